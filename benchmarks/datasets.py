@@ -0,0 +1,165 @@
+import random
+from pathlib import Path
+from typing import Union
+
+# Bytes written at once when creating large files
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def write_random_file(path: Union[Path, str], size: int, rng: random.Random):
+    """
+    Write a file of (incompressible) random bytes
+    """
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            chunk = min(CHUNK_SIZE, remaining)
+            f.write(rng.randbytes(chunk))
+            remaining -= chunk
+
+
+def write_text_file(path: Union[Path, str], size: int, rng: random.Random):
+    """
+    Write a file of (compressible) log-like text
+    """
+    words = ["INFO", "DEBUG", "tile", "cycle", "lane", "read", "ok", "done"]
+    lines = []
+    written = 0
+    while written < size:
+        line = " ".join(rng.choice(words) for _ in range(8)) + "\n"
+        lines.append(line)
+        written += len(line)
+    Path(path).write_text("".join(lines)[:size])
+
+
+def tiny_files(root: Path, scale: float = 1.0, seed: int = 0):
+    """
+    Many tiny files (1-4 KiB), 1000 per directory
+
+    :param root: Directory to create the files in
+    :param scale: Multiplies the number of files (10,000 at scale 1)
+    :param seed: Seed for the file contents
+    """
+    rng = random.Random(seed)
+    n_files = max(int(10000 * scale), 1)
+    for i in range(n_files):
+        directory = root / f"dir_{i // 1000:03d}"
+        if i % 1000 == 0:
+            directory.mkdir(parents=True)
+        write_random_file(
+            directory / f"file_{i:06d}.dat", rng.randint(1024, 4096), rng
+        )
+
+
+def huge_files(root: Path, scale: float = 1.0, seed: int = 0):
+    """
+    A few huge files
+
+    :param root: Directory to create the files in
+    :param scale: Multiplies the size of each file (1 GiB at scale 1)
+    :param seed: Seed for the file contents
+    """
+    rng = random.Random(seed)
+    root.mkdir(parents=True, exist_ok=True)
+    for i in range(3):
+        write_random_file(
+            root / f"huge_{i}.bin", max(int(1024**3 * scale), 1), rng
+        )
+
+
+def deep_nesting(root: Path, scale: float = 1.0, seed: int = 0):
+    """
+    Chains of deeply nested directories, with a small file at every level
+
+    :param root: Directory to create the files in
+    :param scale: Multiplies the number of chains (100 chains, each 30
+    directories deep, at scale 1)
+    :param seed: Seed for the file contents
+    """
+    rng = random.Random(seed)
+    for chain in range(max(int(100 * scale), 1)):
+        directory = root / f"chain_{chain:03d}"
+        for level in range(30):
+            directory = directory / f"level_{level:02d}"
+            directory.mkdir(parents=True)
+            write_random_file(
+                directory / "file.dat", rng.randint(256, 8192), rng
+            )
+
+
+def sequencing_run(root: Path, scale: float = 1.0, seed: int = 0):
+    """
+    The layout of a sequencing run: run metadata, InterOp metrics, base
+    call files per lane & cycle, thumbnails, logs, and large compressed
+    FASTQ files
+
+    :param root: Directory to create the files in
+    :param scale: Multiplies the number of cycles and the size of the
+    FASTQ files (~1 GiB in total at scale 1)
+    :param seed: Seed for the file contents
+    """
+    rng = random.Random(seed)
+    n_cycles = max(int(100 * scale), 1)
+    root.mkdir(parents=True, exist_ok=True)
+    for name in ("RunInfo.xml", "RunParameters.xml"):
+        write_text_file(root / name, 4096, rng)
+
+    interop = root / "InterOp"
+    interop.mkdir()
+    for name in ("ErrorMetrics", "ExtractionMetrics", "TileMetrics"):
+        write_random_file(interop / f"{name}Out.bin", 256 * 1024, rng)
+
+    logs = root / "Logs"
+    logs.mkdir()
+    for i in range(20):
+        write_text_file(logs / f"run_{i:02d}.log", 64 * 1024, rng)
+
+    base_calls = root / "Data" / "Intensities" / "BaseCalls"
+    for lane in range(1, 5):
+        for cycle in range(1, n_cycles + 1):
+            directory = base_calls / f"L00{lane}" / f"C{cycle}.1"
+            directory.mkdir(parents=True)
+            for surface in (1, 2):
+                write_random_file(
+                    directory / f"L00{lane}_{surface}.cbcl",
+                    rng.randint(256, 1024) * 1024,
+                    rng,
+                )
+            write_random_file(directory / "thumbnail.jpg", 16 * 1024, rng)
+
+    fastq = root / "Fastq"
+    fastq.mkdir()
+    for lane in range(1, 5):
+        for read in (1, 2):
+            write_random_file(
+                fastq / f"sample_L00{lane}_R{read}_001.fastq.gz",
+                max(int(32 * 1024**2 * scale), 1),
+                rng,
+            )
+
+
+DATASETS = {
+    "tiny": tiny_files,
+    "huge": huge_files,
+    "deep": deep_nesting,
+    "run": sequencing_run,
+}
+
+
+def create_dataset(
+    name: str, root: Union[Path, str], scale: float = 1.0, seed: int = 0
+) -> Path:
+    """
+    Create a synthetic dataset (the same files for the same name, scale &
+    seed)
+
+    :param name: One of DATASETS
+    :param root: Directory to create (must not exist)
+    :param scale: Multiplies the size of the dataset
+    :param seed: Seed for the file contents
+    :return: The dataset directory
+    """
+    root = Path(root)
+    root.mkdir(parents=True)
+    DATASETS[name](root, scale, seed)
+    return root
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Stand-in for ssh that runs the remote command on this machine, after a
+configurable delay, so the remote code paths (including multiplexed
+connections) can be benchmarked without a remote host.
+
+Install it as "ssh" at the front of PATH (see install_fake_ssh). The delays
+are read from the environment:
+
+SYNCHRO_FAKE_SSH_CONNECT: Seconds to open a new connection (handshake &
+authentication), skipped if a master connection is running
+SYNCHRO_FAKE_SSH_LATENCY: Seconds of round trip latency added to every
+command
+"""
+
+import os
+import sys
+import shlex
+import time
+from pathlib import Path
+from typing import Union
+
+CONNECT_VARIABLE = "SYNCHRO_FAKE_SSH_CONNECT"
+LATENCY_VARIABLE = "SYNCHRO_FAKE_SSH_LATENCY"
+# Options that take a value (from ssh(1))
+OPTIONS_WITH_VALUES = set("BbcDEeFIiJLlmOoPpQRSWw")
+
+
+def parse_args(args: list):
+    """
+    :return: (dict of options, host, remote command)
+    """
+    options = {"o": []}
+    args = list(args)
+    while args and args[0].startswith("-"):
+        arg = args.pop(0)
+        if arg == "--":
+            break
+        flag, value = arg[1], arg[2:]
+        if flag in OPTIONS_WITH_VALUES:
+            if not value:
+                value = args.pop(0)
+            if flag == "o":
+                options["o"].append(value)
+            else:
+                options[flag] = value
+        else:
+            # Grouped flags, e.g. -Nf
+            for flag in arg[1:]:
+                options[flag] = True
+    host = args.pop(0)
+    return options, host, " ".join(args)
+
+
+def ssh_options(options: dict) -> dict:
+    """
+    :return: Dict of the -o options (e.g. ControlPath)
+    """
+    return dict(option.split("=", 1) for option in options["o"])
+
+
+def delay(variable: str):
+    time.sleep(float(os.environ.get(variable, 0)))
+
+
+def main(args: list) -> int:
+    options, _, command = parse_args(args)
+    control_path = ssh_options(options).get("ControlPath")
+    master_running = control_path is not None and Path(control_path).exists()
+
+    if "O" in options:
+        # Control commands for the master connection
+        if options["O"] == "check":
+            return 0 if master_running else 255
+        if options["O"] == "exit" and master_running:
+            Path(control_path).unlink()
+        return 0
+    if ssh_options(options).get("ControlMaster") in ("yes", "auto"):
+        if not master_running:
+            delay(CONNECT_VARIABLE)
+            Path(control_path).touch()
+        if "N" in options:
+            return 0
+        master_running = True
+
+    if not master_running:
+        delay(CONNECT_VARIABLE)
+    delay(LATENCY_VARIABLE)
+    # ssh runs the command with the user's shell on the remote host
+    os.execvp("sh", ["sh", "-c", command])
+
+
+def install_fake_ssh(directory: Union[Path, str]) -> Path:
+    """
+    Make this script available as "ssh" in a directory (to be put at the
+    front of PATH)
+
+    :return: The directory
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    ssh = directory / "ssh"
+    script = shlex.join([sys.executable, str(Path(__file__).resolve())])
+    ssh.write_text(f'#!/bin/sh\nexec {script} "$@"\n')
+    ssh.chmod(0o755)
+    return directory
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,326 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import statistics
+import subprocess
+import tempfile
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from datetime import datetime
+from pathlib import Path
+
+from .datasets import DATASETS, create_dataset
+from .fake_ssh import CONNECT_VARIABLE, LATENCY_VARIABLE, install_fake_ssh
+
+# Config options for each combination of tar & untar that is benchmarked
+# (and the native copy, for local destinations)
+MODES = {
+    "tar+untar": {"tar": "y", "untar": "y"},
+    "tar": {"tar": "y", "untar": "n"},
+    "no-tar": {"tar": "n", "untar": "n"},
+    "stream": {"tar": "y", "untar": "y", "stream": "y"},
+    "native": {"tar": "n", "untar": "n", "local_copy": "copy"},
+}
+# Host name used for remote destinations (with the fake ssh)
+FAKE_HOST = "bench@fakehost"
+# Stages at least this much slower (as a fraction, and in seconds) than the
+# baseline are reported as regressions
+REGRESSION_THRESHOLD = 0.1
+REGRESSION_MIN_SECONDS = 0.1
+
+
+def benchmark_parser():
+    parser = ArgumentParser(
+        prog="python -m benchmarks",
+        description="Time each stage of synchronising synthetic datasets, "
+        "to a local destination, or to a 'remote' destination on this "
+        "machine through a stand-in for ssh with added latency.",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--datasets",
+        nargs="+",
+        choices=sorted(DATASETS),
+        default=sorted(DATASETS),
+        help="Datasets to synchronise",
+    )
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=list(MODES),
+        default=list(MODES),
+        help="Combinations of tar & untar (or the native copy) to "
+        "benchmark",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=0.1,
+        help="Size of the datasets (1 is ~1-3 GiB, or 10,000 tiny files)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Run each benchmark this many times, and report the median",
+    )
+    parser.add_argument(
+        "--remote",
+        action="store_true",
+        help="Synchronise to a 'remote' destination through the fake ssh",
+    )
+    parser.add_argument(
+        "--connect-latency",
+        dest="connect_latency",
+        type=float,
+        default=0.2,
+        help="Seconds for the fake ssh to open a new connection",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.02,
+        help="Seconds of round trip latency added to every fake ssh command",
+    )
+    parser.add_argument(
+        "--work-dir",
+        dest="work_dir",
+        type=Path,
+        default=None,
+        help="Directory for the datasets & destinations (default: a "
+        "temporary directory, removed afterwards). Datasets already in "
+        "the directory are reused.",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help="Save the results to this JSON file",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        default=None,
+        help="Compare with results saved by an earlier run (--output)",
+    )
+    return parser
+
+
+def write_config(config_file, source, destination, mode, work_dir):
+    """
+    Write the config file for a benchmark
+    """
+    options = {
+        "source": source,
+        "destination": destination,
+        "create_dest": "y",
+        **MODES[mode],
+        "metrics_file": work_dir / "metrics.json",
+        "history_file": work_dir / "history.db",
+    }
+    config_file.write_text(
+        "".join(f"{option} = {value}\n" for option, value in options.items())
+    )
+
+
+def reset_source(source):
+    """
+    Remove the files left in the source directory by a synchronisation, so
+    it can be synchronised again
+    """
+    (source / "transfer.done").unlink(missing_ok=True)
+    (source / "synchro.journal").unlink(missing_ok=True)
+    for archive in source.parent.glob(f"{source.name}.tar*"):
+        archive.unlink()
+
+
+def run_once(source, mode, work_dir, remote, env):
+    """
+    Synchronise a dataset (in a separate process, as the synchro command
+    does)
+
+    :return: Dict of total seconds and seconds per stage
+    """
+    reset_source(source)
+    destination = work_dir / "destination"
+    shutil.rmtree(destination, ignore_errors=True)
+    config_file = work_dir / "synchro.conf"
+    write_config(
+        config_file,
+        source,
+        f"{FAKE_HOST}:{destination}" if remote else destination,
+        mode,
+        work_dir,
+    )
+    cmd = [
+        sys.executable,
+        "-m",
+        "synchro.cli",
+        str(config_file),
+        "--no-permission-change",
+        "--log-file",
+        str(work_dir / "synchro.log"),
+    ]
+    start = time.perf_counter()
+    result = subprocess.run(
+        cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    seconds = time.perf_counter() - start
+    if result.returncode:
+        print(result.stderr.decode(errors="replace"), file=sys.stderr)
+        raise subprocess.CalledProcessError(result.returncode, cmd)
+    metrics = json.loads((work_dir / "metrics.json").read_text())
+    shutil.rmtree(destination, ignore_errors=True)
+    return {"seconds": seconds, "stages": metrics["stages"]}
+
+
+def run_benchmark(source, mode, work_dir, remote, env, repeat=1):
+    """
+    :return: Dict of the median total seconds and seconds per stage
+    """
+    runs = [
+        run_once(source, mode, work_dir, remote, env) for _ in range(repeat)
+    ]
+    stages = {
+        stage: statistics.median(run["stages"][stage] or 0 for run in runs)
+        for stage in runs[0]["stages"]
+    }
+    return {
+        "seconds": statistics.median(run["seconds"] for run in runs),
+        "stages": stages,
+    }
+
+
+def dataset_size(directory):
+    n_files, n_bytes = 0, 0
+    for path in Path(directory).rglob("*"):
+        if path.is_file():
+            n_files += 1
+            n_bytes += path.stat().st_size
+    return n_files, n_bytes
+
+
+def environment(args, work_dir):
+    """
+    Environment for the synchro processes: the fake ssh (if benchmarking a
+    remote destination), and synchro from this repository
+    """
+    env = dict(os.environ)
+    repository = str(Path(__file__).resolve().parent.parent)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [repository, env.get("PYTHONPATH")])
+    )
+    if args.remote:
+        fake_ssh = install_fake_ssh(work_dir / "bin")
+        env["PATH"] = f"{fake_ssh}{os.pathsep}{env['PATH']}"
+        env[CONNECT_VARIABLE] = str(args.connect_latency)
+        env[LATENCY_VARIABLE] = str(args.latency)
+    return env
+
+
+def run_benchmarks(args, work_dir):
+    """
+    :return: List of results (one per dataset & mode)
+    """
+    env = environment(args, work_dir)
+    results = []
+    for name in args.datasets:
+        dataset_dir = work_dir / f"{name}_{args.scale}"
+        source = dataset_dir / "source"
+        if not source.exists():
+            print(f"Creating dataset: {name} (scale {args.scale})")
+            create_dataset(name, source, args.scale)
+        n_files, n_bytes = dataset_size(source)
+        for mode in args.modes:
+            print(f"Running: {name}, {mode}")
+            result = run_benchmark(
+                source, mode, dataset_dir, args.remote, env, args.repeat
+            )
+            results.append(
+                {
+                    "dataset": name,
+                    "mode": mode,
+                    "remote": args.remote,
+                    "files": n_files,
+                    "bytes": n_bytes,
+                    **result,
+                }
+            )
+    return results
+
+
+def result_lines(results, baseline=None):
+    """
+    :param results: Results of run_benchmarks
+    :param baseline: Results of an earlier run, to compare with
+    :return: List of lines of the report
+    """
+    baseline = {
+        (result["dataset"], result["mode"], result["remote"]): result
+        for result in baseline or []
+    }
+    lines = []
+    for result in results:
+        throughput = result["bytes"] / result["seconds"] / 1024**2
+        lines.append(
+            f"{result['dataset']:<6} {result['mode']:<10} "
+            f"{'remote' if result['remote'] else 'local':<7} "
+            f"{result['files']:>7} files {result['seconds']:>9.2f}s "
+            f"{throughput:>9.1f} MiB/s"
+        )
+        previous = baseline.get(
+            (result["dataset"], result["mode"], result["remote"])
+        )
+        timings = [("total", result["seconds"])]
+        timings += list(result["stages"].items())
+        for stage, seconds in timings:
+            line = f"    {stage:<24} {seconds:>9.2f}s"
+            if previous is not None:
+                if stage == "total":
+                    before = previous["seconds"]
+                else:
+                    before = previous["stages"].get(stage)
+                if before:
+                    change = seconds / before - 1
+                    line += f" {change:>+8.0%}"
+                    if (
+                        change > REGRESSION_THRESHOLD
+                        and seconds - before > REGRESSION_MIN_SECONDS
+                    ):
+                        line += "  REGRESSION"
+            lines.append(line)
+    return lines
+
+
+def main(argv=None):
+    args = benchmark_parser().parse_args(argv)
+    baseline = None
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text())["results"]
+
+    if args.work_dir is None:
+        with tempfile.TemporaryDirectory(prefix="synchro_bench_") as tmp:
+            results = run_benchmarks(args, Path(tmp))
+    else:
+        args.work_dir.mkdir(parents=True, exist_ok=True)
+        results = run_benchmarks(args, args.work_dir.resolve())
+
+    for line in result_lines(results, baseline):
+        print(line)
+    if args.output is not None:
+        args.output.write_text(
+            json.dumps(
+                {
+                    "date": datetime.now().isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "host": platform.node(),
+                    "scale": args.scale,
+                    "results": results,
+                },
+                indent=2,
+            )
+        )
+    return results
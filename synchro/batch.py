@@ -0,0 +1,401 @@
+import asyncio
+import logging
+import configparser
+
+from collections import Counter, deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    wait,
+)
+from pathlib import Path
+
+from .discover import discover_sources, index_filename, is_source_pattern
+from .sync import run_sychronisation
+from .utils.misc import get_config_obj
+from .utils.options import try_set_boolean_with_default
+from .utils.paths import LOCAL_HOST, Paths
+from .utils.ssh import SSHConnectionError, SSHMaster
+
+
+class SyncJob:
+    """
+    :param config_file: Path to config file
+    :param log_file: File to log to
+    :param change_permissions: Change destination ownership & permissions
+    :param source: Source directory, if the config file has a source
+    pattern matching many directories
+    :param control_path: Control socket of a multiplexed SSH connection to
+    the destination host, opened for the whole batch
+    """
+
+    def __init__(
+        self,
+        config_file,
+        log_file=None,
+        change_permissions=True,
+        source=None,
+        control_path=None,
+    ):
+        self.config_file = Path(config_file)
+        self.log_file = log_file
+        self.change_permissions = change_permissions
+        self.source = source
+        self.control_path = control_path
+        self.host = get_destination_host(self.config_file)
+
+    def __repr__(self):
+        if self.source is not None:
+            return f"SyncJob({self.config_file}, source={self.source})"
+        return f"SyncJob({self.config_file})"
+
+    @property
+    def name(self):
+        """
+        Identifies the job in logs shared with other jobs
+        """
+        if self.source is not None:
+            return f"{self.config_file.stem}:{Path(self.source).name}"
+        return self.config_file.stem
+
+
+class JobScheduler:
+    """
+    Run synchronisation jobs in a pool of worker processes, with a global
+    limit on the number of concurrent jobs, and an optional limit per
+    destination host.
+    """
+
+    def __init__(self, max_workers=4, max_per_host=None):
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+        self.pending = deque()
+        self.running = {}
+        self.host_counts = Counter()
+        self.completed = []
+        self.deferred = []
+        self.failed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def submit(self, job):
+        """
+        Queue a job, and start it if there is capacity
+        """
+        self.pending.append(job)
+        self.dispatch()
+
+    def can_start(self, job):
+        """
+        Check whether starting a job would exceed the global or per-host
+        concurrency limits
+        """
+        if len(self.running) >= self.max_workers:
+            return False
+        if self.max_per_host is not None:
+            if self.host_counts[job.host] >= self.max_per_host:
+                return False
+        return True
+
+    def dispatch(self):
+        """
+        Start as many pending jobs as the concurrency limits allow. Jobs that
+        are blocked by their host limit don't hold up jobs to other hosts.
+        """
+        blocked = deque()
+        while self.pending and len(self.running) < self.max_workers:
+            job = self.pending.popleft()
+            if self.can_start(job):
+                future = self.executor.submit(run_job, job)
+                self.running[future] = job
+                self.host_counts[job.host] += 1
+            else:
+                blocked.append(job)
+        blocked.extend(self.pending)
+        self.pending = blocked
+
+    def wait(self, timeout=None):
+        """
+        Wait for at least one running job to finish (or for the timeout),
+        record the results, and start any jobs that can now run.
+        """
+        if self.running:
+            done, _ = wait(
+                self.running, timeout=timeout, return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                self.finish(future)
+        self.dispatch()
+
+    def finish(self, future):
+        job = self.running.pop(future)
+        self.host_counts[job.host] -= 1
+        error = future.exception()
+        if error is None and future.result():
+            print(f"Synchronisation deferred for: {job.config_file}")
+            self.deferred.append(job)
+        elif error is None:
+            self.completed.append(job)
+        else:
+            print(f"Synchronisation failed for: {job.config_file}: {error}")
+            self.failed.append((job, error))
+
+    def run_until_complete(self):
+        while self.pending or self.running:
+            self.wait()
+
+    def wait_for_running(self):
+        """
+        Wait for the running jobs to finish, without starting any pending
+        jobs (which are dropped)
+        """
+        self.pending.clear()
+        while self.running:
+            self.wait()
+
+    def is_running(self, config_file, source=None):
+        config_file = Path(config_file)
+        jobs = list(self.running.values()) + list(self.pending)
+        return any(
+            job.config_file == config_file and job.source == source
+            for job in jobs
+        )
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def run_job(job):
+    """
+    Run a single synchronisation job in a worker process. Each line logged
+    is prefixed with the job's name, as jobs running at once can log to the
+    same file (and to stdout). Log handlers added by the job are removed
+    afterwards, so that worker processes can be reused for other jobs.
+
+    :return: True if the synchronisation was deferred (e.g. until there is
+    enough space)
+    """
+    logger = logging.getLogger()
+    existing_handlers = list(logger.handlers)
+    try:
+        synchro = run_sychronisation(
+            job.config_file,
+            job.log_file,
+            job.change_permissions,
+            source=job.source,
+            shared_control_path=job.control_path,
+            log_prefix=job.name,
+        )
+    finally:
+        for handler in logger.handlers[:]:
+            if handler not in existing_handlers:
+                logger.removeHandler(handler)
+                handler.close()
+    return synchro.deferred
+
+
+def run_batch(jobs, max_workers=4, max_per_host=None):
+    """
+    Run many synchronisation jobs concurrently
+
+    :param jobs: List of SyncJob objects
+    :param max_workers: Maximum number of concurrent jobs
+    :param max_per_host: Maximum number of concurrent jobs per destination
+    host
+    :return: List of (job, error) tuples for any failed jobs
+    """
+    ssh_masters = open_ssh_connections(jobs)
+    try:
+        with JobScheduler(max_workers, max_per_host) as scheduler:
+            for job in jobs:
+                scheduler.submit(job)
+            scheduler.run_until_complete()
+    finally:
+        for ssh_master in ssh_masters:
+            ssh_master.stop()
+    return scheduler.failed
+
+
+async def run_batch_async(jobs, max_workers=4, max_per_host=None):
+    """
+    Run many synchronisation jobs concurrently from an asyncio event loop
+    (e.g. alongside other tasks of an application). The loop only
+    schedules the jobs: each job runs in a worker process (with its own
+    command engine), rather than in the loop, as logging is set up per
+    process.
+
+    :param jobs: List of SyncJob objects
+    :param max_workers: Maximum number of concurrent jobs
+    :param max_per_host: Maximum number of concurrent jobs per destination
+    host
+    :return: List of (job, error) tuples for any failed jobs
+    """
+    loop = asyncio.get_running_loop()
+    workers = asyncio.Semaphore(max_workers)
+    hosts = {
+        job.host: asyncio.Semaphore(max_per_host or max_workers)
+        for job in jobs
+    }
+    failed = []
+
+    async def run(job):
+        # Wait for the host first, so jobs to a busy host don't hold up
+        # jobs to other hosts
+        async with hosts[job.host], workers:
+            try:
+                deferred = await loop.run_in_executor(executor, run_job, job)
+            except Exception as error:
+                print(
+                    f"Synchronisation failed for: {job.config_file}: {error}"
+                )
+                failed.append((job, error))
+                return
+            if deferred:
+                print(f"Synchronisation deferred for: {job.config_file}")
+
+    ssh_masters = await asyncio.to_thread(open_ssh_connections, jobs)
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            await asyncio.gather(*[run(job) for job in jobs])
+    finally:
+        for ssh_master in ssh_masters:
+            await asyncio.to_thread(ssh_master.stop)
+    return failed
+
+
+def open_ssh_connections(jobs):
+    """
+    Open one multiplexed SSH connection per remote host, to be shared by
+    all the jobs (in all worker processes) for the whole batch. Each job is
+    given the control path of the connection to its host. If a connection
+    can't be opened, the jobs to that host open their own.
+
+    :param jobs: List of SyncJob objects
+    :return: List of SSHMaster objects
+    """
+    remote_hosts = sorted(
+        {job.host for job in jobs if job.host not in (None, LOCAL_HOST)}
+    )
+    ssh_masters = []
+    for remote_host in remote_hosts:
+        ssh_master = open_ssh_connection(remote_host)
+        if ssh_master is not None:
+            ssh_masters.append(ssh_master)
+    share_ssh_connections(jobs, ssh_masters)
+    return ssh_masters
+
+
+def open_ssh_connection(remote_host):
+    """
+    Open a multiplexed SSH connection to a remote host
+
+    :param remote_host: user@remote, needs ssh keys set up
+    :return: SSHMaster object, or None if the connection can't be opened
+    """
+    ssh_master = SSHMaster(remote_host)
+    try:
+        ssh_master.start()
+    except SSHConnectionError as error:
+        print(error)
+        return None
+    return ssh_master
+
+
+def share_ssh_connections(jobs, ssh_masters):
+    """
+    Give each job the control path of the connection to its host (if any)
+    """
+    control_paths = {
+        ssh_master.remote_host: ssh_master.control_path
+        for ssh_master in ssh_masters
+    }
+    for job in jobs:
+        job.control_path = control_paths.get(job.host)
+
+
+def find_config_files(paths, pattern="*.conf"):
+    """
+    Expand a list of config files and/or directories of config files
+
+    :param paths: Paths to config files, or directories containing them
+    :param pattern: Glob pattern used to find config files in directories
+    :return: List of config files
+    """
+    config_files = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            config_files.extend(sorted(path.glob(pattern)))
+        else:
+            config_files.append(path)
+    return config_files
+
+
+def create_jobs(config_files, log_file=None, change_permissions=True):
+    """
+    Create a job for each config file. Config files with a source pattern
+    (e.g. "source = /data/runs/*") create one job for each matching
+    directory that has not yet been synchronised.
+
+    :param config_files: List of config files
+    :param log_file: File to log to
+    :param change_permissions: Change destination ownership & permissions
+    :return: List of SyncJob objects
+    """
+    jobs = []
+    for config_file in config_files:
+        for source in find_sources(config_file):
+            jobs.append(
+                SyncJob(config_file, log_file, change_permissions, source)
+            )
+    return jobs
+
+
+def find_sources(config_file):
+    """
+    Find the source directories of a config file that need to be
+    synchronised
+
+    :param config_file: Path to config file
+    :return: List of source directories, or [None] if the config file has
+    a single source directory
+    """
+    try:
+        config = get_config_obj(config_file)
+    except (OSError, configparser.Error):
+        # Fails (and is reported) when the job runs
+        return [None]
+    source = Paths.set_source_directory(config)
+    if not is_source_pattern(source):
+        return [None]
+    incremental = try_set_boolean_with_default(
+        config, False, "incremental", warn_if_missing=False
+    )
+    return discover_sources(source, index_filename(config_file), incremental)
+
+
+def get_destination_host(config_file):
+    """
+    Get the host that a config file will transfer data to. Local transfers
+    all share a single host.
+
+    :param config_file: Path to config file
+    :return: Remote host address, "localhost", or None if the config
+    cannot be read
+    """
+    try:
+        config = get_config_obj(config_file)
+    except (OSError, configparser.Error):
+        return None
+    destination_directory = Paths.set_destination_directory(config)
+    if destination_directory is None:
+        return None
+    _, remote_host, remote_destination = Paths.check_remote_dest(
+        destination_directory
+    )
+    return remote_host if remote_destination else LOCAL_HOST
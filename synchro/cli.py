@@ -3,8 +3,14 @@ from argparse import (
     ArgumentDefaultsHelpFormatter,
 )
 
+import sys
 from pathlib import Path
 from synchro.sync import run_sychronisation
+from synchro.batch import create_jobs, find_config_files, run_batch
+from synchro.watch import Watcher
+from synchro.plan import plan_config_file
+from synchro.report import report_lines
+from synchro.utils.history import PERIODS, default_history_file
 
 
 def cli_parser():
@@ -12,11 +18,121 @@ def cli_parser():
     parser.add_argument_group("Synchro options")
 
     parser.add_argument(
-        dest="config_file",
+        dest="config_files",
         type=Path,
-        default="synchro.conf",
-        help="Name of the config file",
+        nargs="+",
+        help="Config file(s), or directories containing '.conf' files",
+    )
+    add_common_arguments(parser)
+    return parser
+
+
+def watch_parser():
+    parser = ArgumentParser(
+        prog="synchro watch",
+        description="Watch config files, and start each synchronisation "
+        "as soon as its source is ready.",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        dest="config_files",
+        type=Path,
+        nargs="+",
+        help="Config file(s), or directories containing '.conf' files "
+        "(which are checked for new config files)",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        dest="poll_interval",
+        type=float,
+        default=60,
+        help="Seconds between checks of every config. Changes to source "
+        "directories are detected immediately if inotify_simple is "
+        "installed.",
+    )
+    parser.add_argument(
+        "--no-inotify",
+        dest="use_inotify",
+        action="store_false",
+        help="Only poll, even if inotify_simple is installed (e.g. for "
+        "network filesystems).",
+    )
+    add_common_arguments(parser)
+    return parser
+
+
+def plan_parser():
+    parser = ArgumentParser(
+        prog="synchro plan",
+        description="Describe what the synchronisation of each config "
+        "would do, and estimate how long it would take, without changing "
+        "anything.",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        dest="config_files",
+        type=Path,
+        nargs="+",
+        help="Config file(s), or directories containing '.conf' files",
+    )
+    parser.add_argument(
+        "--threads",
+        dest="threads",
+        type=int,
+        default=8,
+        help="Number of directories to scan at once",
+    )
+    parser.add_argument(
+        "--largest",
+        dest="largest",
+        type=int,
+        default=10,
+        help="Number of the largest files to list",
+    )
+    return parser
+
+
+def report_parser():
+    parser = ArgumentParser(
+        prog="synchro report",
+        description="Summarise previous synchronisations: throughput to "
+        "each destination host over time, the slowest stages, and failure "
+        "rates.",
+        formatter_class=ArgumentDefaultsHelpFormatter,
     )
+    parser.add_argument(
+        "--history-file",
+        dest="history_file",
+        type=Path,
+        default=default_history_file(),
+        help="Run history database (as set by 'history_file' in the config "
+        "files)",
+    )
+    parser.add_argument(
+        "--period",
+        dest="period",
+        choices=sorted(PERIODS),
+        default="day",
+        help="Period to group throughput by",
+    )
+    parser.add_argument(
+        "--stages",
+        dest="stages",
+        type=int,
+        default=10,
+        help="Number of the slowest stages to list",
+    )
+    parser.add_argument(
+        "--host",
+        dest="host",
+        default=None,
+        help="Only report synchronisations to this destination host "
+        "('localhost' for local destinations)",
+    )
+    return parser
+
+
+def add_common_arguments(parser):
     parser.add_argument(
         "-l",
         "--log-file",
@@ -32,15 +148,83 @@ def cli_parser():
         help="Don't change permissions or ownership of destination files. "
         "Useful for debugging or if not running as root.",
     )
-
-    return parser
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=4,
+        help="Maximum number of synchronisations to run at once, "
+        "if multiple config files are given.",
+    )
+    parser.add_argument(
+        "--jobs-per-host",
+        dest="jobs_per_host",
+        type=int,
+        default=None,
+        help="Maximum number of synchronisations to run at once to any "
+        "single destination host. Defaults to no per-host limit.",
+    )
 
 
 def main():
+    if sys.argv[1:2] == ["watch"]:
+        watch(watch_parser().parse_args(sys.argv[2:]))
+        return
+    if sys.argv[1:2] == ["plan"]:
+        plan(plan_parser().parse_args(sys.argv[2:]))
+        return
+    if sys.argv[1:2] == ["report"]:
+        report(report_parser().parse_args(sys.argv[2:]))
+        return
+
     args = cli_parser().parse_args()
-    run_sychronisation(
-        args.config_file, args.log_file, args.change_permissions
+    config_files = find_config_files(args.config_files)
+    jobs = create_jobs(config_files, args.log_file, args.change_permissions)
+    if not jobs:
+        print("No source directories to synchronise")
+    elif len(jobs) == 1:
+        run_sychronisation(
+            jobs[0].config_file,
+            jobs[0].log_file,
+            jobs[0].change_permissions,
+            source=jobs[0].source,
+        )
+    else:
+        failed = run_batch(jobs, args.jobs, args.jobs_per_host)
+        if failed:
+            sys.exit(1)
+
+
+def watch(args):
+    watcher = Watcher(
+        args.config_files,
+        poll_interval=args.poll_interval,
+        max_workers=args.jobs,
+        max_per_host=args.jobs_per_host,
+        log_file=args.log_file,
+        change_permissions=args.change_permissions,
+        use_inotify=args.use_inotify,
     )
+    watcher.run()
+
+
+def plan(args):
+    for i, config_file in enumerate(find_config_files(args.config_files)):
+        if i:
+            print()
+        for line in plan_config_file(config_file, args.threads, args.largest):
+            print(line)
+
+
+def report(args):
+    if not args.history_file.exists():
+        print(f"No run history found at {args.history_file}")
+        return
+    for line in report_lines(
+        args.history_file, args.period, args.stages, args.host
+    ):
+        print(line)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+import os
+import json
+import fnmatch
+
+from pathlib import Path
+from typing import Union
+
+# Characters that make a source a pattern (as used by glob)
+PATTERN_CHARACTERS = ("*", "?", "[")
+
+DONE = "done"
+PENDING = "pending"
+
+
+def is_source_pattern(source: Union[Path, str, None]) -> bool:
+    """
+    Check whether a source (from a config file) is a pattern matching many
+    source directories (e.g. "/data/runs/*"), rather than a directory
+    """
+    if source is None:
+        return False
+    return any(character in str(source) for character in PATTERN_CHARACTERS)
+
+
+def index_filename(config_file: Union[Path, str]) -> Path:
+    """
+    The index of source directories matched by a config file is saved
+    alongside it, e.g. "runs.conf.index"
+    """
+    config_file = Path(config_file)
+    return config_file.with_name(config_file.name + ".index")
+
+
+def load_index(filename: Union[Path, str]) -> dict:
+    """
+    :return: Dict of source directory: "done" or "pending"
+    """
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_index(index: dict, filename: Union[Path, str]):
+    """
+    Save the index, replacing it atomically so that an interrupted save
+    leaves the previous index intact
+    """
+    filename = Path(filename)
+    temp_filename = filename.with_name(filename.name + ".tmp")
+    with open(temp_filename, "w") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(temp_filename, filename)
+
+
+def match_directories(pattern: Union[Path, str]) -> list[str]:
+    """
+    Find the directories matching a pattern (e.g. "/data/runs/*" or
+    "/data/*/run_*"). Each directory in the pattern is listed once with
+    os.scandir, and the type of each entry is read from the directory
+    listing, so no files are opened or stat-ed.
+
+    :param pattern: Pattern, with glob wildcards in any component
+    :return: Sorted list of matching directories
+    """
+    parts = Path(pattern).parts
+    base = []
+    for part in parts:
+        if is_source_pattern(part):
+            break
+        base.append(part)
+    directories = [os.path.join(*base)] if base else [os.curdir]
+
+    n_base = len(base)
+    for part in parts[n_base:]:
+        matches = []
+        for directory in directories:
+            if not is_source_pattern(part):
+                candidate = os.path.join(directory, part)
+                if os.path.isdir(candidate):
+                    matches.append(candidate)
+                continue
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if (
+                            fnmatch.fnmatchcase(entry.name, part)
+                            and not entry.name.startswith(".")
+                            and entry.is_dir()
+                        ):
+                            matches.append(entry.path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+        directories = matches
+    return sorted(directories)
+
+
+def discover_sources(
+    pattern: Union[Path, str],
+    index_file: Union[Path, str],
+    incremental: bool = False,
+) -> list[Path]:
+    """
+    Find the source directories matching a pattern that still need to be
+    synchronised. Directories are done once they contain a "transfer.done"
+    file, and are then recorded as such in the index. If the file is
+    removed (to synchronise the directory again), the directory is pending
+    again. Directories that no longer exist are removed from the index.
+
+    :param pattern: Pattern (e.g. "/data/runs/*")
+    :param index_file: Where the index is saved
+    :param incremental: Incremental transfers are never done, so every
+    matching directory is returned
+    :return: Source directories to synchronise
+    """
+    previous = load_index(index_file)
+    index = {}
+    pending = []
+    for directory in match_directories(pattern):
+        state = previous.get(directory, PENDING)
+        if not incremental:
+            done = os.path.exists(os.path.join(directory, "transfer.done"))
+            state = DONE if done else PENDING
+        index[directory] = state
+        if state == PENDING or incremental:
+            pending.append(Path(directory))
+
+    if index != previous:
+        save_index(index, index_file)
+    return pending
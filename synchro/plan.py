@@ -0,0 +1,245 @@
+import heapq
+
+from datetime import timedelta
+
+from .sync import Synchronise
+from .discover import is_source_pattern, match_directories
+from .utils.misc import get_config_obj
+from .utils.paths import Paths
+from .utils.history import estimate_throughput
+from .utils.space import with_margin
+from .utils.volumes import volume_name
+
+# Upper edges of the size histogram bins
+HISTOGRAM_EDGES = [1024 * 16**i for i in range(8)]
+
+
+def format_size(n_bytes):
+    """
+    :return: Size in human readable units (e.g. "1.5 GiB")
+    """
+    size = float(n_bytes)
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+        if size < 1024 or unit == "TiB":
+            break
+        size /= 1024
+    if unit == "B":
+        return f"{n_bytes} B"
+    return f"{size:.1f} {unit}"
+
+
+def size_histogram(entries):
+    """
+    Count the files (and their total size) in bins of increasing size
+
+    :param entries: Scanned files & directories
+    :return: List of (upper edge (or None for the last bin), files, bytes)
+    """
+    counts = [0] * (len(HISTOGRAM_EDGES) + 1)
+    sizes = [0] * (len(HISTOGRAM_EDGES) + 1)
+    for entry in entries:
+        if entry.is_dir:
+            continue
+        i = 0
+        while i < len(HISTOGRAM_EDGES) and entry.size >= HISTOGRAM_EDGES[i]:
+            i += 1
+        counts[i] += 1
+        sizes[i] += entry.size
+    edges = HISTOGRAM_EDGES + [None]
+    return list(zip(edges, counts, sizes))
+
+
+def plan_config_file(config_file, threads=8, n_largest=10):
+    """
+    Plan the synchronisation of a config file. A config file with a source
+    pattern is planned for every matching directory (whether or not it has
+    already been synchronised, as the index is not updated).
+
+    :return: List of lines of the report
+    """
+    source = Paths.set_source_directory(get_config_obj(config_file))
+    if not is_source_pattern(source):
+        return plan_synchronisation(config_file, None, threads, n_largest)
+
+    lines = []
+    for directory in match_directories(source):
+        if lines:
+            lines.append("")
+        lines += plan_synchronisation(
+            config_file, directory, threads, n_largest
+        )
+    if not lines:
+        lines.append(f"No source directories match {source}")
+    return lines
+
+
+def plan_synchronisation(config_file, source=None, threads=8, n_largest=10):
+    """
+    Describe what a synchronisation would do, and estimate how long it
+    would take, without running anything
+
+    :param config_file: Path to config file
+    :param source: Source directory, if the config file has a source
+    pattern matching many directories
+    :param threads: Number of directories to scan at once
+    :param n_largest: Number of the largest files to list
+    :return: List of lines of the report
+    """
+    synchro = Synchronise(
+        config_file, None, source=source, dry_run=True, scan_threads=threads
+    )
+    entries = synchro.files_to_transfer()
+    files = [entry for entry in entries if not entry.is_dir]
+    total_size = sum(entry.size for entry in files)
+
+    lines = [
+        f"Plan for: {config_file}",
+        f"Source: {synchro.paths.source_directory}",
+        f"Destination: {synchro.paths.destination_directory}",
+        f"Ready to run: {'yes' if synchro.sync_ready else 'no'}",
+        f"Files: {len(files)}",
+        f"Directories: {len(entries) - len(files)}",
+        f"Total size: {format_size(total_size)}",
+        "",
+        "File sizes:",
+    ]
+    lower = 0
+    for edge, count, size in size_histogram(entries):
+        label = (
+            f"{format_size(lower)} - {format_size(edge)}"
+            if edge is not None
+            else f">= {format_size(lower)}"
+        )
+        if count:
+            lines.append(
+                f"  {label:<24} {count:>10} files {format_size(size):>12}"
+            )
+        lower = edge
+
+    lines += ["", f"Largest {n_largest} files:"]
+    for entry in heapq.nlargest(n_largest, files, key=lambda e: e.size):
+        lines.append(f"  {format_size(entry.size):>12}  {entry.path}")
+
+    lines += ["", *space_lines(synchro)]
+    lines += ["", "Commands:", *command_lines(synchro)]
+    lines += ["", duration_line(synchro, total_size)]
+    return lines
+
+
+def space_lines(synchro):
+    """
+    Describe the space needed for the tar archive and at the destination
+    (as checked before the synchronisation if space_check is set)
+    """
+    scratch_needed, destination_needed = synchro.space_needed()
+    scratch_free, destination_free = synchro.free_space()
+    compressed = " (less if compressed)" if synchro.codec is not None else ""
+    archive_directory = synchro.paths.tar_archive.parent
+
+    if not synchro.options.tar or synchro.options.stream:
+        lines = ["Scratch space: none (no tar archive is written)"]
+    else:
+        if synchro.options.volume_size is not None:
+            lines = [
+                f"Scratch space for the archive volumes: at most "
+                f"{format_size(scratch_needed)}{compressed}, at "
+                f"{volume_name(synchro.paths.tar_archive, 0)} etc."
+            ]
+        else:
+            lines = [
+                f"Scratch space for the tar archive: "
+                f"{format_size(scratch_needed)}{compressed}, at "
+                f"{synchro.paths.tar_archive}"
+            ]
+        lines.append(
+            f"  Free space in {archive_directory}: {format_size(scratch_free)}"
+        )
+        if scratch_free < with_margin(scratch_needed):
+            lines.append("  WARNING: not enough space for the tar archive")
+
+    lines.append(
+        f"Space needed at the destination: "
+        f"{format_size(destination_needed)}"
+    )
+    if destination_free is not None:
+        lines.append(
+            f"  Free space at {synchro.paths.destination_directory}: "
+            f"{format_size(destination_free)}"
+        )
+        if destination_free < with_margin(destination_needed):
+            lines.append("  WARNING: not enough space at the destination")
+    return lines
+
+
+def command_lines(synchro):
+    """
+    The commands that the synchronisation would run
+    """
+    commands = [
+        (f"rsync large files {i}", large_string)
+        for i, large_string in enumerate(synchro.rsync_large_strings or [])
+    ]
+    commands += [
+        ("tar", synchro.tar_string),
+        ("rsync", synchro.rsync_string),
+        ("untar", synchro.untar_string),
+        ("delete destination tar", synchro.delete_destination_tarball_string),
+    ]
+    if synchro.extract_volumes_string is not None:
+        volume = volume_name(synchro.paths.tar_archive, 0)
+        commands += [
+            ("clear old volumes", synchro.clear_volumes_string),
+            ("extract volumes", synchro.extract_volumes_string),
+            ("rsync each volume", synchro.volume_rsync_string(volume)),
+        ]
+    if synchro.native_copy:
+        commands.append(
+            (
+                "copy",
+                f"native {synchro.options.local_copy} of "
+                f"{synchro.paths.source_directory}/ to "
+                f"{synchro.paths.destination_directory} "
+                f"({synchro.options.local_copy_threads} files at once)",
+            )
+        )
+    if synchro.stream_strings is not None:
+        stream = " | ".join(" ".join(cmd) for cmd in synchro.stream_strings)
+        commands.append(("stream", stream))
+    for i, shard_string in enumerate(synchro.rsync_shard_strings or []):
+        commands.append((f"rsync shard {i}", shard_string))
+    if synchro.rsync_directories_string is not None:
+        commands.append(
+            ("rsync directories", synchro.rsync_directories_string)
+        )
+    if synchro.remote_post_sync_string is not None:
+        commands.append(
+            ("remote post-transfer", synchro.remote_post_sync_string)
+        )
+    elif synchro.change_permissions:
+        commands.append(("chown", synchro.change_ownership_string))
+        commands.append(("chmod", synchro.change_permission_string))
+
+    lines = []
+    for name, command in commands:
+        if command:
+            if not isinstance(command, str):
+                command = " ".join(str(part) for part in command)
+            lines.append(f"  {name}: {command}")
+    return lines
+
+
+def duration_line(synchro, total_size):
+    """
+    Estimate the duration from the throughput of previous synchronisations
+    to the same host
+    """
+    host = synchro.paths.destination_host
+    throughput = estimate_throughput(host, synchro.options.history_file)
+    if throughput is None:
+        return f"Estimated duration: unknown (no previous transfers to {host})"
+    seconds = round(total_size / throughput)
+    return (
+        f"Estimated duration: {timedelta(seconds=seconds)} "
+        f"(at {format_size(throughput)}/s, from previous transfers to "
+        f"{host})"
+    )
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+from .plan import format_size
+from .utils.history import failure_rates, slowest_stages, throughput_by_host
+
+
+def format_time(timestamp):
+    if timestamp is None:
+        return "-"
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+
+
+def format_duration(seconds):
+    return str(timedelta(seconds=round(seconds)))
+
+
+def report_lines(history_file=None, period="day", n_stages=10, host=None):
+    """
+    Summarise the run history: the throughput to each destination host
+    over time, the slowest stages, and how often synchronisations fail
+
+    :param history_file: Run history database
+    :param period: Group throughput by "day", "week" or "month"
+    :param n_stages: Number of the slowest stages to list
+    :param host: Only report synchronisations to this host
+    :return: List of lines of the report
+    """
+    lines = [f"Throughput per destination host (per {period}):"]
+    rows = throughput_by_host(history_file, period, host)
+    for row in rows:
+        throughput = (
+            f"{format_size(row['throughput'])}/s"
+            if row["throughput"] is not None
+            else "-"
+        )
+        lines.append(
+            f"  {row['host']:<24} {row['period']:<10} {row['runs']:>5} runs "
+            f"{format_size(row['bytes'] or 0):>12} {throughput:>14}"
+        )
+    if not rows:
+        lines.append("  No successful synchronisations")
+
+    lines += ["", f"Slowest {n_stages} stages:"]
+    rows = slowest_stages(history_file, n_stages, host)
+    for row in rows:
+        lines.append(
+            f"  {format_duration(row['seconds']):>10}  {row['stage']:<18} "
+            f"{format_time(row['started'])}  {row['host']}  {row['source']}"
+        )
+    if not rows:
+        lines.append("  No stages recorded")
+
+    lines += ["", "Failures per destination host:"]
+    rows = failure_rates(history_file, host)
+    for row in rows:
+        lines.append(
+            f"  {row['host']:<24} {row['failures']:>5}/{row['runs']:<5} "
+            f"failed ({row['rate']:.0%}), last failure: "
+            f"{format_time(row['last_failure'])}"
+        )
+    if not rows:
+        lines.append("  No synchronisations recorded")
+    return lines
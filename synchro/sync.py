@@ -1,17 +1,83 @@
+import uuid
+import shlex
+import shutil
 import logging
+import sqlite3
+import tempfile
+import subprocess
+import contextvars
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from functools import partial
+from pathlib import Path
 
-from .utils.logging import initalise_logger, write_log_header, write_log_footer
+from .utils.logging import (
+    OUTPUT_LOGGER,
+    initalise_logger,
+    initalise_queue_logger,
+    stop_queue_logger,
+    write_log_header,
+    write_log_footer,
+)
 from .utils.misc import (
     get_config_obj,
     execute_and_log,
+    execute_and_yield_output,
+    execute_concurrently_and_log,
+    execute_pipeline_and_log,
+    execute_remote_steps_and_log,
     check_remote_dir_exists,
 )
 
 from .utils import create_cmd
+from .utils.bandwidth import BandwidthSchedule, lowest_limit
+from .utils.engine import command_timeout, effective_timeout, stage_deadline
+from .utils.fastcopy import FastCopy
+from .utils.compression import (
+    SKIP_THRESHOLD,
+    get_codec,
+    incompressible_fraction,
+)
+from .utils.journal import Journal, source_fingerprint
+from .utils.manifest import changed_entries, load_manifest, save_manifest
+from .utils.metrics import TransferMetrics
 from .utils.options import Options
 from .utils.paths import Paths
+from .utils.history import record_run
+from .utils.scan import scan_directory, scan_directory_parallel
+from .utils.space import (
+    SCAN_THREADS,
+    local_free_space,
+    remote_free_space,
+    same_filesystem,
+    tar_archive_size,
+    with_margin,
+)
+from .utils.shard import balance_shards, write_file_list
+from .utils.ssh import SSHConnectionError, SSHMaster, rsync_ssh_options
+from .utils.throttle import throttle_command
+from .utils.tracing import Tracer, profile
+from .utils.verify import (
+    compare_checksums,
+    hash_files,
+    hash_files_with_command,
+    hashable_files,
+    parse_checksum_line,
+    remote_hash_command,
+    write_checksum_file,
+)
+from .utils.volumes import (
+    MAX_PENDING,
+    clear_volumes_script,
+    done_marker,
+    end_marker,
+    extract_volumes_script,
+    remove_volumes,
+    transfer_volumes,
+    volume_name,
+)
 
 
 class ConfigFileError(Exception):
@@ -26,6 +92,14 @@ class DestinationDirectoryError(Exception):
     pass
 
 
+class VerificationError(Exception):
+    pass
+
+
+class InsufficientSpaceError(Exception):
+    pass
+
+
 class Synchronise:
     def __init__(
         self,
@@ -44,11 +118,33 @@ class Synchronise:
         exclude_log_file=True,
         change_permissions=True,
         permissions="770",
+        stream=False,
+        rsync_shards=1,
+        ssh_multiplex=True,
+        compression="none",
+        compression_level=None,
+        incremental=False,
+        verify=False,
+        source=None,
+        dry_run=False,
+        scan_threads=1,
+        span_hooks=None,
+        shared_control_path=None,
+        log_prefix=None,
     ):
         self.start_time = datetime.now()
         self.sync_ready = False
         self.config_file = config_file
+        self.dry_run = dry_run
+        self.scan_threads = scan_threads
+        self.tracer = Tracer()
+        for hook in span_hooks or []:
+            self.tracer.add_hook(hook)
+        self.resumed = False
+        self.deferred = False
+        self.native_copy = False
         self.log_level = log_level
+        self.log_prefix = log_prefix
         self.rsync_flags = rsync_flags
         self.tar_flags = tar_flags
         self.flags = untar_flags
@@ -66,14 +162,41 @@ class Synchronise:
         self.untar_string = None
         self.delete_destination_tarball_string = None
         self.rsync_string = None
+        self.stream_strings = None
+        self.rsync_shard_strings = None
+        self.rsync_large_strings = None
+        self.extract_volumes_string = None
+        self.clear_volumes_string = None
+        self.end_volumes_string = None
+        self.rsync_directories_string = None
+        self.file_list_directory = None
+        self.file_lists = {}
+        self.remote_post_sync_steps = None
+        self.remote_post_sync_string = None
+        self.ssh_master = None
+        self.shared_control_path = shared_control_path
+        self.control_path = None
+        self.log_listener = None
+        self.journal = None
+        self.codec = None
         self.change_ownership_string = []
         self.change_permission_string = []
 
         self.files_to_sync = []
+        self.scanned_source_entries = None
+        self.changed_files = None
+        self.hash_executor = None
+        self.source_checksums = None
 
-        self.read_config()
-        self.paths = Paths(self.config, log_filename)
-        self.check_source_directory()
+        with self.tracer.span("read_config", config=self.config_file):
+            self.read_config()
+        with self.tracer.span("paths") as span:
+            if source is not None:
+                self.set_source(source)
+            self.paths = Paths(self.config, log_filename)
+            span.attributes["source"] = self.paths.source_directory
+            span.attributes["destination"] = self.paths.destination_directory
+            self.check_source_directory()
         self.options = Options(
             self.config,
             create_dest,
@@ -82,13 +205,172 @@ class Synchronise:
             permissions,
             delete_source_tar,
             delete_destination_tar,
+            stream=stream,
+            rsync_shards=rsync_shards,
+            ssh_multiplex=ssh_multiplex,
+            compression=compression,
+            compression_level=compression_level,
+            incremental=incremental,
+            verify=verify,
         )
-        self.check_sync_ready()
+        self.tracer.trace_file = self.options.trace_file
+        self.native_copy = self.use_native_copy()
+        self.metrics = self.create_metrics()
+        if self.dry_run:
+            with self.tracer.span("check_sync_ready"):
+                self.check_sync_ready()
+            self.prep_dry_run()
+            return
+
+        try:
+            with self.tracer.span("check_sync_ready"):
+                self.check_sync_ready()
+            if self.sync_ready:
+                self.prepare()
+        except Exception:
+            # e.g. the ssh connection or the destination check failed
+            self.metrics.finish("failed")
+            self.record_run("failed")
+            raise
 
+    def prepare(self):
+        """
+        Connect to the destination, and create the commands for the
+        synchronisation (unless it is deferred, e.g. for lack of space)
+        """
+        self.open_ssh_connection()
+        try:
+            if self.options.resume:
+                self.open_journal()
+            if self.options.space_check is not None:
+                self.check_space()
+            if self.sync_ready:
+                with self.tracer.span("prep_sync"):
+                    self.prep_sync()
+        except Exception:
+            self.close_ssh_connection()
+            raise
         if self.sync_ready:
-            self.prep_sync()
             self.setup_logging()
             self.write_log_header()
+        else:
+            self.close_ssh_connection()
+
+    def prep_dry_run(self):
+        """
+        Create the commands for the synchronisation, without changing
+        anything (e.g. creating the destination, or starting to log)
+        """
+        if self.options.resume:
+            self.open_journal()
+        self.prep_sync()
+
+    def notify(self, message):
+        """
+        Report why the synchronisation is (or isn't) going ahead. When only
+        planning (dry run), this is logged, so it doesn't clutter the plan.
+        """
+        if self.dry_run:
+            logging.info(message)
+        else:
+            print(message)
+
+    def use_native_copy(self):
+        """
+        Decide whether to copy the files natively (see local_copy), rather
+        than with tar & rsync. This is only possible for a local
+        destination, if the files (rather than an archive) are to be left
+        there. The archive & rsync options don't apply to a native copy.
+        """
+        if self.options.local_copy == "rsync":
+            return False
+        if self.paths.remote_destination:
+            self.notify(
+                "Option to copy natively, but the destination is remote. "
+                "Defaulting to rsync."
+            )
+            return False
+        if self.options.tar and not self.options.untar:
+            self.notify(
+                "Option to copy natively, but the tar archive is to be kept "
+                "at the destination (not untar). Defaulting to rsync."
+            )
+            return False
+        if self.options.local_copy == "hardlink" and self.change_permissions:
+            # Changing the ownership & permissions of a hardlink changes
+            # the source file too
+            self.notify(
+                "Option to hardlink files, but also change ownership & "
+                "permissions. Defaulting to copying files."
+            )
+            self.options.local_copy = "copy"
+
+        options = self.options
+        options.tar = options.untar = options.stream = False
+        options.delete_source_tar = options.delete_destination_tar = False
+        options.hybrid_threshold = options.volume_size = None
+        options.rsync_shards = 1
+        options.compression = "none"
+        return True
+
+    def create_metrics(self):
+        """
+        Set up the collection of transfer metrics. If they are to be written
+        to a file, rsync reports progress for the whole transfer, rather
+        than for each file.
+        """
+        if (
+            self.options.metrics_file is not None
+            or self.options.prometheus_file is not None
+        ):
+            self.rsync_flags = [*self.rsync_flags, "--info=progress2"]
+        return TransferMetrics(
+            labels={
+                "config": str(self.config_file),
+                "source": str(self.paths.source_directory),
+                "destination": str(self.paths.destination_directory),
+            },
+            json_file=self.options.metrics_file,
+            prometheus_file=self.options.prometheus_file,
+            cumulative_progress="--info=progress2" in self.rsync_flags,
+        )
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Run a stage of the synchronisation (e.g. tar, rsync), recording how
+        long it takes, and the bytes and files transferred
+        """
+        bytes_before = self.metrics.bytes_transferred
+        files_before = self.metrics.files
+        with self.metrics.stage(name), self.tracer.span(name) as span:
+            yield
+            span.attributes["bytes"] = (
+                self.metrics.bytes_transferred - bytes_before
+            )
+            span.attributes["files"] = self.metrics.files - files_before
+
+    def run_stage(self, name, function):
+        """
+        Run a stage of the synchronisation, unless it was completed by an
+        earlier (interrupted) run, and record its completion in the journal
+
+        :param name: Name of the stage (e.g. "tar")
+        :param function: Function that runs the stage
+        """
+        if self.journal is not None:
+            if self.journal.is_completed(name):
+                logging.info(f"Skipping stage completed earlier: {name}")
+                return
+            self.journal.start(name)
+        timeouts = self.options.stage_timeouts
+        with (
+            self.stage(name),
+            stage_deadline(timeouts.get(name, timeouts.get(None))),
+        ):
+            function()
+        if self.journal is not None:
+            self.journal.complete(name)
 
     def check_sync_ready(self):
         """
@@ -101,14 +383,18 @@ class Synchronise:
             self.abort()
             self.sync_ready = False
         else:
-            if not self.check_transfer_done_file():
+            if self.options.incremental:
+                self.transfer_check_ready_file()
+                if self.sync_ready:
+                    self.check_incremental_changes()
+            elif not self.check_transfer_done_file():
                 self.transfer_check_ready_file()
             else:
-                print("Transfer done file exists")
+                self.notify("Transfer done file exists")
                 self.sync_ready = False
 
         if not self.sync_ready:
-            print("Not running synchronisation")
+            self.notify("Not running synchronisation")
 
     def check_transfer_done_file(self):
         """
@@ -117,6 +403,259 @@ class Synchronise:
         """
         return self.paths.transfer_done_file.exists()
 
+    def check_incremental_changes(self):
+        """
+        Compare the source directory with the manifest saved by the last
+        successful transfer, so only new or changed files are transferred.
+        If there is no manifest, all files are transferred.
+        """
+        previous = load_manifest(self.paths.manifest_file)
+        if previous is None:
+            self.notify("No previous manifest found, transferring all files")
+            return
+
+        self.changed_files = changed_entries(previous, self.source_entries())
+        if self.changed_files:
+            self.notify(
+                f"{len(self.changed_files)} files or directories have "
+                f"changed since the last transfer"
+            )
+        else:
+            self.notify("No files have changed since the last transfer")
+            self.sync_ready = False
+
+    def open_journal(self):
+        """
+        Load the journal of an interrupted synchronisation (if the source
+        and config haven't changed since), so that completed stages are
+        skipped. Otherwise, start a new journal.
+        """
+        fingerprint = source_fingerprint(
+            self.source_entries(), self.config_file.read_text()
+        )
+        self.journal = Journal.load(self.paths.journal_file, fingerprint)
+        if self.journal is not None and self.journal_archive_missing():
+            self.notify("Source tar archive is missing, starting again")
+            self.journal = None
+        elif self.journal is not None:
+            self.resumed = True
+            self.notify(
+                f"Resuming interrupted synchronisation. Completed stages: "
+                f"{', '.join(self.journal.completed) or 'none'}"
+            )
+        elif self.paths.journal_file.exists():
+            self.notify(
+                "Source or config changed since the interrupted "
+                "synchronisation, starting again"
+            )
+
+        if self.journal is None:
+            self.journal = Journal(self.paths.journal_file, fingerprint)
+
+    def journal_archive_missing(self):
+        """
+        Check whether a tar archive created by an interrupted
+        synchronisation is needed, but no longer exists
+        """
+        return (
+            self.journal.is_completed("tar")
+            and not self.journal.is_completed("rsync")
+            and not self.paths.tar_archive.exists()
+        )
+
+    def source_entries(self, threads=None):
+        """
+        All the files and directories in the source directory (excluding
+        those written by synchro), scanned once per synchronisation
+
+        :param threads: Number of directories to scan at once (default:
+        scan_threads)
+        """
+        threads = threads or self.scan_threads
+        if self.scanned_source_entries is None:
+            if threads > 1:
+                self.scanned_source_entries = scan_directory_parallel(
+                    self.paths.source_directory,
+                    exclude=self.paths.synchro_files(),
+                    threads=threads,
+                )
+            else:
+                self.scanned_source_entries = list(
+                    scan_directory(
+                        self.paths.source_directory,
+                        exclude=self.paths.synchro_files(),
+                    )
+                )
+        return self.scanned_source_entries
+
+    def transfer_size(self):
+        """
+        Total size (bytes) of the files to transfer
+        """
+        return sum(
+            entry.size
+            for entry in self.files_to_transfer()
+            if not entry.is_dir
+        )
+
+    def split_by_size(self):
+        """
+        For a hybrid transfer, split the files to transfer into those to
+        archive (small files, directories & symlinks), and the large files
+        to send directly
+
+        :return: (entries to archive, large files)
+        """
+        archived, large = [], []
+        for entry in self.files_to_transfer():
+            if (
+                not entry.is_dir
+                and entry.size >= self.options.hybrid_threshold
+            ):
+                large.append(entry)
+            else:
+                archived.append(entry)
+        return archived, large
+
+    def archived_entries(self):
+        """
+        Files and directories to put in the tar archive
+        """
+        if self.options.hybrid_threshold is None:
+            return self.files_to_transfer()
+        return self.split_by_size()[0]
+
+    def files_to_transfer(self):
+        """
+        Files and directories to transfer, i.e. only those that have
+        changed for an incremental transfer
+        """
+        if self.changed_files is not None:
+            return self.changed_files
+        return self.source_entries()
+
+    def space_needed(self):
+        """
+        Estimate the space the synchronisation needs: for the tar archive
+        (next to the source directory), and at the destination (the
+        archive, while it is extracted, as well as the files)
+
+        :return: (bytes of scratch space, bytes at the destination)
+        """
+        # Scan the source quickly (if it hasn't been already)
+        self.source_entries(threads=SCAN_THREADS)
+        data_size = self.transfer_size()
+        if not self.options.tar or self.options.stream:
+            return 0, data_size
+
+        archive_size = tar_archive_size(self.archived_entries())
+        if self.options.volume_size is not None:
+            # Volumes being written & sent, and those waiting to be sent
+            archive_size = min(
+                archive_size, self.options.volume_size * (MAX_PENDING + 2)
+            )
+        scratch_size = archive_size
+        if self.resumed and self.journal.is_completed("tar"):
+            # The archive already exists
+            scratch_size = 0
+        if not self.options.untar:
+            return scratch_size, archive_size
+        return scratch_size, archive_size + data_size
+
+    def free_space(self):
+        """
+        :return: (bytes free next to the source directory, bytes free at
+        the destination, or None if it can't be checked)
+        """
+        scratch_free = local_free_space(self.paths.tar_archive.parent)
+        if self.paths.remote_destination:
+            destination_free = remote_free_space(
+                self.paths.remote_host,
+                self.paths.local_destination,
+                self.control_path,
+            )
+        else:
+            destination_free = local_free_space(
+                self.paths.destination_directory
+            )
+        return scratch_free, destination_free
+
+    def check_space(self):
+        """
+        Check, before anything is written, that there is enough space for
+        the tar archive and at the destination. If not, the
+        synchronisation is either deferred (not run, so it is tried again
+        later), or refused (an error is raised), depending on config.
+        """
+        scratch_needed, destination_needed = map(
+            with_margin, self.space_needed()
+        )
+        scratch_free, destination_free = self.free_space()
+        if (
+            not self.paths.remote_destination
+            and scratch_needed
+            and same_filesystem(
+                self.paths.tar_archive.parent,
+                self.paths.destination_directory,
+            )
+        ):
+            # Both are needed at once on the same filesystem
+            scratch_needed = destination_needed = (
+                scratch_needed + destination_needed
+            )
+
+        problems = []
+        if scratch_needed > scratch_free:
+            problems.append(
+                f"{scratch_needed} bytes needed for the tar archive in "
+                f"{self.paths.tar_archive.parent}, {scratch_free} free"
+            )
+        if destination_free is not None and (
+            destination_needed > destination_free
+        ):
+            problems.append(
+                f"{destination_needed} bytes needed at the destination "
+                f"{self.paths.destination_directory}, {destination_free} "
+                f"free"
+            )
+        if not problems:
+            return
+
+        message = f"Not enough space: {'; '.join(problems)}"
+        if self.options.space_check == "refuse":
+            raise InsufficientSpaceError(message)
+        print(f"{message}. Deferring synchronisation.")
+        self.deferred = True
+        self.sync_ready = False
+
+    def add_file_list(self, entries, name):
+        """
+        Add a list of files (e.g. for rsync --files-from), written to a
+        temporary directory when the synchronisation starts, and removed
+        after it (so nothing is left if it never starts)
+
+        :return: Where the list will be written
+        """
+        if self.file_list_directory is None:
+            # Random, as it is only created later (in a shared directory)
+            self.file_list_directory = (
+                Path(tempfile.gettempdir()) / f"synchro_{uuid.uuid4().hex}"
+            )
+        self.file_lists[name] = entries
+        return self.file_list_directory / name
+
+    def write_file_lists(self):
+        if not self.file_lists:
+            return
+        # Fails if the directory already exists
+        self.file_list_directory.mkdir(mode=0o700)
+        for name, entries in self.file_lists.items():
+            write_file_list(entries, self.file_list_directory / name)
+
+    def remove_file_lists(self):
+        if self.file_list_directory is not None:
+            shutil.rmtree(self.file_list_directory, ignore_errors=True)
+
     def transfer_check_ready_file(self):
         """
         Check whether the transfer ready file (e.g. ready.txt) exists,
@@ -126,7 +665,7 @@ class Synchronise:
             if self.paths.transfer_ready_file.exists():
                 self.sync_ready = True
             else:
-                print(
+                self.notify(
                     f"Transfer ready file: {self.paths.transfer_ready_file} "
                     f"does not exist."
                 )
@@ -134,7 +673,28 @@ class Synchronise:
             self.sync_ready = True
 
     def prep_sync(self):
-        self.check_inputs()
+        if not self.dry_run:
+            self.check_inputs()
+        self.get_ownership()
+
+        if self.native_copy:
+            self.prep_change_ownership_permission_strings()
+            return
+
+        if self.options.tar:
+            self.prep_compression()
+
+        if self.options.stream:
+            self.prep_stream_strings()
+            self.prep_change_ownership_permission_strings()
+            self.prep_remote_post_sync_string()
+            return
+
+        if self.options.volume_size is not None:
+            self.prep_volume_strings()
+            self.prep_change_ownership_permission_strings()
+            self.prep_remote_post_sync_string()
+            return
 
         if self.options.tar:
             self.prep_tar_string()
@@ -148,9 +708,35 @@ class Synchronise:
         else:
             self.files_to_sync = self.paths.source_directory
 
-        self.prep_rsync_string()
-        self.get_ownership()
+        if self.options.hybrid_threshold is not None:
+            self.prep_rsync_large_strings()
+        if self.options.rsync_shards > 1 and not self.options.tar:
+            self.prep_rsync_shard_strings()
+        else:
+            self.prep_rsync_string()
         self.prep_change_ownership_permission_strings()
+        self.prep_remote_post_sync_string()
+
+    def prep_compression(self):
+        """
+        Choose how to compress the tar archive. Compression is skipped if
+        most of the data (by size) is in already compressed formats.
+        """
+        self.codec = get_codec(self.options.compression)
+        if self.codec is None:
+            return
+
+        fraction = incompressible_fraction(
+            self.archived_entries(), self.options.compression_skip
+        )
+        if fraction >= SKIP_THRESHOLD:
+            self.notify(
+                f"{fraction:.0%} of the data is already compressed, "
+                f"not compressing the tar archive."
+            )
+            self.codec = None
+            return
+        self.paths.set_archive_extension(self.codec.extension)
 
     def check_source_directory(self):
         """
@@ -174,12 +760,16 @@ class Synchronise:
         Check if destination directory exists, and if it doesn't,
         either create it, or raise an error (depending on config).
         """
-        if self.paths.remote_destination:
-            if not self.remote_dest_exists():
-                self.deal_with_missing_destination_directory()
-        else:
-            if not self.paths.destination_directory.exists():
-                self.deal_with_missing_destination_directory()
+        with self.tracer.span(
+            "check_destination", remote=self.paths.remote_destination
+        ) as span:
+            if self.paths.remote_destination:
+                exists = self.remote_dest_exists()
+            else:
+                exists = self.paths.destination_directory.exists()
+            span.attributes["exists"] = exists
+        if not exists:
+            self.deal_with_missing_destination_directory()
 
     def remote_dest_exists(self):
         """
@@ -187,7 +777,9 @@ class Synchronise:
         :return: True if directory exists
         """
         return check_remote_dir_exists(
-            self.paths.remote_host, self.paths.local_destination
+            self.paths.remote_host,
+            self.paths.local_destination,
+            control_path=self.control_path,
         )
 
     def deal_with_missing_destination_directory(self):
@@ -241,11 +833,59 @@ class Synchronise:
             )
         self.config = get_config_obj(self.config_file)
 
+    def set_source(self, source):
+        """
+        Synchronise one of the source directories matched by a pattern
+        (e.g. "/data/runs/*") in the config file, to a directory of the same
+        name within the destination directory
+        """
+        destination_directory = Paths.set_destination_directory(self.config)
+        self.config.set("config", "source", str(source))
+        if destination_directory is not None:
+            self.config.set(
+                "config",
+                "destination",
+                str(destination_directory / Path(source).name),
+            )
+
     def setup_logging(self):
         """
-        Begin logging (to stdout and to file)
+        Begin logging (to stdout and to file). With log_summary, the logs
+        are written in the background (by a thread started with the
+        synchronisation, see start_logging), and command output is
+        summarised.
         """
-        initalise_logger(self.paths.log_filename, file_level=self.log_level)
+        if not self.options.log_summary:
+            initalise_logger(
+                self.paths.log_filename,
+                file_level=self.log_level,
+                prefix=self.log_prefix,
+            )
+            return
+
+        max_log_size = self.options.max_log_size
+        if max_log_size is not None:
+            max_log_size *= 1024**2
+        self.log_listener = initalise_queue_logger(
+            self.paths.log_filename,
+            file_level=self.log_level,
+            summary_interval=self.options.log_summary_interval,
+            max_log_size=max_log_size,
+            start=False,
+            prefix=self.log_prefix,
+        )
+
+    def start_logging(self):
+        """
+        Start writing the logs in the background (if using log_summary)
+        """
+        if self.log_listener is not None:
+            self.log_listener.start()
+
+    def stop_logging(self):
+        if self.log_listener is not None:
+            stop_queue_logger(self.log_listener)
+            self.log_listener = None
 
     def write_log_header(self):
         """
@@ -260,6 +900,9 @@ class Synchronise:
             self.tar_string,
             self.untar_string,
             delete_dest_tarball_string=self.delete_destination_tarball_string,
+            stream_strings=self.stream_strings,
+            rsync_shard_strings=self.rsync_shard_strings,
+            remote_post_sync_string=self.remote_post_sync_string,
         )
 
     def prepare_mkdir_string(self):
@@ -270,18 +913,23 @@ class Synchronise:
             mkdir_command = "mkdir -p"
         else:
             mkdir_command = "mkdir"
-        self.mkdir_string = [
-            "ssh",
+        self.mkdir_string = create_cmd.add_ssh_prefix(
+            [mkdir_command, str(self.paths.local_destination)],
             self.paths.remote_host,
-            mkdir_command,
-            self.paths.local_destination,
-        ]
+            self.control_path,
+        )
 
-    def prep_tar_string(self):
+    def prep_tar_string(self, archive=None):
         """
         Create tar command, including '-C' flag to move to directory before
         archiving.
+
+        :param archive: Where to write the archive to ("-" for stdout).
+        Defaults to the source tar archive.
         """
+        if archive is None:
+            archive = self.paths.tar_archive
+
         if self.exclude_log_file:
             self.tar_string = [
                 "tar",
@@ -289,48 +937,376 @@ class Synchronise:
             ]
         else:
             self.tar_string = ["tar"]
+        if self.journal is not None:
+            self.tar_string.append(f"--exclude={self.paths.journal_file.name}")
+
+        if self.codec is not None:
+            self.tar_string += [
+                "-I",
+                self.codec.compress_program(
+                    self.options.compression_level,
+                    rsyncable=self.options.rsyncable,
+                ),
+            ]
 
         cmd = [
+            *self.tar_reproducible_flags(),
+            *self.tar_permission_flags(),
             *self.tar_flags,
-            str(self.paths.tar_archive),
+            str(archive),
             "-C",
             str(self.paths.source_directory),
-            ".",
+            *self.tar_members(),
         ]
         self.tar_string = self.tar_string + cmd
 
+    def tar_members(self):
+        """
+        What to archive (relative to the source directory). Either
+        everything, or for an incremental transfer, only what has changed.
+        """
+        if self.options.hybrid_threshold is not None:
+            file_list = self.add_file_list(
+                self.tar_member_order(self.archived_entries()), "tar_members"
+            )
+            # The top level directory sets the destination's attributes,
+            # as when archiving everything
+            top_level = ["."] if self.changed_files is None else []
+            return [
+                "--null",
+                "--no-recursion",
+                *top_level,
+                "-T",
+                str(file_list),
+            ]
+        if self.changed_files is None:
+            return ["."]
+        file_list = self.add_file_list(
+            self.tar_member_order(self.changed_files), "tar_members"
+        )
+        return ["--null", "--no-recursion", "-T", str(file_list)]
+
+    def tar_member_order(self, entries):
+        """
+        For a reproducible archive, list the members in path order (tar
+        --sort only sorts the directories it recurses into)
+        """
+        if self.options.reproducible_archive:
+            return sorted(entries)
+        return entries
+
+    def prep_stream_strings(self):
+        """
+        Create the commands for a streaming transfer. The source is archived
+        to stdout, and either extracted on the fly at the destination, or
+        written straight to the destination tar archive.
+        """
+        self.prep_tar_string(archive="-")
+
+        if self.options.untar:
+            receive_string = [
+                "tar",
+                *self.decompression_flags(self.codec),
+                # Files are already listed by the source tar
+                *create_cmd.quiet_tar_flags(self.flags),
+                "-",
+                "-C",
+                str(self.paths.local_destination),
+            ]
+        else:
+            receive_string = [
+                "dd",
+                f"of={self.paths.dest_tar_archive}",
+                "bs=1048576",
+            ]
+
+        if self.paths.remote_destination:
+            receive_string = create_cmd.add_ssh_prefix(
+                receive_string, self.paths.remote_host, self.control_path
+            )
+
+        throttle_string = self.throttle_command()
+        if throttle_string is not None:
+            self.stream_strings = [
+                self.tar_string,
+                throttle_string,
+                receive_string,
+            ]
+        else:
+            self.stream_strings = [self.tar_string, receive_string]
+        self.tar_string = None
+
+    def prep_volume_strings(self):
+        """
+        Create the commands for a transfer in volumes. The source is
+        archived to stdout and split into volumes, each rsynced as soon as
+        it is complete. At the destination, each volume is extracted as it
+        arrives, by a script that runs for the whole transfer.
+        """
+        self.prep_tar_string(archive="-")
+        untar_string = [
+            "tar",
+            *self.decompression_flags(self.codec),
+            # Files are already listed by the source tar
+            *create_cmd.quiet_tar_flags(self.flags),
+            "-",
+            "-C",
+            str(self.paths.local_destination),
+        ]
+        archive = self.paths.dest_tar_archive
+        self.extract_volumes_string = self.destination_script(
+            extract_volumes_script(archive, untar_string)
+        )
+        self.clear_volumes_string = self.destination_script(
+            clear_volumes_script(archive)
+        )
+        self.end_volumes_string = self.destination_script(
+            f"touch {shlex.quote(end_marker(archive))}"
+        )
+
+    def destination_script(self, script):
+        """
+        Command to run a shell script at the destination
+        """
+        if self.paths.remote_destination:
+            return create_cmd.add_ssh_prefix(
+                [script], self.paths.remote_host, self.control_path
+            )
+        return ["sh", "-c", script]
+
+    def volume_rsync_string(self, volume):
+        """
+        Command to rsync a volume of the archive to the destination
+        """
+        return [
+            "rsync",
+            *self.rsync_flags,
+            *self.rsync_bandwidth_options(),
+            str(volume),
+            str(self.paths.destination_directory),
+        ]
+
     def prep_rsync_string(self):
         """
         Create command to run rsync
         """
         if not self.options.tar:
+            if self.changed_files is not None:
+                file_list = self.add_file_list(
+                    self.changed_files, "changed_files"
+                )
+                self.rsync_string = self.prep_files_from_rsync_string(
+                    file_list
+                )
+                return
             files_to_sync = str(self.files_to_sync) + "/"
         else:
             files_to_sync = self.files_to_sync
 
+        exclude = []
+        if self.journal is not None and not self.options.tar:
+            exclude = [f"--exclude=/{self.paths.journal_file.name}"]
+
         self.rsync_string = [
             "rsync",
             *self.rsync_flags,
+            *self.rsync_resume_flags(),
+            *self.rsync_bandwidth_options(),
+            *self.rsync_permission_flags(),
+            *exclude,
             files_to_sync,
             str(self.paths.destination_directory),
         ]
 
+    def throttle_command(self):
+        """
+        Command to copy stdin to stdout within the bandwidth limits (shared
+        by all synchro processes on this host), or None if there are no
+        limits (at any time of day)
+        """
+        if not (
+            BandwidthSchedule(self.options.bandwidth_limit)
+            or BandwidthSchedule(self.options.global_bandwidth_limit)
+        ):
+            return None
+        return throttle_command(
+            Path(self.config_file).resolve(),
+            self.options.bandwidth_limit,
+            self.options.global_bandwidth_limit,
+            self.options.bandwidth_coordination_file,
+        )
+
+    def rsync_bandwidth_options(self):
+        """
+        rsync options for the ssh connection and bandwidth limits. Data sent
+        to a remote host passes through the shared throttle (which wraps
+        ssh). rsync can only limit a local copy to a fixed rate, so the
+        limit at the start of the copy is used.
+        """
+        ssh_options = rsync_ssh_options(self.control_path)
+        throttle_string = self.throttle_command()
+        if throttle_string is None:
+            return ssh_options
+
+        if self.paths.remote_destination:
+            if ssh_options:
+                ssh = ssh_options[0].removeprefix("--rsh=")
+            else:
+                ssh = "ssh"
+            return [f"--rsh={shlex.join(throttle_string)} -- {ssh}"]
+
+        limit = lowest_limit(
+            BandwidthSchedule(self.options.bandwidth_limit),
+            BandwidthSchedule(self.options.global_bandwidth_limit),
+        )
+        if limit is None:
+            return ssh_options
+        return [*ssh_options, f"--bwlimit={max(limit // 1024, 1)}"]
+
+    def rsync_resume_flags(self):
+        """
+        rsync flags to keep partially transferred files, so an interrupted
+        transfer can resume. When resuming the transfer of a tar archive,
+        rsync appends to the partial archive (and then verifies the whole
+        file) rather than sending it again.
+        """
+        if self.journal is None:
+            return []
+        flags = []
+        if not any(
+            flag == "--partial" or (not flag.startswith("--") and "P" in flag)
+            for flag in self.rsync_flags
+        ):
+            flags.append("--partial")
+        if self.options.tar and self.journal.is_started("rsync"):
+            flags.append("--append-verify")
+        return flags
+
+    def prep_rsync_shard_strings(self):
+        """
+        Split the source directory into shards of similar total size, and
+        create one rsync command per shard. Directories are synchronised in
+        a final pass, so that their attributes are set after all the files
+        are in place.
+        """
+        entries = self.files_to_transfer()
+        shards = balance_shards(entries, self.options.rsync_shards)
+
+        self.rsync_shard_strings = []
+        for i, shard in enumerate(shards):
+            if shard:
+                file_list = self.add_file_list(shard, f"shard_{i}")
+                self.rsync_shard_strings.append(
+                    self.prep_files_from_rsync_string(file_list)
+                )
+
+        directories = [entry for entry in entries if entry.is_dir]
+        file_list = self.add_file_list(directories, "directories")
+        self.rsync_directories_string = self.prep_files_from_rsync_string(
+            file_list
+        )
+
+    def prep_rsync_large_strings(self):
+        """
+        For a hybrid transfer, create the rsync commands that send the large
+        files directly to the destination, split into rsync_shards shards
+        of similar total size
+        """
+        large = self.split_by_size()[1]
+        shards = balance_shards(large, self.options.rsync_shards)
+        self.rsync_large_strings = []
+        for i, shard in enumerate(shards):
+            if shard:
+                file_list = self.add_file_list(shard, f"large_{i}")
+                self.rsync_large_strings.append(
+                    self.prep_files_from_rsync_string(file_list)
+                )
+
+    def prep_files_from_rsync_string(self, file_list):
+        """
+        Create command to rsync only the files listed (relative to the
+        source directory) in a NUL-separated file
+        """
+        return [
+            "rsync",
+            *self.rsync_flags,
+            *self.rsync_resume_flags(),
+            *self.rsync_bandwidth_options(),
+            *self.rsync_permission_flags(),
+            "--from0",
+            f"--files-from={file_list}",
+            str(self.paths.source_directory) + "/",
+            str(self.paths.destination_directory),
+        ]
+
+    def set_permissions_inline(self):
+        """
+        Whether ownership and permissions are set as the files are copied
+        or extracted, rather than by a recursive pass afterwards (a native
+        copy keeps those of the source, as rsync -a)
+        """
+        return (
+            self.change_permissions
+            and self.options.inline_permissions
+            and not self.native_copy
+        )
+
+    def rsync_permission_flags(self):
+        if not self.set_permissions_inline():
+            return []
+        return create_cmd.rsync_ownership_permission_flags(
+            self.options.owner, self.options.group, self.options.permissions
+        )
+
+    def tar_reproducible_flags(self):
+        if not self.options.reproducible_archive:
+            return []
+        return create_cmd.reproducible_tar_flags()
+
+    def tar_permission_flags(self):
+        """
+        tar flags to store the destination ownership and permissions in the
+        archive. Only used if the archive is extracted (with -p), otherwise
+        the archive itself is copied with the rsync flags.
+        """
+        if not self.set_permissions_inline() or not self.options.untar:
+            return []
+        return create_cmd.tar_ownership_permission_flags(
+            self.options.owner, self.options.group, self.options.permissions
+        )
+
     def prep_untar_string(self):
         """
         Create untar command, including '-C' flag to move to directory before
         archiving.
         """
-        self.untar_string = [
+        self.untar_string = self.untar_command()
+        if self.paths.remote_destination:
+            self.untar_string = create_cmd.add_ssh_prefix(
+                self.untar_string, self.paths.remote_host, self.control_path
+            )
+
+    def untar_command(self):
+        """
+        Untar command, as run on the destination machine
+        """
+        return [
             "tar",
+            *self.decompression_flags(self.codec),
             *self.flags,
             str(self.paths.dest_tar_archive),
             "-C",
             str(self.paths.local_destination),
         ]
-        if self.paths.remote_destination:
-            self.untar_string = create_cmd.add_ssh_prefix(
-                self.untar_string, self.paths.remote_host
-            )
+
+    @staticmethod
+    def decompression_flags(codec):
+        """
+        tar flags needed to extract an archive compressed with codec
+        """
+        if codec is None:
+            return []
+        return ["-I", codec.decompressor]
 
     def prep_change_ownership_permission_strings(self):
         """
@@ -339,17 +1315,32 @@ class Synchronise:
         (
             self.change_ownership_string,
             self.change_permission_string,
-        ) = create_cmd.change_ownership_permission(
+        ) = self.ownership_permission_commands(self.paths.remote_destination)
+
+    def ownership_permission_commands(self, remote_destination):
+        """
+        Commands to change ownership and permissions at the destination
+
+        :param remote_destination: Prefix the commands with ssh
+        """
+        return create_cmd.change_ownership_permission(
             self.options.tar,
             self.options.untar,
-            self.options.delete_destination_tar,
+            # A streamed & extracted archive (or one sent in volumes) never
+            # exists at the destination
+            self.options.delete_destination_tar
+            or (self.options.stream and self.options.untar)
+            or self.options.volume_size is not None,
             self.options.owner,
             self.options.group,
             self.options.permissions,
             self.paths.dest_tar_archive,
             self.paths.local_destination,
             self.paths.remote_host,
-            self.paths.remote_destination,
+            remote_destination,
+            control_path=self.control_path,
+            # Only the top level is left to change
+            recursive=not self.set_permissions_inline(),
         )
 
     def prep_delete_destination_tarball_string(self):
@@ -358,39 +1349,171 @@ class Synchronise:
                 self.paths.dest_tar_archive,
                 self.paths.remote_host,
                 self.paths.remote_destination,
+                control_path=self.control_path,
             )
         )
 
+    def prep_remote_post_sync_string(self):
+        """
+        If the destination is remote, combine all the steps run at the
+        destination after the transfer (untar, deleting the tar archive,
+        setting ownership & permissions) into a single ssh command.
+        """
+        if not self.paths.remote_destination:
+            return
+
+        steps = []
+        if (
+            self.options.untar
+            and not self.options.stream
+            and self.options.volume_size is None
+        ):
+            steps.append(("untar", self.untar_command()))
+            if self.options.delete_destination_tar:
+                steps.append(
+                    (
+                        "delete_destination_tar",
+                        create_cmd.delete_destination_tarball_string(
+                            self.paths.dest_tar_archive, None
+                        ),
+                    )
+                )
+        if self.change_permissions:
+            chown_string, chmod_string = self.ownership_permission_commands(
+                remote_destination=False
+            )
+            steps.append(("chown", chown_string))
+            steps.append(("chmod", chmod_string))
+
+        if steps:
+            self.remote_post_sync_steps = steps
+            self.remote_post_sync_string = create_cmd.batch_remote_steps(
+                steps, self.paths.remote_host, self.control_path
+            )
+
     def start_sync(self):
         """
         Run the full synchronisation workflow
         """
         if self.sync_ready:
-            self._start_sync()
+            self.start_logging()
+            try:
+                with (
+                    self.tracer.span("synchronisation"),
+                    profile(self.options.profile_file),
+                    command_timeout(self.options.command_timeout),
+                ):
+                    self.write_file_lists()
+                    self._start_sync()
+            except BaseException:
+                self.metrics.finish("failed")
+                self.record_run("failed")
+                raise
+            finally:
+                self.stop_source_hashing()
+                self.remove_file_lists()
+                self.close_ssh_connection()
+                self.write_trace()
+                self.stop_logging()
+
+    def open_ssh_connection(self):
+        """
+        Open a multiplexed SSH connection to the remote host (or reuse the
+        one opened for a batch of synchronisations, shared_control_path),
+        so that every remote step of the synchronisation shares a single
+        connection. If it can't be opened, each ssh command connects
+        separately.
+        """
+        if not (self.paths.remote_destination and self.options.ssh_multiplex):
+            return
+        if self.shared_control_path is not None:
+            shared = SSHMaster(
+                self.paths.remote_host, control_path=self.shared_control_path
+            )
+            if shared.is_running():
+                self.control_path = shared.control_path
+                return
+        self.ssh_master = SSHMaster(self.paths.remote_host)
+        try:
+            self.ssh_master.start()
+        except SSHConnectionError as error:
+            print(f"{error}. Connecting separately for each command.")
+            self.ssh_master = None
+            return
+        self.control_path = self.ssh_master.control_path
+
+    def close_ssh_connection(self):
+        if self.ssh_master is not None:
+            self.ssh_master.stop()
 
     def _start_sync(self):
+        archive_sync = False
+        if self.options.verify:
+            logging.debug("Starting to calculate source checksums")
+            self.start_source_hashing()
+        if self.native_copy:
+            logging.debug("Starting native copy")
+            self.run_stage("copy", self.run_native_copy)
+            logging.debug("Native copy completed")
+        elif self.options.stream:
+            logging.debug("Starting streaming transfer")
+            self.run_stage("stream", self.run_stream)
+            logging.debug("Streaming transfer completed")
+        elif self.options.volume_size is not None:
+            logging.debug("Starting transfer in volumes")
+            self.run_stage("volumes", self.run_volumes)
+            logging.debug("Transfer in volumes completed")
+        else:
+            self._start_archive_sync()
+            archive_sync = True
+        if self.remote_post_sync_string is not None:
+            logging.debug("Running remote post-transfer steps")
+            self.run_stage("remote_post_sync", self.run_remote_post_sync_steps)
+        else:
+            logging.debug("Setting destination ownership and permissions")
+            self.run_stage("permissions", self.set_ownership_permissions)
+        if self.options.verify:
+            logging.debug("Verifying destination checksums")
+            self.run_stage("verify", self.run_verification)
+        if archive_sync and self.options.delete_source_tar:
+            # Only once the archive has been extracted at the destination
+            logging.debug("Removing source tar archive ")
+            self.run_stage("delete_source_tar", self.run_delete_source_tar)
+        if self.options.incremental:
+            logging.debug("Saving source manifest")
+            self.write_manifest()
+        logging.debug("Writing 'transfer.done' file")
+        self.write_transfer_done_file()
+        if self.journal is not None:
+            self.journal.remove()
+        self.metrics.finish("success")
+        self.record_run("success")
+        self.write_log_footer()
+
+    def _start_archive_sync(self):
+        if self.rsync_large_strings:
+            # Before extraction, which sets the attributes of the
+            # directories the large files are in
+            logging.debug("Starting rsync of large files")
+            self.run_stage("rsync_large", self.run_rsync_large)
         if self.options.tar:
             logging.debug("Starting tar archiving")
-            self.run_tar()
+            self.run_stage("tar", self.run_tar)
         logging.debug("Starting rsync")
-        self.run_rsync()
+        self.run_stage("rsync", self.run_rsync)
         logging.debug("Rsync completed")
-        if self.options.untar:
+        if not self.options.untar:
+            logging.debug("Not untaring files")
+        elif self.remote_post_sync_string is None:
+            # Otherwise untar & deletion run with the other remote steps
             logging.debug("Untaring files")
-            self.run_untar()
+            self.run_stage("untar", self.run_untar)
             if self.options.delete_destination_tar:
                 logging.debug("Removing destination tar archive")
-                self.run_destination_tar_deletion()
-        else:
-            logging.debug("Not untaring files")
-        logging.debug("Writing 'transfer.done' file")
-        if self.options.delete_source_tar:
-            logging.debug("Removing source tar archive ")
-            self.run_delete_source_tar()
-        logging.debug("Setting destination ownership and permissions")
-        self.set_ownership_permissions()
-        self.write_transfer_done_file()
-        self.write_log_footer()
+                self.run_stage(
+                    "delete_destination_tar",
+                    self.run_destination_tar_deletion,
+                )
 
     def get_ownership(self):
         """
@@ -403,16 +1526,127 @@ class Synchronise:
             self.options.group = self.paths.source_directory.group()
 
     def run_tar(self):
-        execute_and_log(self.tar_string)
+        execute_and_log(self.tar_string, callback=self.metrics.observe)
 
     def run_destination_tar_deletion(self):
         execute_and_log(self.delete_destination_tarball_string)
 
     def run_rsync(self):
-        execute_and_log(self.rsync_string)
+        if self.rsync_shard_strings is not None:
+            self.run_rsync_shards()
+        else:
+            execute_and_log(self.rsync_string, callback=self.metrics.observe)
+
+    def run_rsync_shards(self):
+        n_shards = len(self.rsync_shard_strings)
+        prefixes = [f"[shard {i}] " for i in range(n_shards)]
+        callbacks = [
+            partial(self.metrics.observe, stream=str(i))
+            for i in range(n_shards)
+        ]
+        execute_concurrently_and_log(
+            self.rsync_shard_strings, prefixes, callbacks
+        )
+        execute_and_log(
+            self.rsync_directories_string,
+            callback=partial(self.metrics.observe, stream="directories"),
+        )
+
+    def run_rsync_large(self):
+        n_shards = len(self.rsync_large_strings)
+        prefixes = [f"[large {i}] " for i in range(n_shards)]
+        callbacks = [
+            partial(self.metrics.observe, stream=f"large {i}")
+            for i in range(n_shards)
+        ]
+        execute_concurrently_and_log(
+            self.rsync_large_strings, prefixes, callbacks
+        )
+
+    def run_volumes(self):
+        """
+        Archive, send and extract the volumes at once. The destination
+        script is told that the last volume has been sent (or that the
+        transfer has failed) by the end marker.
+        """
+        execute_and_log(self.clear_volumes_string)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # The copied context carries any timeout to the other thread
+            extraction = executor.submit(
+                contextvars.copy_context().run,
+                execute_and_log,
+                self.extract_volumes_string,
+                callback=self.metrics.observe,
+            )
+
+            def send_volume(volume, index):
+                if extraction.done():
+                    # Raises the error if extraction failed
+                    extraction.result()
+                    raise RuntimeError("Extraction stopped early")
+                execute_and_log(
+                    self.volume_rsync_string(volume),
+                    callback=self.metrics.observe,
+                )
+                marker = done_marker(
+                    volume_name(self.paths.dest_tar_archive, index)
+                )
+                execute_and_log(
+                    self.destination_script(f"touch {shlex.quote(marker)}")
+                )
+                volume.unlink()
+
+            try:
+                n_volumes = transfer_volumes(
+                    self.tar_string,
+                    self.paths.tar_archive,
+                    self.options.volume_size,
+                    send_volume,
+                    callback=self.metrics.observe,
+                )
+            finally:
+                execute_and_log(self.end_volumes_string)
+                remove_volumes(self.paths.tar_archive)
+            extraction.result()
+        logging.info(f"Transferred {n_volumes} volumes")
 
     def run_untar(self):
-        execute_and_log(self.untar_string)
+        execute_and_log(self.untar_string, callback=self.metrics.observe)
+
+    def run_remote_post_sync_steps(self):
+        execute_remote_steps_and_log(
+            self.remote_post_sync_string,
+            self.remote_post_sync_steps,
+            callback=self.metrics.observe,
+        )
+
+    def run_stream(self):
+        try:
+            execute_pipeline_and_log(
+                self.stream_strings, callback=self.metrics.observe
+            )
+            # There is no progress output to parse when streaming
+            self.metrics.add_bytes(self.transfer_size())
+        except subprocess.SubprocessError as error:
+            logging.error(f"Streaming transfer failed: {error}")
+            self.abort()
+            raise
+
+    def run_native_copy(self):
+        copy = FastCopy(
+            self.paths.source_directory,
+            self.paths.destination_directory,
+            policy=self.options.local_copy,
+            threads=self.options.local_copy_threads,
+            callback=self.log_copied_file,
+        )
+        copy.copy(self.files_to_transfer())
+        # Hardlinked (and unchanged) files aren't counted
+        self.metrics.add_bytes(copy.bytes_copied)
+
+    def log_copied_file(self, path):
+        logging.getLogger(OUTPUT_LOGGER).debug(path)
+        self.metrics.observe(path)
 
     def run_delete_source_tar(self):
         self.paths.tar_archive.unlink()
@@ -425,8 +1659,192 @@ class Synchronise:
             execute_and_log(self.change_ownership_string)
             execute_and_log(self.change_permission_string)
 
+    def start_source_hashing(self):
+        """
+        Start calculating checksums of the source files in the background,
+        so they are read while the transfer is running (and likely to be in
+        the page cache)
+        """
+        paths = hashable_files(
+            self.paths.source_directory, self.files_to_transfer()
+        )
+        self.hash_executor = ThreadPoolExecutor(max_workers=1)
+        self.source_checksums = self.hash_executor.submit(
+            hash_files,
+            self.paths.source_directory,
+            paths,
+            self.options.verify_algorithm,
+            self.options.verify_threads,
+        )
+
+    def stop_source_hashing(self):
+        if self.hash_executor is not None:
+            self.hash_executor.shutdown(wait=False, cancel_futures=True)
+            self.hash_executor = None
+
+    def run_verification(self):
+        """
+        Compare checksums of the source and destination files, and save the
+        checksums alongside the data at the destination
+        """
+        source_checksums = self.source_checksums.result()
+        destination_checksums = self.get_destination_checksums(
+            list(source_checksums)
+        )
+        problems = compare_checksums(source_checksums, destination_checksums)
+        if problems:
+            for problem in problems:
+                logging.error(problem)
+            error = f"Verification failed for {len(problems)} files"
+            logging.error(error)
+            self.abort()
+            raise VerificationError(error)
+
+        logging.info(f"Verified {len(source_checksums)} files")
+        self.write_destination_checksum_file(source_checksums)
+
+    def get_destination_checksums(self, paths):
+        """
+        Calculate checksums of the files at the destination, either locally
+        or on the remote machine
+
+        :param paths: Relative paths of the files to hash
+        """
+        if self.paths.remote_destination:
+            cmd = create_cmd.add_ssh_prefix(
+                remote_hash_command(
+                    self.paths.local_destination,
+                    self.options.verify_algorithm,
+                    self.options.verify_threads,
+                ),
+                self.paths.remote_host,
+                self.control_path,
+            )
+            return hash_files_with_command(cmd, paths, effective_timeout())
+
+        paths = [
+            path
+            for path in paths
+            if (self.paths.local_destination / path).is_file()
+        ]
+        return hash_files(
+            self.paths.local_destination,
+            paths,
+            self.options.verify_algorithm,
+            self.options.verify_threads,
+        )
+
+    def write_destination_checksum_file(self, checksums):
+        """
+        Write a checksum file (that can be checked by e.g. "sha256sum -c")
+        alongside the data at the destination. For incremental transfers,
+        the checksums of any previously transferred files are kept.
+        """
+        checksum_file = self.paths.checksum_file(self.options.verify_algorithm)
+        if self.options.incremental:
+            checksums = {
+                **self.read_destination_checksum_file(checksum_file),
+                **checksums,
+            }
+
+        if self.paths.remote_destination:
+            with tempfile.NamedTemporaryFile() as f:
+                write_checksum_file(checksums, f.name)
+                cmd = create_cmd.add_ssh_prefix(
+                    ["cat", ">", shlex.quote(str(checksum_file))],
+                    self.paths.remote_host,
+                    self.control_path,
+                )
+                subprocess.run(cmd, stdin=f, check=True)
+        else:
+            write_checksum_file(checksums, checksum_file)
+
+    def read_destination_checksum_file(self, checksum_file):
+        """
+        Read a checksum file from a previous transfer (if any)
+        """
+        if self.paths.remote_destination:
+            cmd = create_cmd.add_ssh_prefix(
+                [f"cat {shlex.quote(str(checksum_file))} 2>/dev/null || true"],
+                self.paths.remote_host,
+                self.control_path,
+            )
+            lines = list(execute_and_yield_output(cmd))
+        elif checksum_file.exists():
+            with open(checksum_file) as f:
+                lines = f.readlines()
+        else:
+            lines = []
+        return dict(parse_checksum_line(line) for line in lines)
+
+    def write_manifest(self):
+        """
+        Save the state of the source directory (as scanned before the
+        transfer), so the next incremental transfer only sends changes
+        """
+        with self.tracer.span("manifest"):
+            save_manifest(self.source_entries(), self.paths.manifest_file)
+
+    def record_run(self, status):
+        """
+        Save this synchronisation (its size, the duration of each stage and
+        whether it succeeded) to the run history database, which is used
+        by synchro report, and to estimate the duration of future
+        synchronisations to the same host
+        """
+        n_bytes, n_files = self.run_size()
+        try:
+            record_run(
+                {
+                    "started": self.start_time.timestamp(),
+                    "config": str(self.config_file),
+                    "source": str(self.paths.source_directory),
+                    "destination": str(self.paths.destination_directory),
+                    "host": self.paths.destination_host,
+                    "status": status,
+                    "bytes": n_bytes,
+                    "files": n_files,
+                    "resumed": self.resumed,
+                },
+                {
+                    name: stage["duration"]
+                    for name, stage in self.metrics.stages.items()
+                },
+                self.options.history_file,
+            )
+        except (OSError, sqlite3.Error) as error:
+            logging.warning(f"Could not save run history: {error}")
+
+    def run_size(self):
+        """
+        Size of the synchronisation, from the scan of the source if it has
+        already been scanned, otherwise from the transfer's metrics (so
+        that a large source isn't scanned just to record the run, e.g.
+        after it has been interrupted)
+
+        :return: (bytes, files)
+        """
+        if self.changed_files is None and self.scanned_source_entries is None:
+            return self.metrics.bytes_transferred, self.metrics.files
+        files = [
+            entry for entry in self.files_to_transfer() if not entry.is_dir
+        ]
+        return sum(entry.size for entry in files), len(files)
+
     def write_transfer_done_file(self):
-        self.paths.transfer_done_file.touch()
+        with self.tracer.span(
+            "transfer_done", path=self.paths.transfer_done_file
+        ):
+            self.paths.transfer_done_file.touch()
+
+    def write_trace(self):
+        """
+        Export the spans recorded so far (if trace_file is set)
+        """
+        try:
+            self.tracer.write()
+        except OSError as error:
+            logging.warning(f"Could not write trace file: {error}")
 
     def abort(self):
         """
@@ -439,10 +1857,21 @@ class Synchronise:
         write_log_footer(self.start_time)
 
 
-def run_sychronisation(config_file, log_file, change_permissions=True):
+def run_sychronisation(
+    config_file,
+    log_file,
+    change_permissions=True,
+    source=None,
+    shared_control_path=None,
+    log_prefix=None,
+):
     synchro = Synchronise(
         config_file,
         log_file,
         change_permissions=change_permissions,
+        source=source,
+        shared_control_path=shared_control_path,
+        log_prefix=log_prefix,
     )
     synchro.start_sync()
+    return synchro
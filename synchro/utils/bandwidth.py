@@ -0,0 +1,310 @@
+import os
+import json
+import time
+import fcntl
+import hashlib
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Union
+
+UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+UNLIMITED = ("0", "none", "unlimited")
+
+# Bytes read & written at once
+CHUNK_SIZE = 1024 * 1024
+# Bytes are taken from the shared buckets this many seconds' worth (at the
+# current limit) at a time. Larger quanta mean fewer updates to the
+# coordination files, but less smooth throttling.
+QUANTUM_SECONDS = 1.0
+# Seconds between checks of the limits (e.g. for the start of a window),
+# while transferring without taking from the buckets
+RECHECK_INTERVAL = 10.0
+# Tokens can build up for this long (s) while idle
+BURST_SECONDS = 1.0
+# Processes that haven't updated the coordination file for this long (s)
+# are assumed to have finished
+CLIENT_TIMEOUT = 30.0
+
+
+def parse_rate(string: str) -> Optional[int]:
+    """
+    Parse a transfer rate from a config file
+
+    :param string: Bytes per second, with an optional K, M or G suffix
+    (e.g. "200M"), or 0/none/unlimited
+    :return: Bytes per second, or None for no limit
+    """
+    string = string.strip().upper().removesuffix("B")
+    if string.lower() in UNLIMITED:
+        return None
+    if string[-1] in UNITS:
+        return int(float(string[:-1]) * UNITS[string[-1]])
+    return int(float(string))
+
+
+def parse_time(string: str) -> int:
+    """
+    :param string: e.g. "09:30"
+    :return: Minutes since midnight
+    """
+    hours, minutes = string.strip().split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+class BandwidthSchedule:
+    """
+    A bandwidth limit that can vary with the time of day
+
+    :param string: Comma-separated limits, either for a time window
+    ("09:00-18:00=200M") or the default for any other time ("1G"). Windows
+    can cross midnight (e.g. "22:00-06:00=0"). The first matching window is
+    used.
+    """
+
+    def __init__(self, string: Optional[str]):
+        self.windows = []
+        self.default = None
+        if string is None:
+            return
+        for item in string.split(","):
+            if not item.strip():
+                continue
+            if "=" in item:
+                window, rate = item.split("=", 1)
+                start, end = window.split("-")
+                self.windows.append(
+                    (parse_time(start), parse_time(end), parse_rate(rate))
+                )
+            else:
+                self.default = parse_rate(item)
+
+    def __bool__(self):
+        return bool(self.windows) or self.default is not None
+
+    def limit_at(self, when: Optional[datetime] = None) -> Optional[int]:
+        """
+        :param when: Time (default: now)
+        :return: Limit (bytes per second), or None for no limit
+        """
+        if when is None:
+            when = datetime.now()
+        minute = when.hour * 60 + when.minute
+        for start, end, rate in self.windows:
+            if start <= end:
+                in_window = start <= minute < end
+            else:
+                in_window = minute >= start or minute < end
+            if in_window:
+                return rate
+        return self.default
+
+
+def lowest_limit(*schedules: BandwidthSchedule) -> Optional[int]:
+    """
+    :return: The lowest limit (bytes per second) of the schedules now, or
+    None for no limit
+    """
+    limits = [schedule.limit_at() for schedule in schedules]
+    limits_set = [limit for limit in limits if limit is not None]
+    return min(limits_set) if limits_set else None
+
+
+def default_coordination_file() -> Path:
+    return (
+        Path(tempfile.gettempdir())
+        / f"synchro-{os.getuid()}"
+        / "bandwidth.json"
+    )
+
+
+class SharedThrottle:
+    """
+    Limit the rate of transfers, shared between all the synchro processes
+    on a host. Each limit is a token bucket, stored in a coordination file
+    that is locked while it is updated. Transfers using the same config
+    share the per-config limit (in a file for that config). Transfers with
+    a global limit share the global limit, which is the lowest global limit
+    set by any of them (in the coordination file). While there is no limit
+    (e.g. outside a window), the files aren't used.
+
+    :param key: Identifies the config (e.g. its path)
+    :param limit: Per-config BandwidthSchedule
+    :param global_limit: Global BandwidthSchedule
+    :param coordination_file: File shared by all synchro processes
+    """
+
+    def __init__(
+        self,
+        key: str,
+        limit: BandwidthSchedule,
+        global_limit: BandwidthSchedule,
+        coordination_file: Union[Path, str, None] = None,
+    ):
+        self.key = key
+        self.limit = limit
+        self.global_limit = global_limit
+        if coordination_file is None:
+            coordination_file = default_coordination_file()
+        self.coordination_file = Path(coordination_file)
+        self.coordination_file.parent.mkdir(parents=True, exist_ok=True)
+        key_hash = hashlib.sha1(key.encode()).hexdigest()[:16]
+        self.config_file = self.coordination_file.with_name(
+            f"{self.coordination_file.stem}-{key_hash}"
+            f"{self.coordination_file.suffix}"
+        )
+        self.client = str(os.getpid())
+        # Bytes taken from the buckets, but not sent yet
+        self.allowance = 0
+        self.rate: Optional[int] = None
+        self.next_check = 0.0
+
+    def acquire(self, n_bytes: int):
+        """
+        Wait until n_bytes can be sent without exceeding the limits. Bytes
+        are taken from the buckets in quanta (see QUANTUM_SECONDS), and not
+        at all while there is no limit.
+        """
+        now = time.monotonic()
+        if now >= self.next_check:
+            self.rate = lowest_limit(self.limit, self.global_limit)
+            self.next_check = now + RECHECK_INTERVAL
+            if self.rate is None:
+                self.allowance = 0
+        if self.rate is None:
+            return
+        if self.allowance < n_bytes:
+            quantum = max(n_bytes, int(self.rate * QUANTUM_SECONDS))
+            time.sleep(self.reserve(quantum))
+            self.allowance += quantum
+        self.allowance -= n_bytes
+
+    def reserve(self, n_bytes: int) -> float:
+        """
+        Take n_bytes from the buckets. A bucket can go into debt, in which
+        case every transfer using it waits until it has refilled.
+
+        :return: Time (s) to wait before sending
+        """
+        now = time.time()
+        wait = 0.0
+        limit = self.limit.limit_at()
+        if limit is not None:
+            wait = self.update(
+                self.config_file,
+                lambda state: take(
+                    state.setdefault("buckets", {}),
+                    self.key,
+                    limit,
+                    n_bytes,
+                    now,
+                ),
+            )
+        global_limit = self.global_limit.limit_at()
+        if global_limit is not None:
+            global_wait = self.update(
+                self.coordination_file,
+                lambda state: self.take_global(
+                    state, global_limit, n_bytes, now
+                ),
+            )
+            wait = max(wait, global_wait)
+        return wait
+
+    def take_global(
+        self, state: dict, global_limit: int, n_bytes: int, now: float
+    ) -> float:
+        """
+        Take n_bytes from the global bucket, which is refilled at the lowest
+        global limit of any running transfer
+        """
+        clients = {
+            client: info
+            for client, info in state.get("clients", {}).items()
+            if now - info["time"] < CLIENT_TIMEOUT
+        }
+        clients[self.client] = {"time": now, "limit": global_limit}
+        state["clients"] = clients
+        global_rate = min(
+            info["limit"]
+            for info in clients.values()
+            if info["limit"] is not None
+        )
+        return take(
+            state.setdefault("buckets", {}),
+            "global",
+            global_rate,
+            n_bytes,
+            now,
+        )
+
+    def update(self, filename: Path, change) -> float:
+        """
+        Change the state saved in a coordination file, while it is locked
+
+        :param filename: Coordination file
+        :param change: Function that changes the state (a dict) in place
+        :return: What change returns
+        """
+        lock_file = filename.with_name(filename.name + ".lock")
+        with open(lock_file, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = self.read_state(filename)
+                result = change(state)
+                self.write_state(filename, state)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return result
+
+    @staticmethod
+    def read_state(filename: Path) -> dict:
+        try:
+            with open(filename) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    @staticmethod
+    def write_state(filename: Path, state: dict):
+        temp_filename = filename.with_name(
+            filename.name + f".{os.getpid()}.tmp"
+        )
+        with open(temp_filename, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_filename, filename)
+
+
+def take(buckets: dict, name: str, rate: int, n_bytes: int, now: float):
+    """
+    Take tokens from a bucket (refilled at rate since it was last used)
+
+    :return: Time (s) until the bucket is out of debt
+    """
+    bucket = buckets.get(name, {"tokens": rate * BURST_SECONDS, "time": now})
+    tokens = min(
+        bucket["tokens"] + (now - bucket["time"]) * rate,
+        rate * BURST_SECONDS,
+    )
+    tokens -= n_bytes
+    buckets[name] = {"tokens": tokens, "time": now}
+    return -tokens / rate if tokens < 0 else 0.0
+
+
+def copy_throttled(source, destination, throttle: SharedThrottle):
+    """
+    Copy from one binary file object to another (e.g. stdin to stdout) at
+    no more than the throttle allows
+
+    :return: Bytes copied
+    """
+    copied = 0
+    while True:
+        data = source.read1(CHUNK_SIZE)
+        if not data:
+            break
+        throttle.acquire(len(data))
+        destination.write(data)
+        copied += len(data)
+    destination.flush()
+    return copied
@@ -0,0 +1,155 @@
+import shutil
+from typing import Iterable, Optional
+
+from synchro.utils.scan import FileEntry
+
+# If at least this fraction of the data is already compressed, don't
+# compress the archive
+SKIP_THRESHOLD = 0.5
+
+DEFAULT_SKIP_EXTENSIONS = (
+    ".bam",
+    ".cram",
+    ".gz",
+    ".bgz",
+    ".bz2",
+    ".xz",
+    ".zst",
+    ".lz4",
+    ".zip",
+    ".7z",
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".mp4",
+)
+
+
+class Codec:
+    """
+    A compression format that tar can use via an external program
+    ("tar -I <program>")
+
+    :param name: Name used in the config file
+    :param extension: Suffix added to the tar archive filename
+    :param compressor: Program (and options) used to compress
+    :param decompressor: Program used to decompress. tar adds "-d", so this
+    must not contain spaces (so it can be passed through ssh unquoted).
+    :param default_level: Compression level used if none is set
+    :param max_level: Highest supported compression level
+    :param rsyncable_flag: Option to compress in independent blocks, so a
+    small change to the input only changes the output nearby (and rsync
+    only sends the changed blocks), or None if not supported
+    """
+
+    def __init__(
+        self,
+        name,
+        extension,
+        compressor,
+        decompressor,
+        default_level,
+        max_level,
+        rsyncable_flag=None,
+    ):
+        self.name = name
+        self.extension = extension
+        self.compressor = compressor
+        self.decompressor = decompressor
+        self.default_level = default_level
+        self.max_level = max_level
+        self.rsyncable_flag = rsyncable_flag
+
+    def compress_program(
+        self, level: Optional[int] = None, rsyncable: bool = False
+    ) -> str:
+        """
+        Program (with options) for "tar -I" when creating an archive
+
+        :param level: Compression level, clipped to the supported range
+        :param rsyncable: Compress in a rsync-friendly way (if supported)
+        """
+        if level is None:
+            level = self.default_level
+        level = min(max(level, 1), self.max_level)
+        program = f"{self.compressor} -{level}"
+        if rsyncable and self.rsyncable_flag is not None:
+            program += f" {self.rsyncable_flag}"
+        return program
+
+
+def gzip_compressor() -> str:
+    """
+    Use the multi-threaded pigz if it's installed
+    """
+    return "pigz" if shutil.which("pigz") is not None else "gzip"
+
+
+CODECS = {
+    # gzip (1.7 or later) and pigz both support --rsyncable
+    "gzip": Codec(
+        "gzip",
+        ".gz",
+        gzip_compressor(),
+        "gzip",
+        6,
+        9,
+        rsyncable_flag="--rsyncable",
+    ),
+    "zstd": Codec(
+        "zstd",
+        ".zst",
+        "zstd -T0",
+        "zstd",
+        3,
+        19,
+        rsyncable_flag="--rsyncable",
+    ),
+    "lz4": Codec("lz4", ".lz4", "lz4", "lz4", 1, 12),
+}
+
+
+def get_codec(name: Optional[str]) -> Optional[Codec]:
+    """
+    :param name: Codec name (e.g. "zstd"). "none" or None for no compression
+    :return: Codec, or None for no compression
+    """
+    if name is None or name == "none":
+        return None
+    return CODECS[name]
+
+
+def incompressible_fraction(
+    entries: Iterable[FileEntry], skip_extensions: Iterable[str]
+) -> float:
+    """
+    Fraction of the total bytes in files that are already compressed
+    (judged by file extension)
+
+    :param entries: Files to check
+    :param skip_extensions: Extensions of already compressed formats
+    :return: Fraction of bytes (0-1)
+    """
+    skip_extensions = tuple(ext.lower() for ext in skip_extensions)
+    total = 0
+    skipped = 0
+    for entry in entries:
+        if entry.is_dir:
+            continue
+        total += entry.size
+        if entry.path.lower().endswith(skip_extensions):
+            skipped += entry.size
+    return skipped / total if total else 0.0
+
+
+def parse_extensions(string: str) -> tuple:
+    """
+    Parse a comma-separated list of file extensions from a config file
+
+    :param string: e.g. "bam, .cram,fastq.gz"
+    :return: e.g. (".bam", ".cram", ".fastq.gz")
+    """
+    extensions = [ext.strip() for ext in string.split(",") if ext.strip()]
+    return tuple(
+        ext if ext.startswith(".") else "." + ext for ext in extensions
+    )
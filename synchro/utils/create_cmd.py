@@ -1,18 +1,56 @@
+import shlex
+from typing import Optional
+
+from synchro.utils.ssh import control_options
+
+
 class DestinationDirectoryError(Exception):
     pass
 
 
-def add_ssh_prefix(cmd: list[str], remote_host: str) -> list:
+def add_ssh_prefix(
+    cmd: list[str], remote_host: str, control_path: Optional[str] = None
+) -> list:
     """
     Prefix a command with "ssh <remote_address>" for remote use
     :param cmd: Command to be run remotely
     :param remote_host: Remote machine address
+    :param control_path: Control socket of a master connection to reuse
     :return: Command with prefix
     """
-    ssh_string = ["ssh", remote_host]
+    ssh_string = ["ssh", *control_options(control_path), remote_host]
     return ssh_string + cmd
 
 
+REMOTE_STEP_MARKER = "@@synchro_step"
+
+
+def batch_remote_steps(
+    steps: list, remote_host: str, control_path: Optional[str] = None
+) -> list:
+    """
+    Combine several commands into a single ssh command, so they can be run
+    on a remote machine in one round trip. Each step's output is delimited
+    by marker lines (including its exit status), so it can be logged
+    separately. Steps are run in order, stopping at the first failure.
+
+    :param steps: List of (step name, command) tuples. Step names must not
+    contain whitespace.
+    :param remote_host: Remote machine address
+    :param control_path: Control socket of a master connection to reuse
+    :return: Command to run all the steps remotely
+    """
+    script = []
+    for name, cmd in steps:
+        script.append(
+            f"echo '{REMOTE_STEP_MARKER} {name} start'; "
+            f"{shlex.join(str(c) for c in cmd)} 2>&1; rc=$?; "
+            f'echo "{REMOTE_STEP_MARKER} {name} exit $rc"; '
+            f"[ $rc -eq 0 ] || exit $rc"
+        )
+    return add_ssh_prefix(["; ".join(script)], remote_host, control_path)
+
+
 def change_ownership_permission(
     tar,
     untar,
@@ -24,12 +62,18 @@ def change_ownership_permission(
     local_destination,
     remote_host,
     remote_destination=False,
+    control_path=None,
+    recursive=True,
 ):
     """
     Create command change permissions at destination
 
     Command depends on whether the tar archive, the destination directory
     or both will remain at the destination.
+
+    :param recursive: Change everything in the destination directory, rather
+    than just the directory itself (e.g. if the ownership & permissions of
+    its contents were already set during the transfer)
     """
     if tar:
         if delete_destination_tar and not untar:
@@ -38,8 +82,11 @@ def change_ownership_permission(
             )
 
     new_ownership = owner + ":" + group
-    chown_string = ["chown", "-R", new_ownership]
-    chmod_string = ["chmod", "-R", permissions]
+    chown_string = ["chown", new_ownership]
+    chmod_string = ["chmod", permissions]
+    if recursive:
+        chown_string.insert(1, "-R")
+        chmod_string.insert(1, "-R")
 
     if tar and untar and not delete_destination_tar:
         change_archive = True
@@ -71,17 +118,63 @@ def change_ownership_permission(
 
     if remote_destination:
         change_ownership_string = add_ssh_prefix(
-            change_ownership_string, remote_host
+            change_ownership_string, remote_host, control_path
         )
         change_permission_string = add_ssh_prefix(
-            change_permission_string, remote_host
+            change_permission_string, remote_host, control_path
         )
 
     return change_ownership_string, change_permission_string
 
 
+def rsync_ownership_permission_flags(owner, group, permissions):
+    """
+    rsync flags to set ownership and permissions as files are copied, with
+    the same result as chown -R & chmod -R afterwards
+    """
+    return [
+        f"--chown={owner}:{group}",
+        f"--chmod=D{permissions},F{permissions}",
+    ]
+
+
+def tar_ownership_permission_flags(owner, group, permissions):
+    """
+    tar flags to store the ownership and permissions in the archive (rather
+    than those of the source files), so they are set on extraction
+    """
+    return [f"--owner={owner}", f"--group={group}", f"--mode={permissions}"]
+
+
+def quiet_tar_flags(flags):
+    """
+    tar flags without verbose listing (-v), which is only removed from
+    clusters of short options (e.g. -xvpf), so long options (e.g.
+    --overwrite) are unchanged
+    """
+    quiet_flags = []
+    for flag in flags:
+        if flag.startswith("-") and not flag.startswith("--"):
+            flag = flag.replace("v", "")
+            if flag == "-":
+                continue
+        quiet_flags.append(flag)
+    return quiet_flags
+
+
+def reproducible_tar_flags():
+    """
+    tar flags for an archive that only changes where the files have: members
+    in name order (rather than the order the filesystem lists them), and
+    the GNU format, whose headers don't include access & change times, or
+    the process ID (as the POSIX format's extended headers do). Requires GNU
+    tar 1.28 or later.
+    """
+    return ["--sort=name", "--format=gnu"]
+
+
 def delete_destination_tarball_string(
-    dest_tar_archive, remote_host, remote_destination=False
+    dest_tar_archive, remote_host, remote_destination=False, control_path=None
 ):
     """
     Create command to delete tar archive after untar
@@ -95,5 +188,6 @@ def delete_destination_tarball_string(
         delete_dest_tarball_string = add_ssh_prefix(
             delete_dest_tarball_string,
             remote_host,
+            control_path,
         )
     return delete_dest_tarball_string
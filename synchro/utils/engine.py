@@ -0,0 +1,468 @@
+import os
+import time
+import shlex
+import signal
+import asyncio
+import logging
+import threading
+import subprocess
+import contextvars
+import codecs
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Optional
+
+from synchro.utils.tracing import child_span
+
+# Seconds between asking a command to stop (SIGTERM) and killing it
+KILL_TIMEOUT = 10.0
+READ_SIZE = 64 * 1024
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+NO_TIMEOUT = ("0", "none")
+
+# Timeout (s) for each command run in this context (e.g. a synchronisation)
+_command_timeout: contextvars.ContextVar[Optional[float]] = (
+    contextvars.ContextVar("command_timeout", default=None)
+)
+# Time (time.monotonic) by which every command run in this context (e.g. a
+# stage of a synchronisation) must have finished
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "deadline", default=None
+)
+
+
+def parse_duration(string: str) -> Optional[float]:
+    """
+    Parse a timeout from a config file
+
+    :param string: Seconds, with an optional s, m, h or d suffix (e.g.
+    "30m"), or 0/none
+    :return: Seconds, or None for no timeout
+    """
+    string = string.strip().lower()
+    if string in NO_TIMEOUT:
+        return None
+    if string[-1] in DURATION_UNITS:
+        return float(string[:-1]) * DURATION_UNITS[string[-1]]
+    return float(string)
+
+
+def parse_stage_timeouts(string: str) -> dict:
+    """
+    Parse the timeouts of the stages of a synchronisation from a config file
+
+    :param string: Comma-separated timeouts, either for a stage
+    ("rsync=12h") or the default for any other stage ("6h")
+    :return: Dict of stage name: seconds (or None for no timeout). The
+    default is under the key None.
+    """
+    timeouts: dict[Optional[str], Optional[float]] = {}
+    for item in string.split(","):
+        if not item.strip():
+            continue
+        if "=" in item:
+            stage, duration = item.split("=", 1)
+            timeouts[stage.strip()] = parse_duration(duration)
+        else:
+            timeouts[None] = parse_duration(item)
+    return timeouts
+
+
+@contextmanager
+def command_timeout(seconds: Optional[float]):
+    """
+    Stop any command run within this context (in this thread, or in tasks
+    and threads started with a copy of its context) that takes longer than
+    seconds. No timeout if None.
+    """
+    token = _command_timeout.set(seconds)
+    try:
+        yield
+    finally:
+        _command_timeout.reset(token)
+
+
+@contextmanager
+def stage_deadline(seconds: Optional[float]):
+    """
+    Stop any command run within this context that is still running seconds
+    from now (or by an earlier deadline already set). No deadline if None.
+    """
+    deadline = _deadline.get()
+    if seconds is not None:
+        stage_end = time.monotonic() + seconds
+        deadline = stage_end if deadline is None else min(deadline, stage_end)
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def effective_timeout(timeout: Optional[float] = None) -> Optional[float]:
+    """
+    :param timeout: Timeout (s) for a single command
+    :return: The shortest of the timeout, the command timeout and the time
+    left until the deadline of the current context (or None for no limit)
+    """
+    limits = [timeout, _command_timeout.get()]
+    deadline = _deadline.get()
+    if deadline is not None:
+        limits.append(max(deadline - time.monotonic(), 0.0))
+    limits_set = [limit for limit in limits if limit is not None]
+    return min(limits_set) if limits_set else None
+
+
+class LineSplitter:
+    """
+    Split a stream of bytes into lines of text, ending at "\\n", "\\r" or
+    "\\r\\n" (as rsync ends progress updates with "\\r")
+    """
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.buffer = ""
+
+    def feed(self, data: bytes) -> list:
+        text = self.buffer + self.decoder.decode(data)
+        # Keep a trailing "\r", in case the "\n" is in the next chunk
+        lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        if text.endswith("\r"):
+            lines[-2:] = [lines[-2] + "\r"]
+        self.buffer = lines.pop()
+        return lines
+
+    def flush(self) -> list:
+        text = self.buffer + self.decoder.decode(b"", final=True)
+        self.buffer = ""
+        text = text.rstrip("\r")
+        return [text] if text else []
+
+
+async def read_lines(stream, callback: Optional[Callable[[str], None]]):
+    """
+    Read a stream until it is closed, calling callback with each line (without
+    its line ending)
+    """
+    splitter = LineSplitter()
+    while True:
+        data = await stream.read(READ_SIZE)
+        lines = splitter.feed(data) if data else splitter.flush()
+        if callback is not None:
+            for line in lines:
+                callback(line)
+        if not data:
+            return
+
+
+async def stop_process(process: asyncio.subprocess.Process, group=True):
+    """
+    Stop a process and anything it started (its process group): ask it to
+    stop, and kill it if it hasn't within KILL_TIMEOUT seconds
+
+    :param process: Process to stop
+    :param group: The process leads its own process group (see
+    new_session), which is stopped too
+    """
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            if group:
+                os.killpg(process.pid, sig)
+            else:
+                process.send_signal(sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+        try:
+            await asyncio.wait_for(process.wait(), KILL_TIMEOUT)
+        except asyncio.TimeoutError:
+            continue
+        if group and sig == signal.SIGTERM:
+            # Anything left in the group
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        return
+
+
+def new_session(timeout: Optional[float]) -> bool:
+    """
+    Whether to run a command in its own session (and process group), so
+    that if it times out, anything it started (e.g. the ssh started by
+    rsync) is stopped with it. This detaches the command from the
+    terminal, so it can't prompt for input (e.g. an ssh password), so is
+    only done for commands with a timeout.
+    """
+    return timeout is not None
+
+
+async def run_command(
+    cmd: list,
+    callback: Optional[Callable[[str], None]] = None,
+    timeout: Optional[float] = None,
+):
+    """
+    Run a command, streaming its (combined stdout & stderr) output line by
+    line. The command is stopped if it times out (along with anything it
+    started, see new_session) or the task is cancelled.
+
+    :param cmd: Command to run
+    :param callback: Function called with each line of output
+    :param timeout: Seconds before the command is stopped (limited further
+    by any command timeout or stage deadline of the current context)
+    :raises subprocess.CalledProcessError: If the command fails
+    :raises subprocess.TimeoutExpired: If the command times out
+    """
+    timeout = effective_timeout(timeout)
+    group = new_session(timeout)
+    with command_span(cmd) as span:
+        process = await asyncio.create_subprocess_exec(
+            *[str(c) for c in cmd],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=group,
+        )
+
+        async def communicate():
+            await read_lines(process.stdout, callback)
+            return await process.wait()
+
+        try:
+            return_code = await asyncio.wait_for(communicate(), timeout)
+        except asyncio.TimeoutError:
+            # Only raised if there is a timeout
+            assert timeout is not None
+            logging.error(f"Command timed out after {timeout:.0f}s: {cmd}")
+            await stop_process(process, group)
+            raise subprocess.TimeoutExpired(cmd, timeout) from None
+        except BaseException:
+            await stop_process(process, group)
+            raise
+        if span is not None:
+            span.attributes["exit_code"] = return_code
+        if return_code:
+            raise subprocess.CalledProcessError(return_code, cmd)
+
+
+async def run_commands(
+    cmds: list,
+    callbacks: Optional[list] = None,
+    timeout: Optional[float] = None,
+):
+    """
+    Run several commands at once. All commands are run to completion, and
+    then the first error (if any) is raised.
+
+    :param cmds: Commands to run
+    :param callbacks: Functions called with each line of output of each
+    command
+    :param timeout: Seconds before each command is stopped
+    """
+    if callbacks is None:
+        callbacks = [None] * len(cmds)
+    results = await asyncio.gather(
+        *[
+            run_command(cmd, callback, timeout)
+            for cmd, callback in zip(cmds, callbacks)
+        ],
+        return_exceptions=True,
+    )
+    errors = [result for result in results if isinstance(result, Exception)]
+    for error in errors:
+        logging.error(f"Command failed: {error}")
+    if errors:
+        raise errors[0]
+
+
+async def run_pipeline(
+    cmds: list,
+    callback: Optional[Callable[[str], None]] = None,
+    timeout: Optional[float] = None,
+):
+    """
+    Run a pipeline of commands (cmd1 | cmd2 | ...), streaming the stderr of
+    every stage and the stdout of the final stage, interleaved. Every stage
+    is stopped if the pipeline times out or the task is cancelled.
+
+    :param cmds: Commands to connect together
+    :param callback: Function called with each line of output
+    :param timeout: Seconds before the pipeline is stopped
+    :raises subprocess.CalledProcessError: For the stage that caused the
+    failure, if any stage fails (see check_pipeline_return_codes)
+    """
+    pipeline = " | ".join(shlex.join(str(c) for c in cmd) for cmd in cmds)
+    with child_span("pipeline", command=pipeline) as span:
+        return_codes = await _run_pipeline(cmds, callback, timeout)
+        if span is not None:
+            span.attributes["exit_codes"] = return_codes
+    check_pipeline_return_codes(cmds, return_codes)
+
+
+async def _run_pipeline(cmds, callback, timeout):
+    """
+    :return: Exit status of each command
+    """
+    timeout = effective_timeout(timeout)
+    group = new_session(timeout)
+    read_fd, write_fd = os.pipe()
+    processes = []
+    stdin = None
+    try:
+        for i, cmd in enumerate(cmds):
+            last = i == len(cmds) - 1
+            if last:
+                next_stdin, stdout = None, write_fd
+            else:
+                next_stdin, stdout = os.pipe()
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *[str(c) for c in cmd],
+                    stdin=stdin,
+                    stdout=stdout,
+                    stderr=write_fd,
+                    start_new_session=group,
+                )
+            finally:
+                # The parent's copies must be closed so that SIGPIPE reaches
+                # upstream stages if a downstream stage exits early
+                if stdin is not None:
+                    os.close(stdin)
+                stdin = next_stdin
+                if not last:
+                    os.close(stdout)
+            processes.append(process)
+    except BaseException:
+        if stdin is not None:
+            os.close(stdin)
+        os.close(write_fd)
+        os.close(read_fd)
+        for process in processes:
+            await stop_process(process, group)
+        raise
+    os.close(write_fd)
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader),
+        os.fdopen(read_fd, "rb", buffering=0),
+    )
+
+    async def communicate():
+        await read_lines(reader, callback)
+        return [await process.wait() for process in processes]
+
+    try:
+        return_codes = await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        # Only raised if there is a timeout
+        assert timeout is not None
+        logging.error(f"Pipeline timed out after {timeout:.0f}s: {cmds}")
+        for process in processes:
+            await stop_process(process, group)
+        raise subprocess.TimeoutExpired(cmds, timeout) from None
+    except BaseException:
+        for process in processes:
+            await stop_process(process, group)
+        raise
+    finally:
+        transport.close()
+    return return_codes
+
+
+def command_span(cmd: list, **attributes):
+    """
+    Record a command as a span of the current trace (if any)
+    """
+    return child_span(
+        Path(str(cmd[0])).name,
+        command=shlex.join(str(c) for c in cmd),
+        **attributes,
+    )
+
+
+def check_pipeline_return_codes(cmds, return_codes):
+    """
+    Log every failed stage of a pipeline, and raise an error for the stage
+    that caused the failure. Upstream stages killed by SIGPIPE are a
+    consequence of a downstream failure, so are only blamed if no other
+    stage failed.
+
+    :param cmds: List of terminal commands that made up the pipeline
+    :param return_codes: Exit status of each command
+    """
+    failed = [
+        (cmd, return_code)
+        for cmd, return_code in zip(cmds, return_codes)
+        if return_code
+    ]
+    if not failed:
+        return
+
+    for cmd, return_code in failed:
+        logging.error(
+            f"Pipeline stage: {cmd} failed with exit status: {return_code}"
+        )
+    sigpipe = -signal.SIGPIPE
+    root_causes = [stage for stage in failed if stage[1] != sigpipe]
+    cmd, return_code = root_causes[0] if root_causes else failed[0]
+    raise subprocess.CalledProcessError(return_code, cmd)
+
+
+class CommandEngine:
+    """
+    Event loop (in a background thread) that runs the commands of every
+    synchronisation in this process, so that blocking code (in any thread)
+    can run commands concurrently, with timeouts and cancellation. If the
+    thread waiting for a command is interrupted (e.g. by Ctrl-C), the
+    command is stopped.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.pid = os.getpid()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="synchro-commands", daemon=True
+        )
+        self.thread.start()
+
+    def run(self, coroutine):
+        """
+        Run a coroutine (e.g. run_command(...)) in the engine's event loop,
+        and wait for the result
+        """
+        finished = threading.Event()
+
+        async def run_until_finished():
+            try:
+                return await coroutine
+            finally:
+                finished.set()
+
+        future = asyncio.run_coroutine_threadsafe(
+            run_until_finished(), self.loop
+        )
+        try:
+            return future.result()
+        except BaseException:
+            # e.g. KeyboardInterrupt: stop the command before returning
+            future.cancel()
+            finished.wait(KILL_TIMEOUT * 2)
+            raise
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> CommandEngine:
+    """
+    The command engine of this process (a new one is started in processes
+    forked from one that already has one, as its thread isn't copied)
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None or _engine.pid != os.getpid():
+            _engine = CommandEngine()
+        return _engine
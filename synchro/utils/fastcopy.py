@@ -0,0 +1,372 @@
+import os
+import stat
+import time
+import errno
+import shutil
+import logging
+import threading
+import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Union
+
+from synchro.utils.engine import effective_timeout
+from synchro.utils.scan import FileEntry, scan_directory
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover (not on Windows)
+    fcntl = None  # type: ignore[assignment]
+
+# "copy" uses the fastest method available for each file (a reflink, then
+# copy_file_range, then reading & writing), "hardlink" links each file to
+# the source if possible
+LOCAL_COPY_POLICIES = ("rsync", "copy", "hardlink")
+# ioctl to clone a file's extents (a reflink) on Linux (btrfs, XFS, etc.)
+FICLONE = 0x40049409
+# Bytes copied at once by copy_file_range, or when reading & writing
+CHUNK_SIZE = 8 * 1024 * 1024
+# Files copied at once
+COPY_THREADS = 8
+# Errors meaning a fast path isn't supported here (e.g. the destination is
+# on another filesystem), so the next method is tried
+UNSUPPORTED_ERRORS = {
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EPERM,
+}
+
+
+def reflink(source_fd: int, destination_fd: int):
+    """
+    Share the source file's data with the (empty) destination file, so
+    nothing is copied until either is changed
+    """
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "reflinks not supported")
+    fcntl.ioctl(destination_fd, FICLONE, source_fd)
+
+
+def copy_file_range(source_fd: int, destination_fd: int, size: int):
+    """
+    Copy within the kernel (which may share the data, or copy it on the
+    server for network filesystems)
+    """
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range not supported")
+    copied = 0
+    while True:
+        # Ask for the rest of the file at once (in case the filesystem can
+        # share the data), but keep going if it grew
+        n_bytes = os.copy_file_range(
+            source_fd, destination_fd, max(size - copied, CHUNK_SIZE)
+        )
+        if n_bytes == 0:
+            break
+        copied += n_bytes
+
+
+def read_write(source_fd: int, destination_fd: int):
+    with (
+        open(source_fd, "rb", closefd=False) as source,
+        open(destination_fd, "wb", closefd=False) as destination,
+    ):
+        shutil.copyfileobj(source, destination, CHUNK_SIZE)
+
+
+def temporary_path(path: str) -> str:
+    """
+    Where to write a file before it is renamed into place (so an
+    interrupted copy never leaves a partial file), as rsync does
+    """
+    directory, name = os.path.split(path)
+    return os.path.join(
+        directory, f".{name}.synchro.{os.getpid()}.{threading.get_ident()}"
+    )
+
+
+def unchanged(
+    source_stat: os.stat_result, destination_stat: Optional[os.stat_result]
+) -> bool:
+    """
+    rsync's quick check: whether the destination already has the same type,
+    size and modification time as the source (or is a hardlink to it)
+    """
+    if destination_stat is None:
+        return False
+    if os.path.samestat(source_stat, destination_stat):
+        return True
+    return (
+        stat.S_IFMT(destination_stat.st_mode)
+        == stat.S_IFMT(source_stat.st_mode)
+        and destination_stat.st_size == source_stat.st_size
+        and destination_stat.st_mtime_ns == source_stat.st_mtime_ns
+    )
+
+
+def copy_metadata(source_stat: os.stat_result, path: str):
+    """
+    Set the metadata that rsync -a preserves: ownership (only if running as
+    root, otherwise just the group, if allowed), permissions and
+    modification time. Symlinks themselves are changed, not their targets.
+    """
+    is_link = stat.S_ISLNK(source_stat.st_mode)
+    if os.geteuid() == 0:
+        os.chown(
+            path, source_stat.st_uid, source_stat.st_gid, follow_symlinks=False
+        )
+    else:
+        try:
+            os.chown(path, -1, source_stat.st_gid, follow_symlinks=False)
+        except PermissionError:
+            pass
+    if not is_link:
+        # After chown, which clears the setuid & setgid bits
+        os.chmod(path, stat.S_IMODE(source_stat.st_mode))
+    if not is_link or os.utime in os.supports_follow_symlinks:
+        os.utime(
+            path,
+            ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns),
+            follow_symlinks=False,
+        )
+
+
+def lstat_or_none(path: str) -> Optional[os.stat_result]:
+    try:
+        return os.lstat(path)
+    except FileNotFoundError:
+        return None
+
+
+class FastCopy:
+    """
+    Copy a directory tree on this machine, as rsync -a would, using the
+    fastest method the filesystems support for each file, and copying
+    several files at once. Files that are already at the destination (with
+    the same size & modification time) are not copied again.
+
+    :param source: Directory to copy the contents of
+    :param destination: Directory to copy into (created if needed)
+    :param policy: "copy" or "hardlink" (see LOCAL_COPY_POLICIES)
+    :param threads: Number of files to copy at once
+    :param callback: Called with the relative path of each file copied
+    """
+
+    def __init__(
+        self,
+        source: Union[Path, str],
+        destination: Union[Path, str],
+        policy: str = "copy",
+        threads: int = COPY_THREADS,
+        callback: Optional[Callable[[str], None]] = None,
+    ):
+        if policy not in LOCAL_COPY_POLICIES[1:]:
+            raise ValueError(f"Local copy policy not supported: {policy}")
+        self.source = str(source)
+        self.destination = str(destination)
+        self.policy = policy
+        self.threads = max(threads, 1)
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.deadline: Optional[float] = None
+        # Files created by each method, and bytes copied
+        self.methods: Counter[str] = Counter()
+        self.bytes_copied = 0
+        # Methods found not to work for this source & destination
+        self.unsupported: set[str] = set()
+
+    def copy(self, entries: Optional[Iterable[FileEntry]] = None):
+        """
+        Copy the files & directories. Directories are created first, and
+        their permissions & times are set last (deepest first), so that
+        copying their contents doesn't change them. Stops (raising
+        TimeoutExpired) if the stage deadline or command timeout is reached.
+
+        :param entries: Files & directories to copy (and the directories
+        they are in). Default: everything in the source directory.
+        """
+        if entries is None:
+            entries = scan_directory(self.source)
+        timeout = effective_timeout()
+        if timeout is not None:
+            self.deadline = time.monotonic() + timeout
+
+        found_directories, others = {""}, []
+        for entry in entries:
+            if entry.is_dir:
+                found_directories.add(entry.path)
+            else:
+                others.append(entry.path)
+            parent = os.path.dirname(entry.path)
+            while parent not in found_directories:
+                found_directories.add(parent)
+                parent = os.path.dirname(parent)
+
+        directories = sorted(found_directories)
+        for directory in directories:
+            path = os.path.join(self.destination, directory)
+            os.makedirs(path, exist_ok=True)
+            if not os.access(path, os.W_OK | os.X_OK):
+                # e.g. read-only from an earlier copy, until its permissions
+                # are set again at the end
+                os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) | 0o700)
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            # Raises the first error (if any)
+            for _ in executor.map(self.copy_entry, others):
+                pass
+        for directory in reversed(directories):
+            copy_metadata(
+                os.lstat(os.path.join(self.source, directory)),
+                os.path.join(self.destination, directory),
+            )
+        logging.info(self.summary())
+
+    def check_deadline(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise subprocess.TimeoutExpired(
+                ["copy", self.source, self.destination], effective_timeout()
+            )
+
+    def copy_entry(self, path: str):
+        """
+        Copy a file, symlink or special file, and its metadata. If the file
+        is already at the destination, only its metadata is updated (as
+        rsync does).
+
+        :param path: Path relative to the source directory
+        """
+        self.check_deadline()
+        source_path = os.path.join(self.source, path)
+        destination_path = os.path.join(self.destination, path)
+        source_stat = os.lstat(source_path)
+        destination_stat = lstat_or_none(destination_path)
+        if destination_stat is not None and unchanged(
+            source_stat, destination_stat
+        ):
+            method = "unchanged"
+            if not os.path.samestat(source_stat, destination_stat):
+                copy_metadata(source_stat, destination_path)
+        else:
+            temporary = temporary_path(destination_path)
+            try:
+                created = self.create(source_path, temporary, source_stat)
+                if created is None:
+                    return
+                method = created
+                if method != "hardlink":
+                    copy_metadata(source_stat, temporary)
+                os.replace(temporary, destination_path)
+            except BaseException:
+                if os.path.lexists(temporary):
+                    os.unlink(temporary)
+                raise
+
+        with self.lock:
+            self.methods[method] += 1
+            if method in ("reflink", "copy_file_range", "read_write"):
+                self.bytes_copied += source_stat.st_size
+        if self.callback is not None:
+            self.callback(path)
+
+    def create(
+        self, source_path: str, path: str, source_stat: os.stat_result
+    ) -> Optional[str]:
+        """
+        Create a copy of a file, symlink or special file (without its
+        metadata)
+
+        :return: The method used, or None if the file was skipped
+        """
+        mode = source_stat.st_mode
+        if stat.S_ISLNK(mode):
+            os.symlink(os.readlink(source_path), path)
+            return "symlink"
+        if stat.S_ISREG(mode):
+            return self.copy_file(source_path, path, source_stat.st_size)
+        try:
+            # Devices (only as root), FIFOs & sockets, as rsync -D
+            os.mknod(path, mode, source_stat.st_rdev)
+        except PermissionError:
+            logging.warning(f"Skipping special file (not root): {source_path}")
+            return None
+        return "special"
+
+    def copy_file(self, source_path: str, path: str, size: int) -> str:
+        """
+        Copy a regular file with the first method that works
+
+        :return: The method used
+        """
+        if self.policy == "hardlink" and "hardlink" not in self.unsupported:
+            try:
+                os.link(source_path, path)
+                return "hardlink"
+            except OSError as error:
+                self.check_unsupported(error, "hardlink")
+
+        source_fd = os.open(source_path, os.O_RDONLY)
+        try:
+            destination_fd = os.open(
+                path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600
+            )
+            try:
+                return self.copy_data(source_fd, destination_fd, size)
+            finally:
+                os.close(destination_fd)
+        finally:
+            os.close(source_fd)
+
+    def copy_data(self, source_fd: int, destination_fd: int, size: int) -> str:
+        """
+        Copy the data of a file, trying the kernel's fast paths first
+
+        :return: The method used
+        """
+        if size == 0:
+            return "empty"
+        fast_paths = {
+            "reflink": lambda: reflink(source_fd, destination_fd),
+            "copy_file_range": lambda: copy_file_range(
+                source_fd, destination_fd, size
+            ),
+        }
+        for method, copy in fast_paths.items():
+            if method in self.unsupported:
+                continue
+            try:
+                copy()
+                return method
+            except OSError as error:
+                self.check_unsupported(error, method)
+                # Start again, in case it failed part way through
+                os.lseek(source_fd, 0, os.SEEK_SET)
+                os.lseek(destination_fd, 0, os.SEEK_SET)
+                os.ftruncate(destination_fd, 0)
+        read_write(source_fd, destination_fd)
+        return "read_write"
+
+    def check_unsupported(self, error: OSError, method: str):
+        """
+        Raise the error, unless it means the method isn't supported here
+        (in which case it isn't tried again)
+        """
+        if error.errno not in UNSUPPORTED_ERRORS:
+            raise error
+        with self.lock:
+            if method not in self.unsupported:
+                logging.debug(f"Not using {method}: {error}")
+                self.unsupported.add(method)
+
+    def summary(self) -> str:
+        methods = ", ".join(
+            f"{method}: {count}"
+            for method, count in sorted(self.methods.items())
+        )
+        return (
+            f"Copied {sum(self.methods.values())} files "
+            f"({methods or 'none'}), {self.bytes_copied} bytes"
+        )
@@ -0,0 +1,206 @@
+import os
+import time
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from typing import Optional, Union
+
+# Number of transfers to each host used to estimate throughput
+MAX_RUNS = 20
+# Seconds to wait for another synchro process to finish writing
+TIMEOUT = 30.0
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    finished REAL NOT NULL,
+    config TEXT,
+    source TEXT,
+    destination TEXT,
+    host TEXT NOT NULL,
+    status TEXT NOT NULL,
+    bytes INTEGER,
+    files INTEGER,
+    seconds REAL,
+    throughput REAL,
+    resumed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS runs_host ON runs (host, started);
+CREATE TABLE IF NOT EXISTS stages (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    stage TEXT NOT NULL,
+    seconds REAL
+);
+CREATE INDEX IF NOT EXISTS stages_run ON stages (run_id);
+"""
+# strftime formats used to group runs by period
+PERIODS = {"day": "%Y-%m-%d", "week": "%Y-W%W", "month": "%Y-%m"}
+
+
+def default_history_file() -> Path:
+    cache = os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+    return Path(cache) / "synchro" / "history.db"
+
+
+def connect(filename: Union[Path, str, None] = None) -> sqlite3.Connection:
+    """
+    Open the run history database, creating it if needed
+
+    :param filename: Database file (default: in the user's cache)
+    """
+    if filename is None:
+        filename = default_history_file()
+    filename = Path(filename)
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(filename, timeout=TIMEOUT)
+    connection.row_factory = sqlite3.Row
+    if connection.execute("PRAGMA user_version").fetchone()[0] == 0:
+        with connection:
+            connection.executescript(SCHEMA)
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return connection
+
+
+def record_run(
+    run: dict,
+    stages: dict,
+    filename: Union[Path, str, None] = None,
+) -> Optional[int]:
+    """
+    Save a synchronisation (successful or not) to the run history
+
+    :param run: Columns of the runs table (host, status, bytes, files,
+    started, etc.). The duration and throughput are calculated if missing.
+    :param stages: Dict of stage name: duration (s), or None if the stage
+    didn't finish
+    :param filename: Database file
+    :return: ID of the run
+    """
+    run = dict(run)
+    run.setdefault("finished", time.time())
+    run.setdefault("seconds", run["finished"] - run["started"])
+    if run.get("bytes") is not None and run["seconds"]:
+        run.setdefault("throughput", run["bytes"] / run["seconds"])
+    columns = ", ".join(run)
+    placeholders = ", ".join(f":{column}" for column in run)
+
+    with closing(connect(filename)) as connection, connection:
+        cursor = connection.execute(
+            f"INSERT INTO runs ({columns}) VALUES ({placeholders})", run
+        )
+        connection.executemany(
+            "INSERT INTO stages (run_id, stage, seconds) VALUES (?, ?, ?)",
+            [(cursor.lastrowid, name, secs) for name, secs in stages.items()],
+        )
+    return cursor.lastrowid
+
+
+def estimate_throughput(
+    host: str, filename: Union[Path, str, None] = None
+) -> Optional[float]:
+    """
+    :return: Average throughput (bytes per second) of the recent successful
+    transfers to a host (weighted by size), or None if there are none.
+    Resumed transfers are ignored, as only part of the work was timed.
+    """
+    if not Path(filename or default_history_file()).exists():
+        return None
+    with closing(connect(filename)) as connection:
+        n_bytes, seconds = connection.execute(
+            """
+            SELECT SUM(bytes), SUM(seconds) FROM (
+                SELECT bytes, seconds FROM runs
+                WHERE host = ? AND status = 'success' AND NOT resumed
+                ORDER BY started DESC LIMIT ?
+            )
+            """,
+            (host, MAX_RUNS),
+        ).fetchone()
+    if not n_bytes or not seconds:
+        return None
+    return n_bytes / seconds
+
+
+def throughput_by_host(
+    filename: Union[Path, str, None] = None,
+    period: str = "day",
+    host: Optional[str] = None,
+) -> list:
+    """
+    Throughput of successful transfers to each host, per day, week or month
+
+    :return: Rows of host, period, runs, bytes, throughput (bytes/s)
+    """
+    return query(
+        f"""
+        SELECT host,
+            strftime('{PERIODS[period]}', started, 'unixepoch', 'localtime')
+                AS period,
+            COUNT(*) AS runs,
+            SUM(bytes) AS bytes,
+            SUM(bytes) / SUM(seconds) AS throughput
+        FROM runs
+        WHERE status = 'success' AND NOT resumed
+            AND (:host IS NULL OR host = :host)
+        GROUP BY host, period
+        ORDER BY host, period
+        """,
+        {"host": host},
+        filename,
+    )
+
+
+def slowest_stages(
+    filename: Union[Path, str, None] = None,
+    limit: int = 10,
+    host: Optional[str] = None,
+) -> list:
+    """
+    The longest stages of any synchronisation
+
+    :return: Rows of stage, seconds, host, config, source, started
+    """
+    return query(
+        """
+        SELECT stages.stage, stages.seconds, runs.host, runs.config,
+            runs.source, runs.started
+        FROM stages JOIN runs ON stages.run_id = runs.id
+        WHERE stages.seconds IS NOT NULL
+            AND (:host IS NULL OR runs.host = :host)
+        ORDER BY stages.seconds DESC
+        LIMIT :limit
+        """,
+        {"host": host, "limit": limit},
+        filename,
+    )
+
+
+def failure_rates(
+    filename: Union[Path, str, None] = None, host: Optional[str] = None
+) -> list:
+    """
+    :return: Rows of host, runs, failures, failure rate (0-1), and when the
+    last failure started
+    """
+    return query(
+        """
+        SELECT host,
+            COUNT(*) AS runs,
+            SUM(status != 'success') AS failures,
+            AVG(status != 'success') AS rate,
+            MAX(CASE WHEN status != 'success' THEN started END)
+                AS last_failure
+        FROM runs
+        WHERE (:host IS NULL OR host = :host)
+        GROUP BY host
+        ORDER BY host
+        """,
+        {"host": host},
+        filename,
+    )
+
+
+def query(sql: str, parameters: dict, filename: Union[Path, str, None]):
+    with closing(connect(filename)) as connection:
+        return connection.execute(sql, parameters).fetchall()
@@ -0,0 +1,104 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import Iterable, Union
+
+from synchro.utils.scan import FileEntry
+
+JOURNAL_VERSION = 1
+
+
+def source_fingerprint(entries: Iterable[FileEntry], config: str) -> str:
+    """
+    Fingerprint of the source directory (the path, size and modification
+    time of every file and directory) and the config, used to check that
+    nothing has changed since a checkpoint
+
+    :param entries: Scanned source directory
+    :param config: Contents of the config file
+    :return: Hex digest
+    """
+    digest = hashlib.sha1(config.encode("utf-8", "surrogateescape"))
+    for entry in sorted(entries):
+        record = f"{entry.path}\0{entry.size}\0{entry.mtime_ns}\0"
+        digest.update(record.encode("utf-8", "surrogateescape"))
+    return digest.hexdigest()
+
+
+class Journal:
+    """
+    Record which stages of a synchronisation have started and completed,
+    so that an interrupted synchronisation can resume from the first
+    unfinished stage. The journal is saved after every change (atomically,
+    so an interruption while saving leaves the previous state intact).
+
+    :param filename: Where the journal is saved
+    :param fingerprint: Fingerprint of the source (from source_fingerprint)
+    """
+
+    def __init__(self, filename: Union[Path, str], fingerprint: str):
+        self.filename = Path(filename)
+        self.fingerprint = fingerprint
+        self.started: list[str] = []
+        self.completed: list[str] = []
+
+    @classmethod
+    def load(cls, filename: Union[Path, str], fingerprint: str):
+        """
+        Load a journal from an interrupted synchronisation
+
+        :return: Journal, or None if there isn't one, or the source has
+        changed since it was saved
+        """
+        try:
+            with open(filename) as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if (
+            state.get("version") != JOURNAL_VERSION
+            or state.get("fingerprint") != fingerprint
+        ):
+            return None
+        journal = cls(filename, fingerprint)
+        journal.started = state["started"]
+        journal.completed = state["completed"]
+        return journal
+
+    def is_started(self, stage: str) -> bool:
+        return stage in self.started
+
+    def is_completed(self, stage: str) -> bool:
+        return stage in self.completed
+
+    def start(self, stage: str):
+        if stage not in self.started:
+            self.started.append(stage)
+            self.save()
+
+    def complete(self, stage: str):
+        if stage not in self.completed:
+            self.completed.append(stage)
+            self.save()
+
+    def save(self):
+        temp_filename = self.filename.with_name(self.filename.name + ".tmp")
+        with open(temp_filename, "w") as f:
+            json.dump(
+                {
+                    "version": JOURNAL_VERSION,
+                    "fingerprint": self.fingerprint,
+                    "started": self.started,
+                    "completed": self.completed,
+                },
+                f,
+                indent=2,
+            )
+        os.replace(temp_filename, self.filename)
+
+    def remove(self):
+        """
+        Remove the journal once the synchronisation has finished
+        """
+        self.filename.unlink(missing_ok=True)
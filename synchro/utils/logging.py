@@ -1,25 +1,54 @@
+import re
 import sys
+import time
+import queue
 import logging
+import logging.handlers
+from collections import deque
 from pathlib import Path
 from datetime import datetime
 from typing import Optional
 
+# Logger for the output of commands (e.g. one line per file from tar -v)
+OUTPUT_LOGGER = "synchro.output"
+# Lines of command output that are always logged in full
+ERROR_PATTERN = re.compile(
+    r"error|fail|cannot|denied|no such file|warning", re.IGNORECASE
+)
+
+
+def log_formatter(prefix: Optional[str] = None) -> logging.Formatter:
+    """
+    :param prefix: Added to the start of each line (e.g. to tell apart the
+    logs of synchronisations running at once)
+    """
+    if prefix is None:
+        formatter = logging.Formatter()
+    else:
+        prefix = prefix.replace("%", "%%")
+        formatter = logging.Formatter(f"[{prefix}] %(message)s")
+    formatter.datefmt = "%Y-%m-%d %H:%M:%S %p"
+    return formatter
+
 
 def initalise_logger(
-    filename: str, print_level: str = "INFO", file_level: str = "DEBUG"
+    filename: str,
+    print_level: str = "INFO",
+    file_level: str = "DEBUG",
+    prefix: Optional[str] = None,
 ) -> logging.Logger:
     """
     Start logging to file and stdout
     :param filename: Where to save the logs to
     :param print_level: What level of logging to send to stdout.
     :param file_level: What level of logging to print to file.
+    :param prefix: Added to the start of each line
     """
 
     logger = logging.getLogger()
     logger.setLevel(getattr(logging, file_level))
 
-    formatter = logging.Formatter()
-    formatter.datefmt = "%Y-%m-%d %H:%M:%S %p"
+    formatter = log_formatter(prefix)
 
     if filename is not None:
         fh = logging.FileHandler(filename)
@@ -34,14 +63,221 @@ def initalise_logger(
     return logger
 
 
+def initalise_queue_logger(
+    filename: str,
+    print_level: str = "INFO",
+    file_level: str = "DEBUG",
+    summary_interval: float = 10.0,
+    max_queue_size: int = 10000,
+    max_log_size: Optional[int] = None,
+    start: bool = True,
+    prefix: Optional[str] = None,
+) -> logging.handlers.QueueListener:
+    """
+    Start logging to file and stdout, with the output written by a
+    background thread. Command output is summarised periodically, rather
+    than logged line by line (see SummarisingQueueHandler).
+
+    :param filename: Where to save the logs to
+    :param print_level: What level of logging to send to stdout.
+    :param file_level: What level of logging to print to file.
+    :param summary_interval: Seconds between summaries of command output
+    :param max_queue_size: Maximum number of records waiting to be written
+    :param max_log_size: Maximum size of the log file (bytes) before only
+    warnings and errors are written. No limit if None.
+    :param start: Start the background thread now. Otherwise, records wait
+    in the queue until the listener is started.
+    :param prefix: Added to the start of each line
+    :return: Listener that writes the logs. Stop with stop_queue_logger.
+    """
+    logger = logging.getLogger()
+    logger.setLevel(getattr(logging, file_level))
+
+    formatter = log_formatter(prefix)
+
+    handlers: list[logging.Handler] = []
+    if filename is not None:
+        fh = CappedFileHandler(filename, max_log_size)
+        fh.setLevel(getattr(logging, file_level))
+        fh.setFormatter(formatter)
+        handlers.append(fh)
+
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setLevel(getattr(logging, print_level))
+    ch.setFormatter(formatter)
+    handlers.append(ch)
+
+    log_queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+    listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    if start:
+        listener.start()
+    logger.addHandler(SummarisingQueueHandler(log_queue, summary_interval))
+    return listener
+
+
+def stop_queue_logger(listener: logging.handlers.QueueListener):
+    """
+    Write any remaining logs, and stop the background thread
+    """
+    logger = logging.getLogger()
+    for handler in logger.handlers[:]:
+        if getattr(handler, "queue", None) is listener.queue:
+            logger.removeHandler(handler)
+            handler.close()
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+class SummarisingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Pass log records to a background thread (via a bounded queue), so that
+    writing the logs doesn't slow down the transfer.
+
+    Command output (e.g. one line per file) is counted and summarised every
+    summary_interval seconds, rather than logged in full. Lines that look
+    like errors are always logged, and the most recent lines are logged in
+    full before any warning or error, to give them context. If the queue is
+    full, debug records are dropped (and counted) rather than waiting.
+
+    :param log_queue: Bounded queue read by a QueueListener
+    :param summary_interval: Seconds between summaries of command output
+    :param context_lines: Number of recent lines of output to keep
+    """
+
+    def __init__(self, log_queue, summary_interval=10.0, context_lines=20):
+        super().__init__(log_queue)
+        self.summary_interval = summary_interval
+        self.recent = deque(maxlen=context_lines)
+        self.summarised = 0
+        self.last_line = None
+        self.dropped = 0
+        self.last_summary = time.monotonic()
+
+    def emit(self, record):
+        if record.levelno >= logging.WARNING:
+            self.emit_context()
+        elif record.name == OUTPUT_LOGGER:
+            if ERROR_PATTERN.search(record.getMessage()) is None:
+                self.recent.append(record)
+                self.last_line = record
+                self.summarised += 1
+                if (
+                    time.monotonic() - self.last_summary
+                    >= self.summary_interval
+                ):
+                    self.emit_summary()
+                return
+        self.enqueue_record(record)
+
+    def enqueue_record(self, record):
+        try:
+            if record.levelno > logging.DEBUG:
+                self.enqueue(self.prepare(record))
+            else:
+                self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def enqueue(self, record):
+        # Wait for space, rather than lose important records
+        self.queue.put(record)
+
+    def emit_summary(self):
+        """
+        Log the number of lines of output since the last summary
+        """
+        self.last_summary = time.monotonic()
+        if not self.summarised:
+            return
+        message = f"{self.summarised} lines of output"
+        if self.last_line is not None:
+            message += f" (last: {self.last_line.getMessage()})"
+        if self.dropped:
+            message += f", {self.dropped} log records dropped"
+            self.dropped = 0
+        self.summarised = 0
+        self.enqueue_record(
+            logging.makeLogRecord(
+                {
+                    "name": OUTPUT_LOGGER,
+                    "levelno": logging.DEBUG,
+                    "levelname": "DEBUG",
+                    "msg": message,
+                }
+            )
+        )
+
+    def emit_context(self):
+        """
+        Log the most recent lines of output in full
+        """
+        while self.recent:
+            self.enqueue_record(self.recent.popleft())
+
+    def close(self):
+        self.acquire()
+        try:
+            self.emit_summary()
+        finally:
+            self.release()
+        super().close()
+
+
+class CappedFileHandler(logging.FileHandler):
+    """
+    Log to a file, until it reaches a maximum size. After that, only
+    warnings and errors are written.
+
+    :param filename: Where to save the logs to
+    :param max_bytes: Maximum size of the log file. No limit if None.
+    """
+
+    def __init__(self, filename, max_bytes=None):
+        super().__init__(filename)
+        self.max_bytes = max_bytes
+        self.capped = False
+
+    def emit(self, record):
+        if self.max_bytes is not None and record.levelno < logging.WARNING:
+            if (
+                self.stream is not None
+                and self.stream.tell() >= self.max_bytes
+            ):
+                if not self.capped:
+                    self.capped = True
+                    super().emit(
+                        logging.makeLogRecord(
+                            {
+                                "levelno": logging.WARNING,
+                                "levelname": "WARNING",
+                                "msg": (
+                                    f"Log file reached {self.max_bytes} "
+                                    f"bytes, only logging warnings and "
+                                    f"errors from now on"
+                                ),
+                            }
+                        )
+                    )
+                return
+        super().emit(record)
+
+
 def write_log_header(
     start_time: datetime,
     source_directory: Path,
     destination_directory: Path,
-    rsync_string: str,
+    rsync_string: Optional[str],
     tar_string: Optional[str] = None,
     untar_string: Optional[str] = None,
     delete_dest_tarball_string: Optional[str] = None,
+    stream_strings: Optional[list] = None,
+    rsync_shard_strings: Optional[list] = None,
+    remote_post_sync_string: Optional[list] = None,
 ):
     """
     Write a standardised header to the log file
@@ -59,11 +295,23 @@ def write_log_header(
     logging.debug(f"Destination directory: {destination_directory}")
     if tar_string is not None:
         logging.debug(f"tar command: {tar_string}")
-    logging.debug(f"rsync command: {rsync_string}")
+    if rsync_string is not None:
+        logging.debug(f"rsync command: {rsync_string}")
+    if rsync_shard_strings is not None:
+        for i, shard_string in enumerate(rsync_shard_strings):
+            logging.debug(f"rsync shard {i} command: {shard_string}")
+    if stream_strings is not None:
+        logging.debug(
+            f"stream command: {' | '.join(str(c) for c in stream_strings)}"
+        )
     if untar_string is not None:
         logging.debug(f"untar command: {untar_string}")
     if delete_dest_tarball_string is not None:
         logging.debug(f"deletion command: {delete_dest_tarball_string}")
+    if remote_post_sync_string is not None:
+        logging.debug(
+            f"remote post-transfer command: {remote_post_sync_string}"
+        )
 
     logging.debug("**************************************\n")
     logging.debug("Starting log")
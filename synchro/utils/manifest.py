@@ -0,0 +1,82 @@
+import os
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+from synchro.utils.scan import FileEntry
+
+MANIFEST_HEADER = b"synchro-manifest-v1\0"
+
+
+def save_manifest(
+    entries: Iterable[FileEntry], filename: Union[Path, str]
+) -> None:
+    """
+    Save a manifest of a directory. Each record is
+    "size<TAB>mtime_ns<TAB>inode<TAB>type<TAB>path", and records are
+    NUL-separated (so any path can be stored). The file is replaced
+    atomically, so an interrupted save leaves the previous manifest intact.
+
+    :param entries: Files and directories to record
+    :param filename: Where to save the manifest
+    """
+    filename = Path(filename)
+    temp_filename = filename.with_name(filename.name + ".tmp")
+    with open(temp_filename, "wb") as f:
+        f.write(MANIFEST_HEADER)
+        for entry in entries:
+            entry_type = "d" if entry.is_dir else "f"
+            record = (
+                f"{entry.size}\t{entry.mtime_ns}\t{entry.inode}\t"
+                f"{entry_type}\t{entry.path}\0"
+            )
+            f.write(record.encode("utf-8", "surrogateescape"))
+    os.replace(temp_filename, filename)
+
+
+def load_manifest(filename: Union[Path, str]) -> Optional[dict]:
+    """
+    Load a manifest saved by save_manifest
+
+    :param filename: Path to the manifest
+    :return: Dict of relative path: FileEntry, or None if there is no
+    (valid) manifest
+    """
+    try:
+        with open(filename, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if not data.startswith(MANIFEST_HEADER):
+        return None
+
+    manifest = {}
+    records = data.removeprefix(MANIFEST_HEADER).split(b"\0")
+    for record in records:
+        if not record:
+            continue
+        size, mtime_ns, inode, entry_type, path = record.decode(
+            "utf-8", "surrogateescape"
+        ).split("\t", 4)
+        manifest[path] = FileEntry(
+            path, int(size), int(mtime_ns), int(inode), entry_type == "d"
+        )
+    return manifest
+
+
+def changed_entries(
+    previous: dict, current: Iterable[FileEntry]
+) -> list[FileEntry]:
+    """
+    Find files and directories that are new, or have changed (size,
+    modification time or inode) since a previous manifest
+
+    :param previous: Dict of relative path: FileEntry (from load_manifest)
+    :param current: Entries from a new scan of the directory
+    :return: New or changed entries
+    """
+    changed = []
+    for entry in current:
+        old_entry = previous.get(entry.path)
+        if old_entry is None or old_entry != entry:
+            changed.append(entry)
+    return changed
@@ -0,0 +1,251 @@
+import os
+import re
+import json
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Union
+
+# e.g. "  1,048,576 100%   50.00MB/s    0:00:01 (xfr#1, to-chk=2/4)"
+RSYNC_PROGRESS = re.compile(
+    r"^\s*(?P<bytes>[\d,]+)\s+(?P<percent>\d+)%\s+"
+    r"(?P<rate>[\d.]+)(?P<unit>[kMGT]?B)/s\s+"
+    r"(?P<time>\d+:\d{2}:\d{2})"
+    r"(?:\s+\(xfr#(?P<xfr>\d+), "
+    r"\w+-chk=(?P<remaining>\d+)/(?P<total>\d+)\))?"
+)
+UNITS = {"B": 1, "kB": 1024, "MB": 1024**2, "GB": 1024**3, "TB": 1024**4}
+
+
+class TransferMetrics:
+    """
+    Structured metrics for a synchronisation, built by parsing the output
+    of rsync and tar, and timing each stage. Optionally written (and
+    updated during the run) as JSON, and as a Prometheus textfile
+    collector file.
+
+    :param labels: Labels identifying the run (e.g. source & destination)
+    :param json_file: Where to write JSON metrics (or None)
+    :param prometheus_file: Where to write Prometheus metrics (or None)
+    :param cumulative_progress: rsync progress is for the whole transfer
+    (--info=progress2), rather than for each file
+    :param write_interval: Minimum time (s) between writes during a stage
+    """
+
+    def __init__(
+        self,
+        labels: dict,
+        json_file: Optional[Union[Path, str]] = None,
+        prometheus_file: Optional[Union[Path, str]] = None,
+        cumulative_progress: bool = False,
+        write_interval: float = 1.0,
+    ):
+        self.labels = labels
+        self.json_file = json_file
+        self.prometheus_file = prometheus_file
+        self.cumulative_progress = cumulative_progress
+        self.write_interval = write_interval
+        self.lock = threading.Lock()
+        self.last_write = 0.0
+
+        self.start_time = time.time()
+        self.status = "running"
+        self.current_stage: Optional[str] = None
+        self.stages: dict[str, dict] = {}
+        self.stage_files: Counter[str] = Counter()
+        self.rsync_files: dict[str, int] = {}
+        self.completed_bytes = 0
+        self.partial_bytes: dict[str, int] = {}
+        self.rate = 0.0
+        self.eta = None
+        self.files_to_check = None
+
+    @property
+    def bytes_transferred(self):
+        return self.completed_bytes + sum(self.partial_bytes.values())
+
+    @property
+    def files(self):
+        """
+        Files transferred. The same files are listed by tar when archiving
+        and extracting, so the stage with the most files is used.
+        """
+        return max(
+            max(self.stage_files.values(), default=0),
+            sum(self.rsync_files.values()),
+        )
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time a stage of the synchronisation
+        """
+        start = time.time()
+        with self.lock:
+            self.current_stage = name
+            self.stages[name] = {"start": start, "duration": None}
+        self.write(force=True)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.stages[name]["duration"] = time.time() - start
+                self.current_stage = None
+                self.eta = None
+            self.write(force=True)
+
+    def observe(self, line: str, stream: str = ""):
+        """
+        Update the metrics from a line of rsync or tar output
+
+        :param line: Line of output
+        :param stream: Identifies the process (e.g. rsync shard) the line
+        came from, so concurrent progress can be combined
+        """
+        match = RSYNC_PROGRESS.match(line)
+        with self.lock:
+            if match is None:
+                # tar -v prints one line per file
+                if self.current_stage is not None:
+                    self.stage_files[self.current_stage] += 1
+            else:
+                self.observe_rsync_progress(match, stream)
+        self.write()
+
+    def observe_rsync_progress(self, match, stream):
+        n_bytes = int(match["bytes"].replace(",", ""))
+        self.rate = float(match["rate"]) * UNITS[match["unit"]]
+        if self.cumulative_progress:
+            self.partial_bytes[stream] = n_bytes
+            self.eta = parse_duration(match["time"])
+        elif match["xfr"] is not None:
+            # File completed
+            self.partial_bytes[stream] = 0
+            self.completed_bytes += n_bytes
+        else:
+            self.partial_bytes[stream] = n_bytes
+
+        if match["xfr"] is not None:
+            if self.cumulative_progress:
+                self.rsync_files[stream] = int(match["xfr"])
+            else:
+                self.rsync_files[stream] = self.rsync_files.get(stream, 0) + 1
+            self.files_to_check = int(match["remaining"])
+
+    def add_bytes(self, n_bytes: int):
+        """
+        Record bytes transferred without parseable progress output
+        """
+        with self.lock:
+            self.completed_bytes += n_bytes
+
+    def finish(self, status: str):
+        with self.lock:
+            self.status = status
+            self.eta = None
+        self.write(force=True)
+
+    def as_dict(self) -> dict:
+        elapsed = time.time() - self.start_time
+        return {
+            **self.labels,
+            "status": self.status,
+            "current_stage": self.current_stage,
+            "elapsed_seconds": elapsed,
+            "bytes_transferred": self.bytes_transferred,
+            "files_transferred": self.files,
+            "bytes_per_second": self.rate,
+            "files_per_second": self.files / elapsed if elapsed else 0.0,
+            "average_bytes_per_second": (
+                self.bytes_transferred / elapsed if elapsed else 0.0
+            ),
+            "eta_seconds": self.eta,
+            "stages": {
+                name: stage["duration"] for name, stage in self.stages.items()
+            },
+        }
+
+    def write(self, force: bool = False):
+        """
+        Write the metrics files (if any), at most once per write_interval
+        unless forced
+        """
+        if self.json_file is None and self.prometheus_file is None:
+            return
+        now = time.time()
+        if not force and now - self.last_write < self.write_interval:
+            return
+        with self.lock:
+            self.last_write = now
+            metrics = self.as_dict()
+        if self.json_file is not None:
+            write_atomic(self.json_file, json.dumps(metrics, indent=2))
+        if self.prometheus_file is not None:
+            write_atomic(
+                self.prometheus_file, format_prometheus(metrics, self.labels)
+            )
+
+
+def parse_duration(string: str) -> int:
+    """
+    :param string: e.g. "1:02:03"
+    :return: Seconds
+    """
+    hours, minutes, seconds = (int(x) for x in string.split(":"))
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def format_prometheus(metrics: dict, labels: dict) -> str:
+    """
+    Format metrics for the Prometheus node exporter textfile collector
+    """
+    label_string = ",".join(
+        f'{key}="{escape_label(value)}"' for key, value in labels.items()
+    )
+    lines = []
+    described = set()
+
+    def add(name, value, help_text, extra_labels=""):
+        if value is None:
+            return
+        all_labels = ",".join(x for x in (label_string, extra_labels) if x)
+        if name not in described:
+            lines.append(f"# HELP synchro_{name} {help_text}")
+            lines.append(f"# TYPE synchro_{name} gauge")
+            described.add(name)
+        lines.append(f"synchro_{name}{{{all_labels}}} {value}")
+
+    add("bytes_transferred", metrics["bytes_transferred"], "Bytes sent")
+    add("files_transferred", metrics["files_transferred"], "Files sent")
+    add("bytes_per_second", metrics["bytes_per_second"], "Current rate")
+    add("files_per_second", metrics["files_per_second"], "Files per second")
+    add("eta_seconds", metrics["eta_seconds"], "Estimated time remaining")
+    add("elapsed_seconds", metrics["elapsed_seconds"], "Time since start")
+    add("running", int(metrics["status"] == "running"), "Run in progress")
+    add("success", int(metrics["status"] == "success"), "Run succeeded")
+    for stage, duration in metrics["stages"].items():
+        add(
+            "stage_duration_seconds",
+            duration,
+            "Duration of each completed stage",
+            f'stage="{stage}"',
+        )
+    return "\n".join(lines) + "\n"
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def write_atomic(filename: Union[Path, str], contents: str):
+    """
+    Write a file via a temporary file and rename, so readers (e.g. the
+    Prometheus node exporter) never see a partially written file
+    """
+    filename = str(filename)
+    temp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(temp_filename, "w") as f:
+        f.write(contents)
+    os.replace(temp_filename, filename)
@@ -1,9 +1,25 @@
+import time
+import queue
+import asyncio
 import logging
 import subprocess
 from configparser import ConfigParser
 from pathlib import Path
 from typing import Union
 
+from synchro.utils.create_cmd import REMOTE_STEP_MARKER
+from synchro.utils.engine import (  # noqa: F401
+    check_pipeline_return_codes,
+    effective_timeout,
+    get_engine,
+    run_command,
+    run_commands,
+    run_pipeline,
+)
+from synchro.utils.logging import OUTPUT_LOGGER
+from synchro.utils.ssh import control_options
+from synchro.utils.tracing import current_span
+
 
 def get_config_obj(config_path: Union[Path, str]) -> ConfigParser:
     """
@@ -21,28 +37,43 @@ def get_config_obj(config_path: Union[Path, str]) -> ConfigParser:
     return parser
 
 
-def execute_and_yield_output(cmd):
+def execute_and_yield_output(cmd, timeout=None):
     """
-    Run terminal command and yield output
-    From https://stackoverflow.com/questions/4417546/
+    Run terminal command and yield output (line by line, as it is written)
 
     :param cmd: Terminal command to run
+    :param timeout: Seconds before the command is stopped
     """
-    popen = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        universal_newlines=True,
+    lines = queue.Queue()
+    done = object()
+    timeout = effective_timeout(timeout)
+
+    async def run_until_finished():
+        try:
+            await run_command(
+                cmd, lambda line: lines.put(line + "\n"), timeout
+            )
+        finally:
+            lines.put(done)
+
+    future = asyncio.run_coroutine_threadsafe(
+        run_until_finished(), get_engine().loop
     )
-    for stdout_line in iter(popen.stdout.readline, ""):
-        yield stdout_line
-    popen.stdout.close()
-    return_code = popen.wait()
-    if return_code:
-        raise subprocess.CalledProcessError(return_code, cmd)
+    finished = False
+    try:
+        for line in iter(lines.get, done):
+            yield line
+        finished = True
+    finally:
+        # If the output wasn't read to the end, stop the command
+        if not finished:
+            future.cancel()
+    future.result()
 
 
-def execute_and_log(cmd, rstrip=True, skip_empty=True):
+def execute_and_log(
+    cmd, rstrip=True, skip_empty=True, prefix="", callback=None, timeout=None
+):
     """
     Execute a terminal command, and log the output using the standard
     logging library
@@ -50,15 +81,158 @@ def execute_and_log(cmd, rstrip=True, skip_empty=True):
     :param cmd: Command to run
     :param rstrip: Strip the output of trailing new line
     :param skip_empty: Don't log empty lines
+    :param prefix: String to prepend to each logged line
+    :param callback: Function called with each line of output
+    :param timeout: Seconds before the command is stopped (also limited by
+    any command timeout or stage deadline, see synchro.utils.engine)
+    """
+    log_line = line_logger(rstrip, skip_empty, prefix, callback)
+    get_engine().run(run_command(cmd, log_line, effective_timeout(timeout)))
+
+
+def line_logger(rstrip=True, skip_empty=True, prefix="", callback=None):
+    """
+    :return: Function that logs a line of command output using the standard
+    logging library (see log_lines)
     """
-    for string in execute_and_yield_output(cmd):
+    logger = logging.getLogger(OUTPUT_LOGGER)
+
+    def log_line(string):
         if rstrip:
             string = string.rstrip("\n")
-        if skip_empty:
-            if string != "":
-                logging.debug(string)
-        else:
-            logging.debug(string)
+        if skip_empty and string == "":
+            return
+        logger.debug(prefix + string)
+        if callback is not None and string != "":
+            callback(string)
+
+    return log_line
+
+
+def log_lines(lines, rstrip=True, skip_empty=True, prefix="", callback=None):
+    """
+    Log lines of command output using the standard logging library
+
+    :param lines: Iterable of lines
+    :param rstrip: Strip the output of trailing new line
+    :param skip_empty: Don't log empty lines
+    :param prefix: String to prepend to each logged line
+    :param callback: Function called with each (non-empty) line
+    """
+    log_line = line_logger(rstrip, skip_empty, prefix, callback)
+    for string in lines:
+        log_line(string)
+
+
+def execute_concurrently_and_log(cmds, prefixes=None, callbacks=None):
+    """
+    Execute several terminal commands at once, and log the output of all
+    of them using the standard logging library. All commands are run to
+    completion, and then the first error (if any) is raised.
+
+    :param cmds: Commands to run
+    :param prefixes: Strings to prepend to the logged lines of each command
+    :param callbacks: Functions called with each line of output of each
+    command
+    """
+    if prefixes is None:
+        prefixes = [""] * len(cmds)
+    if callbacks is None:
+        callbacks = [None] * len(cmds)
+    log_line_functions = [
+        line_logger(prefix=prefix, callback=callback)
+        for prefix, callback in zip(prefixes, callbacks)
+    ]
+    get_engine().run(
+        run_commands(cmds, log_line_functions, effective_timeout())
+    )
+
+
+def execute_pipeline_and_log(
+    cmds, rstrip=True, skip_empty=True, callback=None
+):
+    """
+    Execute a pipeline of terminal commands, and log the output using the
+    standard logging library. If any stage fails, the failing stage(s) are
+    logged, and a CalledProcessError is raised for the stage that caused
+    the failure.
+
+    :param cmds: List of commands to connect together
+    :param rstrip: Strip the output of trailing new line
+    :param skip_empty: Don't log empty lines
+    :param callback: Function called with each line of output
+    """
+    log_line = line_logger(rstrip, skip_empty, callback=callback)
+    get_engine().run(run_pipeline(cmds, log_line, effective_timeout()))
+
+
+def execute_remote_steps_and_log(cmd, steps, callback=None):
+    """
+    Execute a batch of remote steps (created by
+    create_cmd.batch_remote_steps), logging the output and exit status of
+    each step separately.
+
+    :param cmd: Batched ssh command
+    :param steps: List of (step name, command) tuples that make up the batch
+    :param callback: Function called with each line of output (other than
+    the step markers)
+    """
+    step_cmds = dict(steps)
+    exit_statuses = {}
+    start_times = {}
+    step = None
+
+    def log_line(string):
+        nonlocal step
+        if string.startswith(REMOTE_STEP_MARKER):
+            step, status = parse_remote_step_marker(string)
+            if status is None:
+                logging.debug(f"Starting remote step: {step}")
+                start_times[step] = time.time()
+            else:
+                exit_statuses[step] = status
+                log = logging.error if status else logging.debug
+                log(f"Remote step: {step} exited with status: {status}")
+                record_remote_step(step, start_times.get(step), status)
+        elif string != "":
+            logging.getLogger(OUTPUT_LOGGER).debug(
+                f"[{step}] {string}" if step else string
+            )
+            if callback is not None:
+                callback(string)
+
+    try:
+        get_engine().run(run_command(cmd, log_line, effective_timeout()))
+    except subprocess.CalledProcessError as error:
+        for step, status in exit_statuses.items():
+            if status:
+                raise subprocess.CalledProcessError(status, step_cmds[step])
+        raise error
+
+
+def record_remote_step(step, start, status):
+    """
+    Record a remote step as a span of the current trace (if any), timed by
+    when its output markers arrived
+    """
+    span = current_span()
+    if span is not None and start is not None:
+        span.tracer.record(
+            step, start, time.time(), category="step", exit_code=status
+        )
+
+
+def parse_remote_step_marker(string):
+    """
+    Parse a marker line written by a batch of remote steps
+
+    :param string: Marker line, e.g. "@@synchro_step untar exit 0"
+    :return: Step name, and exit status (None if the step is starting)
+    """
+    _, step, event, *status = string.split()
+    if event == "exit":
+        return step, int(status[0])
+    return step, None
 
 
 def split_pathlib(path, separator=":"):
@@ -98,7 +272,9 @@ def return_pathlib_remote_components(path: Path) -> list[str]:
     return split_pathlib(path)
 
 
-def check_remote_dir_exists(host, directory, return_string="dir_exists"):
+def check_remote_dir_exists(
+    host, directory, return_string="dir_exists", control_path=None
+):
     """
     Check if a directory on a remote machine exists via ssh
     :TODO improve untidy implementation
@@ -106,14 +282,20 @@ def check_remote_dir_exists(host, directory, return_string="dir_exists"):
     :param host: user@remote, needs ssh keys set up
     :param directory: Path to local directory
     :param return_string: Some string to return if directory exists
+    :param control_path: Control socket of a master connection to reuse
     :return: bool
     """
     directory = str(directory)
-    cmd = ["ssh", host, f"[ -d '{directory}' ] && echo '{return_string}'"]
+    cmd = [
+        "ssh",
+        *control_options(control_path),
+        host,
+        f"[ -d '{directory}' ] && echo '{return_string}'",
+    ]
     try:
         for string in execute_and_yield_output(cmd):
             if string == f"{return_string}\n":
                 return True
         return False
-    except subprocess.CalledProcessError:
+    except subprocess.SubprocessError:
         return False
@@ -1,6 +1,17 @@
 import configparser
 import logging
 
+from synchro.utils.compression import (
+    CODECS,
+    DEFAULT_SKIP_EXTENSIONS,
+    parse_extensions,
+)
+from synchro.utils.bandwidth import BandwidthSchedule, parse_rate
+from synchro.utils.engine import parse_duration, parse_stage_timeouts
+from synchro.utils.fastcopy import COPY_THREADS, LOCAL_COPY_POLICIES
+from synchro.utils.space import SPACE_CHECKS
+from synchro.utils.verify import ALGORITHMS
+
 
 class Options:
     def __init__(
@@ -14,6 +25,27 @@ class Options:
         delete_destination_tar,
         owner=None,
         group=None,
+        stream=False,
+        rsync_shards=1,
+        ssh_multiplex=True,
+        compression="none",
+        compression_level=None,
+        incremental=False,
+        verify=False,
+        verify_algorithm="sha256",
+        verify_threads=8,
+        metrics_file=None,
+        prometheus_file=None,
+        log_summary=False,
+        log_summary_interval=10,
+        max_log_size=None,
+        resume=False,
+        inline_permissions=False,
+        hybrid_threshold=None,
+        volume_size=None,
+        local_copy="rsync",
+        reproducible_archive=False,
+        rsyncable=False,
     ):
 
         self.create_dest = try_set_boolean_with_default(
@@ -29,7 +61,91 @@ class Options:
         self.owner, self.group = set_ownership(config, owner, group)
         self.permissions = set_permissions(config, permissions)
         self.delete_destination_tar = set_delete_destination_tar(
-            delete_destination_tar, self.tar, self.untar
+            config, delete_destination_tar, self.tar, self.untar
+        )
+        self.stream = set_stream(config, stream, self.tar)
+        if self.stream:
+            # No archive is written at the source when streaming
+            self.delete_source_tar = False
+        self.hybrid_threshold = set_hybrid_threshold(
+            config, hybrid_threshold, self.tar, self.untar, self.stream
+        )
+        self.volume_size = set_volume_size(
+            config,
+            volume_size,
+            self.tar,
+            self.untar,
+            self.stream,
+            self.hybrid_threshold,
+        )
+        # Only large files are sharded in hybrid mode
+        self.rsync_shards = set_rsync_shards(
+            config, rsync_shards, self.tar and self.hybrid_threshold is None
+        )
+        self.ssh_multiplex = try_set_boolean_with_default(
+            config, ssh_multiplex, "ssh_multiplex", warn_if_missing=False
+        )
+        (
+            self.compression,
+            self.compression_level,
+            self.compression_skip,
+        ) = set_compression(config, compression, compression_level, self.tar)
+        self.reproducible_archive = set_reproducible_archive(
+            config, reproducible_archive, self.tar
+        )
+        self.rsyncable = set_rsyncable(config, rsyncable, self.compression)
+        self.incremental = set_incremental(
+            config, incremental, self.tar, self.untar
+        )
+        (
+            self.verify,
+            self.verify_algorithm,
+            self.verify_threads,
+        ) = set_verify(
+            config,
+            verify,
+            verify_algorithm,
+            verify_threads,
+            self.tar,
+            self.untar,
+        )
+        self.metrics_file = try_set_parameter(
+            config, metrics_file, "metrics_file"
+        )
+        self.prometheus_file = try_set_parameter(
+            config, prometheus_file, "prometheus_file"
+        )
+        (
+            self.log_summary,
+            self.log_summary_interval,
+            self.max_log_size,
+        ) = set_log_summary(
+            config, log_summary, log_summary_interval, max_log_size
+        )
+        self.resume = try_set_boolean_with_default(
+            config, resume, "resume", warn_if_missing=False
+        )
+        self.inline_permissions = try_set_boolean_with_default(
+            config,
+            inline_permissions,
+            "inline_permissions",
+            warn_if_missing=False,
+        )
+        self.bandwidth_limit = set_bandwidth_limit(config, "bandwidth_limit")
+        self.global_bandwidth_limit = set_bandwidth_limit(
+            config, "global_bandwidth_limit"
+        )
+        self.bandwidth_coordination_file = try_set_parameter(
+            config, None, "bandwidth_coordination_file"
+        )
+        self.history_file = try_set_parameter(config, None, "history_file")
+        self.command_timeout = set_command_timeout(config)
+        self.stage_timeouts = set_stage_timeouts(config)
+        self.space_check = set_space_check(config)
+        self.trace_file = try_set_parameter(config, None, "trace_file")
+        self.profile_file = try_set_parameter(config, None, "profile_file")
+        self.local_copy, self.local_copy_threads = set_local_copy(
+            config, local_copy
         )
 
 
@@ -57,7 +173,13 @@ def set_tar_options(
     return run_tar, run_untar, delete_source_tar
 
 
-def set_delete_destination_tar(delete_destination_tar, tar, untar):
+def set_delete_destination_tar(config, delete_destination_tar, tar, untar):
+    delete_destination_tar = try_set_boolean_with_default(
+        config,
+        delete_destination_tar,
+        "delete_destination_tar",
+        warn_if_missing=False,
+    )
     if tar:
         if delete_destination_tar and not untar:
             print(
@@ -70,6 +192,270 @@ def set_delete_destination_tar(delete_destination_tar, tar, untar):
     return delete_destination_tar
 
 
+def set_stream(config, stream, tar):
+    stream = try_set_boolean_with_default(
+        config, stream, "stream", warn_if_missing=False
+    )
+    if stream and not tar:
+        print(
+            "Option to stream, but not tar selected. "
+            "Defaulting to not streaming."
+        )
+        stream = False
+    return stream
+
+
+def set_rsync_shards(config, rsync_shards, tar):
+    rsync_shards = try_set_integer(config, rsync_shards, "rsync_shards")
+    if rsync_shards > 1 and tar:
+        print(
+            "Option to shard rsync, but also tar selected. "
+            "Defaulting to a single rsync process."
+        )
+        rsync_shards = 1
+    return max(rsync_shards, 1)
+
+
+def set_hybrid_threshold(config, hybrid_threshold, tar, untar, stream):
+    """
+    :return: Size (bytes) from which files are sent directly, rather than in
+    the tar archive, or None to archive every file
+    """
+    hybrid_threshold = try_set_parameter(
+        config, hybrid_threshold, "hybrid_threshold"
+    )
+    if hybrid_threshold is None:
+        return None
+    # Sizes have the same suffixes (K, M, G) as bandwidth limits
+    hybrid_threshold = parse_rate(str(hybrid_threshold))
+    if hybrid_threshold is None:
+        return None
+    if not (tar and untar) or stream:
+        print(
+            "Option to send large files directly, but not tar & untar "
+            "selected (or streaming). Defaulting to archiving every file."
+        )
+        return None
+    return hybrid_threshold
+
+
+def set_volume_size(config, volume_size, tar, untar, stream, hybrid):
+    """
+    :return: Size (bytes) of each volume of the tar archive, or None to
+    write a single archive
+    """
+    volume_size = try_set_parameter(config, volume_size, "volume_size")
+    if volume_size is None:
+        return None
+    volume_size = parse_rate(str(volume_size))
+    if volume_size is None:
+        return None
+    if not (tar and untar) or stream or hybrid is not None:
+        print(
+            "Option to split the archive into volumes, but not tar & untar "
+            "selected (or streaming, or hybrid_threshold set). Defaulting to "
+            "a single archive."
+        )
+        return None
+    return volume_size
+
+
+def set_compression(config, compression, compression_level, tar):
+    compression = try_set_parameter(config, compression, "compression")
+    compression_level = try_set_integer(
+        config, compression_level, "compression_level"
+    )
+    compression_skip = try_set_parameter(config, None, "compression_skip")
+    if compression_skip is None:
+        compression_skip = DEFAULT_SKIP_EXTENSIONS
+    else:
+        compression_skip = parse_extensions(compression_skip)
+
+    if compression != "none" and compression not in CODECS:
+        print(
+            f"Compression: {compression} not supported (options are: none, "
+            f"{', '.join(CODECS)}). Defaulting to no compression."
+        )
+        compression = "none"
+    if compression != "none" and not tar:
+        print(
+            "Option to compress, but not tar selected. "
+            "Defaulting to no compression."
+        )
+        compression = "none"
+    return compression, compression_level, compression_skip
+
+
+def set_reproducible_archive(config, reproducible_archive, tar):
+    reproducible_archive = try_set_boolean_with_default(
+        config,
+        reproducible_archive,
+        "reproducible_archive",
+        warn_if_missing=False,
+    )
+    if reproducible_archive and not tar:
+        print(
+            "Option for a reproducible archive, but not tar selected. "
+            "Ignoring."
+        )
+        reproducible_archive = False
+    return reproducible_archive
+
+
+def set_rsyncable(config, rsyncable, compression):
+    rsyncable = try_set_boolean_with_default(
+        config, rsyncable, "rsyncable", warn_if_missing=False
+    )
+    if not rsyncable:
+        return False
+    if compression == "none":
+        print(
+            "Option for rsyncable compression, but not compression "
+            "selected. Ignoring."
+        )
+        return False
+    if CODECS[compression].rsyncable_flag is None:
+        print(
+            f"Option for rsyncable compression, but {compression} doesn't "
+            f"support it (gzip & zstd do). Compressing normally."
+        )
+        return False
+    return True
+
+
+def set_incremental(config, incremental, tar, untar):
+    incremental = try_set_boolean_with_default(
+        config, incremental, "incremental", warn_if_missing=False
+    )
+    if incremental and tar and not untar:
+        # Each transfer would overwrite the last transfer's archive
+        print(
+            "Option to transfer incrementally, but not untar selected. "
+            "Defaulting to not transferring incrementally."
+        )
+        incremental = False
+    return incremental
+
+
+def set_verify(config, verify, algorithm, threads, tar, untar):
+    verify = try_set_boolean_with_default(
+        config, verify, "verify", warn_if_missing=False
+    )
+    algorithm = try_set_parameter(config, algorithm, "verify_algorithm")
+    threads = try_set_integer(config, threads, "verify_threads")
+    if verify and tar and not untar:
+        print(
+            "Option to verify, but not untar selected. "
+            "Defaulting to not verifying."
+        )
+        verify = False
+    if algorithm not in ALGORITHMS:
+        print(
+            f"Verification algorithm: {algorithm} not supported (options "
+            f"are: {', '.join(ALGORITHMS)}). Defaulting to sha256."
+        )
+        algorithm = "sha256"
+    return verify, algorithm, max(threads, 1)
+
+
+def set_log_summary(config, log_summary, interval, max_log_size):
+    log_summary = try_set_boolean_with_default(
+        config, log_summary, "log_summary", warn_if_missing=False
+    )
+    interval = try_set_integer(config, interval, "log_summary_interval")
+    max_log_size = try_set_integer(config, max_log_size, "max_log_size")
+    if max_log_size is not None and not log_summary:
+        print(
+            "Maximum log size set, but not log_summary. "
+            "Not limiting the log size."
+        )
+        max_log_size = None
+    return log_summary, max(interval, 1), max_log_size
+
+
+def set_bandwidth_limit(config, parameter_config_entry):
+    limit = try_set_parameter(config, None, parameter_config_entry)
+    if limit is None:
+        return None
+    try:
+        BandwidthSchedule(limit)
+    except ValueError:
+        print(
+            f"{parameter_config_entry}: {limit} not understood (e.g. "
+            f"'09:00-18:00=200M, 1G'). Not limiting bandwidth."
+        )
+        return None
+    return limit
+
+
+def set_command_timeout(config):
+    """
+    :return: Seconds before any single command is stopped, or None
+    """
+    timeout = try_set_parameter(config, None, "command_timeout")
+    if timeout is None:
+        return None
+    try:
+        return parse_duration(timeout)
+    except ValueError:
+        print(
+            f"command_timeout: {timeout} not understood (e.g. '90', '30m', "
+            f"'2h'). Not timing out commands."
+        )
+        return None
+
+
+def set_stage_timeouts(config):
+    """
+    :return: Dict of stage name: seconds before the stage is stopped (with
+    the default for any other stage under None)
+    """
+    timeouts = try_set_parameter(config, None, "stage_timeout")
+    if timeouts is None:
+        return {}
+    try:
+        return parse_stage_timeouts(timeouts)
+    except ValueError:
+        print(
+            f"stage_timeout: {timeouts} not understood (e.g. "
+            f"'tar=2h, rsync=12h, 6h'). Not timing out stages."
+        )
+        return {}
+
+
+def set_space_check(config):
+    """
+    :return: What to do if there isn't enough space ("defer" or "refuse"),
+    or None to not check
+    """
+    space_check = try_set_parameter(config, None, "space_check")
+    if space_check in (None, "n"):
+        return None
+    if space_check not in SPACE_CHECKS:
+        print(
+            f"space_check: {space_check} not supported (options are: n, "
+            f"{', '.join(SPACE_CHECKS)}). Not checking free space."
+        )
+        return None
+    return space_check
+
+
+def set_local_copy(config, local_copy):
+    """
+    :return: (How to copy files to a local destination, one of
+    LOCAL_COPY_POLICIES, number of files copied at once by a native copy)
+    """
+    local_copy = try_set_parameter(config, local_copy, "local_copy")
+    threads = try_set_integer(config, COPY_THREADS, "local_copy_threads")
+    if local_copy not in LOCAL_COPY_POLICIES:
+        print(
+            f"local_copy: {local_copy} not supported (options are: "
+            f"{', '.join(LOCAL_COPY_POLICIES)}). Defaulting to rsync."
+        )
+        local_copy = "rsync"
+    return local_copy, max(threads, 1)
+
+
 def try_set_parameter(
     config, parameter, parameter_config_entry, config_string="config"
 ):
@@ -80,8 +466,22 @@ def try_set_parameter(
     return parameter
 
 
-def try_set_boolean_with_default(
+def try_set_integer(
     config, parameter, parameter_config_entry, config_string="config"
+):
+    try:
+        parameter = config.getint(config_string, parameter_config_entry)
+    except configparser.NoOptionError:
+        pass
+    return parameter
+
+
+def try_set_boolean_with_default(
+    config,
+    parameter,
+    parameter_config_entry,
+    config_string="config",
+    warn_if_missing=True,
 ):
     try:
         parameter = (
@@ -90,8 +490,9 @@ def try_set_boolean_with_default(
             else False
         )
     except configparser.NoOptionError:
-        logging.warning(
-            f"{parameter_config_entry} option not set in config file. "
-            f"Setting to: {parameter}"
-        )
+        if warn_if_missing:
+            logging.warning(
+                f"{parameter_config_entry} option not set in config file. "
+                f"Setting to: {parameter}"
+            )
     return parameter
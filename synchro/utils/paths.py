@@ -6,6 +6,10 @@ from synchro.utils.misc import (
     check_pathlib_remote,
     return_pathlib_remote_components,
 )
+from synchro.utils.verify import ALGORITHMS
+
+# Host name used for transfers to a local destination
+LOCAL_HOST = "localhost"
 
 
 class Paths:
@@ -28,6 +32,50 @@ class Paths:
         )
         self.dest_tar_archive = self.local_destination / self.tar_archive.name
         self.transfer_done_file = self.source_directory / "transfer.done"
+        self.manifest_file = self.source_directory / "synchro.manifest"
+        self.journal_file = self.source_directory / "synchro.journal"
+
+    def synchro_files(self):
+        """
+        Files written to the source directory by synchro itself (rather
+        than data), relative to the source directory
+        """
+        names = {
+            self.transfer_done_file.name,
+            self.manifest_file.name,
+            self.journal_file.name,
+            self.journal_file.name + ".tmp",
+        }
+        names.update(
+            self.checksum_file(algorithm).name for algorithm in ALGORITHMS
+        )
+        names.update(
+            log_file.name
+            for log_file in self.source_directory.glob("synchro_*.log")
+        )
+        log_filename = Path(self.log_filename)
+        if log_filename.parent == self.source_directory:
+            names.add(log_filename.name)
+        return tuple(names)
+
+    @property
+    def destination_host(self):
+        return self.remote_host if self.remote_destination else LOCAL_HOST
+
+    def set_archive_extension(self, extension):
+        """
+        Add a compression suffix (e.g. ".zst") to the tar archive filenames
+        """
+        self.tar_archive = self.source_directory.parent / (
+            self.source_directory.name + ".tar" + extension
+        )
+        self.dest_tar_archive = self.local_destination / self.tar_archive.name
+
+    def checksum_file(self, algorithm):
+        """
+        Checksum file written alongside the data at the destination
+        """
+        return self.local_destination / f"synchro.{algorithm}"
 
     @staticmethod
     def set_source_directory(config):
@@ -75,7 +123,7 @@ class Paths:
                 datetime.now().strftime("synchro" + "_%Y-%m-%d_%H-%M-%S")
                 + ".log"
             )
-        return log_filename
+        return Path(log_filename)
 
     @staticmethod
     def set_transfer_initiation(config, source_directory):
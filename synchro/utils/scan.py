@@ -0,0 +1,93 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Iterator, NamedTuple, Union
+
+
+class FileEntry(NamedTuple):
+    path: str
+    size: int
+    mtime_ns: int
+    inode: int
+    is_dir: bool
+
+
+def scan_directory(
+    directory: Union[Path, str], exclude: tuple = ()
+) -> Iterator[FileEntry]:
+    """
+    Walk a directory tree using os.scandir, yielding an entry for every
+    file, symlink and subdirectory. Symlinks are not followed. Paths are
+    relative to the top level directory.
+
+    :param directory: Directory to scan
+    :param exclude: Relative paths to skip (and not descend into)
+    """
+    directory = str(directory)
+    stack = [""]
+    while stack:
+        for entry in scan_one_directory(directory, stack.pop(), exclude):
+            yield entry
+            if entry.is_dir:
+                stack.append(entry.path)
+
+
+def scan_directory_parallel(
+    directory: Union[Path, str], exclude: tuple = (), threads: int = 8
+) -> list[FileEntry]:
+    """
+    As scan_directory, but listing many directories at once. This is much
+    faster on network filesystems, where each listing & stat has a high
+    latency.
+
+    :param directory: Directory to scan
+    :param exclude: Relative paths to skip (and not descend into)
+    :param threads: Number of directories to list at once
+    :return: Entries, sorted by path
+    """
+    directory = str(directory)
+    results = []
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        running = {executor.submit(scan_one_directory, directory, "", exclude)}
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                entries = future.result()
+                results.extend(entries)
+                for entry in entries:
+                    if entry.is_dir:
+                        running.add(
+                            executor.submit(
+                                scan_one_directory,
+                                directory,
+                                entry.path,
+                                exclude,
+                            )
+                        )
+    return sorted(results)
+
+
+def scan_one_directory(
+    directory: str, relative_dir: str, exclude: tuple
+) -> list[FileEntry]:
+    """
+    List a single directory (without descending into subdirectories)
+    """
+    results = []
+    with os.scandir(os.path.join(directory, relative_dir)) as entries:
+        for entry in entries:
+            relative_path = os.path.join(relative_dir, entry.name)
+            if relative_path in exclude:
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            is_dir = entry.is_dir(follow_symlinks=False)
+            results.append(
+                FileEntry(
+                    relative_path,
+                    0 if is_dir else stat.st_size,
+                    stat.st_mtime_ns,
+                    stat.st_ino,
+                    is_dir,
+                )
+            )
+    return results
@@ -0,0 +1,49 @@
+import heapq
+from pathlib import Path
+from typing import Iterable, Union
+
+from synchro.utils.scan import FileEntry
+
+
+def balance_shards(
+    entries: Iterable[FileEntry], n_shards: int
+) -> list[list[FileEntry]]:
+    """
+    Split files into shards of (approximately) equal total size. Files are
+    assigned largest first, each to the shard with the fewest bytes so far.
+    Directories are not included.
+
+    :param entries: Files to split
+    :param n_shards: Number of shards
+    :return: List of shards, each a list of files
+    """
+    files = sorted(
+        (entry for entry in entries if not entry.is_dir),
+        key=lambda entry: entry.size,
+        reverse=True,
+    )
+    shards: list[list[FileEntry]] = [[] for _ in range(n_shards)]
+    heap = [(0, i) for i in range(n_shards)]
+    for entry in files:
+        total, i = heapq.heappop(heap)
+        shards[i].append(entry)
+        heapq.heappush(heap, (total + entry.size, i))
+    return shards
+
+
+def write_file_list(
+    entries: Iterable[FileEntry], filename: Union[Path, str]
+) -> Path:
+    """
+    Write a NUL-separated list of relative paths, for use with
+    "rsync --from0 --files-from" or "tar --null -T"
+
+    :param entries: Files to list
+    :param filename: Where to write the list
+    :return: Path to the list
+    """
+    filename = Path(filename)
+    with open(filename, "wb") as f:
+        for entry in entries:
+            f.write(entry.path.encode("utf-8", "surrogateescape") + b"\0")
+    return filename
@@ -0,0 +1,114 @@
+import os
+import shlex
+import subprocess
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+from synchro.utils.misc import execute_and_yield_output
+from synchro.utils.scan import FileEntry
+from synchro.utils.ssh import control_options
+
+SPACE_CHECKS = ("defer", "refuse")
+# Extra space required, as a fraction of the estimate (e.g. for long paths
+# and filesystem overheads)
+MARGIN = 0.05
+# Directories scanned at once to measure the source
+SCAN_THREADS = 8
+# Size of each tar header, and tar's block size
+TAR_BLOCK_SIZE = 512
+# tar pads the archive to a multiple of this
+TAR_RECORD_SIZE = 10240
+
+
+def tar_archive_size(entries: Iterable[FileEntry]) -> int:
+    """
+    Size of an uncompressed tar archive of the entries: a header per entry,
+    each file padded to a whole number of blocks, two empty blocks at the
+    end, and the whole archive padded to a whole number of records.
+    (Long paths need extra headers, so this is slightly low for them.)
+    """
+    size = 2 * TAR_BLOCK_SIZE
+    for entry in entries:
+        size += TAR_BLOCK_SIZE
+        if not entry.is_dir:
+            size += -(-entry.size // TAR_BLOCK_SIZE) * TAR_BLOCK_SIZE
+    return -(-size // TAR_RECORD_SIZE) * TAR_RECORD_SIZE
+
+
+def with_margin(n_bytes: int) -> int:
+    return int(n_bytes * (1 + MARGIN))
+
+
+def existing_parent(path: Union[Path, str]) -> Path:
+    """
+    :return: The path, or its closest parent that exists (e.g. for a
+    destination directory that will be created)
+    """
+    path = Path(path).absolute()
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return path
+
+
+def local_free_space(path: Union[Path, str]) -> int:
+    """
+    :return: Bytes available (to unprivileged users) on the filesystem of
+    a path (or of its closest existing parent)
+    """
+    stat = os.statvfs(existing_parent(path))
+    return stat.f_bavail * stat.f_frsize
+
+
+def same_filesystem(path_1: Union[Path, str], path_2: Union[Path, str]):
+    """
+    Check whether two local paths (or their closest existing parents) are
+    on the same filesystem
+    """
+    return (
+        existing_parent(path_1).stat().st_dev
+        == existing_parent(path_2).stat().st_dev
+    )
+
+
+def remote_free_space_script(path: Union[Path, str]) -> str:
+    """
+    Shell script printing (with df) the free space of the filesystem of a
+    path (or of its closest existing parent)
+    """
+    return (
+        f"d={shlex.quote(str(path))}; "
+        'while [ ! -e "$d" ]; do d=$(dirname "$d"); done; '
+        'df -Pk "$d"'
+    )
+
+
+def parse_df_output(lines: list) -> int:
+    """
+    :param lines: Output of df -Pk (a header, and a line per filesystem)
+    :return: Bytes available on the (last) filesystem
+    """
+    return int(lines[-1].split()[3]) * 1024
+
+
+def remote_free_space(
+    host: str, path: Union[Path, str], control_path=None
+) -> Optional[int]:
+    """
+    :param host: user@remote, needs ssh keys set up
+    :param path: Path on the remote host
+    :param control_path: Control socket of a master connection to reuse
+    :return: Bytes available on the filesystem of a remote path (or None if
+    it can't be checked)
+    """
+    cmd = [
+        "ssh",
+        *control_options(control_path),
+        host,
+        remote_free_space_script(path),
+    ]
+    try:
+        lines = [line for line in execute_and_yield_output(cmd) if line]
+        return parse_df_output(lines)
+    except (subprocess.SubprocessError, IndexError, ValueError) as error:
+        print(f"Could not check free space on {host}: {error}")
+        return None
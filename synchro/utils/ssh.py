@@ -0,0 +1,172 @@
+import os
+import atexit
+import hashlib
+import logging
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Optional, Union
+
+
+class SSHConnectionError(Exception):
+    pass
+
+
+class SSHMaster:
+    """
+    A multiplexed SSH master connection to a remote host. Any ssh command
+    given the same control path reuses this connection, rather than
+    opening a new one.
+
+    The control path is unique to this process, so the connection is only
+    closed by the process that opened it, and not while independent
+    synchronisations (e.g. from other cron jobs) are using it. If a master
+    connection is already running at the control path (e.g. given the path
+    of one opened by a parent process running a batch of
+    synchronisations), it is reused, and left running when this object is
+    stopped.
+
+    :param remote_host: user@remote, needs ssh keys set up
+    :param control_directory: Where to create the control socket
+    :param control_path: Control socket of an existing connection to use
+    (instead of one for this process)
+    """
+
+    def __init__(
+        self,
+        remote_host: str,
+        control_directory: Optional[Union[Path, str]] = None,
+        control_path: Optional[Union[Path, str]] = None,
+    ):
+        self.remote_host = remote_host
+        if control_path is None:
+            control_path = get_control_path(remote_host, control_directory)
+        self.control_path = Path(control_path)
+        self.owner = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def is_running(self) -> bool:
+        """
+        Check whether a master connection is running at the control path
+        """
+        cmd = [
+            "ssh",
+            *control_options(self.control_path),
+            "-O",
+            "check",
+            self.remote_host,
+        ]
+        result = subprocess.run(
+            cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        return result.returncode == 0
+
+    def start(self):
+        """
+        Open the master connection in the background, unless one is
+        already running
+        """
+        if self.is_running():
+            logging.debug(
+                f"Reusing SSH connection to {self.remote_host} "
+                f"at {self.control_path}"
+            )
+            return
+        cmd = [
+            "ssh",
+            *control_options(self.control_path),
+            "-o",
+            "ControlMaster=yes",
+            "-o",
+            "ControlPersist=yes",
+            "-N",
+            "-f",
+            self.remote_host,
+        ]
+        # The backgrounded master inherits stdout/stderr, so they must not
+        # be pipes, or this would block until the connection is closed
+        result = subprocess.run(
+            cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        if result.returncode:
+            raise SSHConnectionError(
+                f"Could not open SSH connection to: {self.remote_host}"
+            )
+        logging.debug(
+            f"Opened SSH connection to {self.remote_host} "
+            f"at {self.control_path}"
+        )
+        self.owner = True
+        atexit.register(self.stop)
+
+    def stop(self):
+        """
+        Close the master connection, if it was opened by this object
+        """
+        if not self.owner:
+            return
+        cmd = [
+            "ssh",
+            *control_options(self.control_path),
+            "-O",
+            "exit",
+            self.remote_host,
+        ]
+        subprocess.run(
+            cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        self.owner = False
+        atexit.unregister(self.stop)
+        logging.debug(f"Closed SSH connection to {self.remote_host}")
+
+
+def get_control_path(
+    remote_host: str, control_directory: Optional[Union[Path, str]] = None
+) -> Path:
+    """
+    Get the socket path for this process's master connection to a host.
+    The path is unique to the process (so it can be given to child
+    processes to share the connection), and short, as unix socket paths
+    are limited to ~100 characters.
+
+    :param remote_host: Remote machine address
+    :param control_directory: Where to create the socket. Defaults to a
+    user-specific directory in the system temporary directory.
+    :return: Path to the control socket
+    """
+    if control_directory is None:
+        control_directory = (
+            Path(tempfile.gettempdir()) / f"synchro-ssh-{os.getuid()}"
+        )
+    control_directory = Path(control_directory)
+    control_directory.mkdir(mode=0o700, exist_ok=True)
+    host_hash = hashlib.sha1(remote_host.encode()).hexdigest()[:16]
+    return control_directory / f"{host_hash}-{os.getpid()}"
+
+
+def control_options(control_path: Optional[Union[Path, str]]) -> list:
+    """
+    ssh options needed to use a master connection
+    :param control_path: Path to the control socket (or None)
+    :return: List of ssh options
+    """
+    if control_path is None:
+        return []
+    return ["-o", f"ControlPath={control_path}"]
+
+
+def rsync_ssh_options(control_path: Optional[Union[Path, str]]) -> list:
+    """
+    rsync options needed to use a master connection for the transfer
+    :param control_path: Path to the control socket (or None)
+    :return: List of rsync options
+    """
+    if control_path is None:
+        return []
+    return [f"--rsh=ssh {' '.join(control_options(control_path))}"]
@@ -0,0 +1,98 @@
+"""
+Copy stdin to stdout (or to the stdin of a command), throttled to the
+bandwidth limits shared by all synchro processes on the host. Used as a
+stage of a streaming transfer, or to wrap the ssh command used by rsync:
+
+    python -m synchro.utils.throttle --limit 200M | ...
+    rsync --rsh="python -m synchro.utils.throttle --limit 200M -- ssh" ...
+"""
+
+import sys
+import threading
+import subprocess
+
+from argparse import ArgumentParser
+
+from synchro.utils.bandwidth import (
+    BandwidthSchedule,
+    SharedThrottle,
+    copy_throttled,
+)
+
+
+def throttle_command(key, limit, global_limit, coordination_file):
+    """
+    Command to run this module
+
+    :param key: Identifies the config (e.g. its path)
+    :param limit: Per-config limit (as in the config file), or None
+    :param global_limit: Global limit (as in the config file), or None
+    :param coordination_file: File shared by all synchro processes, or None
+    for the default
+    """
+    cmd = [sys.executable, "-m", "synchro.utils.throttle", "--key", str(key)]
+    if coordination_file is not None:
+        cmd += ["--coordination-file", str(coordination_file)]
+    if limit is not None:
+        cmd += ["--limit", limit]
+    if global_limit is not None:
+        cmd += ["--global-limit", global_limit]
+    return cmd
+
+
+def parser():
+    parser = ArgumentParser(prog="python -m synchro.utils.throttle")
+    parser.add_argument("--key", default="default")
+    parser.add_argument("--limit", default=None)
+    parser.add_argument("--global-limit", dest="global_limit", default=None)
+    parser.add_argument(
+        "--coordination-file", dest="coordination_file", default=None
+    )
+    parser.add_argument(
+        "command",
+        nargs="*",
+        help="Command to run, with its stdin throttled (after '--')",
+    )
+    return parser
+
+
+def run_throttled(throttle, command):
+    """
+    Run a command (e.g. ssh), throttling what is sent to it. Its output is
+    passed straight through.
+
+    :return: Exit status of the command
+    """
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def send():
+        try:
+            copy_throttled(sys.stdin.buffer, process.stdin, throttle)
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+    return process.wait()
+
+
+def main(args=None):
+    args = parser().parse_args(args)
+    throttle = SharedThrottle(
+        args.key,
+        BandwidthSchedule(args.limit),
+        BandwidthSchedule(args.global_limit),
+        args.coordination_file,
+    )
+    if args.command:
+        sys.exit(run_throttled(throttle, args.command))
+    copy_throttled(sys.stdin.buffer, sys.stdout.buffer, throttle)
+
+
+if __name__ == "__main__":
+    main()
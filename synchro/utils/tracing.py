@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import cProfile
+import threading
+import contextvars
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+# Span being recorded in this context (commands run within it are recorded
+# as child spans)
+_current_span: contextvars.ContextVar[Optional["Span"]] = (
+    contextvars.ContextVar("current_span", default=None)
+)
+
+
+class Span:
+    """
+    A timed section of a synchronisation (e.g. a stage, or a command), with
+    attributes such as the command, bytes, file count and exit code
+
+    :param tracer: Tracer recording the span
+    :param name: Name of the span (e.g. "tar")
+    :param category: Kind of span (e.g. "stage" or "command")
+    :param attributes: Attributes of the span (more can be added until the
+    span ends)
+    """
+
+    def __init__(self, tracer, name, category, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.attributes = dict(attributes)
+        self.thread_id = threading.get_ident()
+        self.start = time.time()
+        self.end = None
+
+    def __repr__(self):
+        return f"Span({self.name}, {self.category})"
+
+    @property
+    def duration(self) -> Optional[float]:
+        return None if self.end is None else self.end - self.start
+
+
+class Tracer:
+    """
+    Record spans, call hooks as each span starts and ends, and export the
+    spans as a Chrome trace (for chrome://tracing or https://ui.perfetto.dev)
+
+    :param trace_file: Where to write the trace (or None)
+    """
+
+    def __init__(self, trace_file: Optional[Union[Path, str]] = None):
+        self.trace_file = trace_file
+        self.spans: list[Span] = []
+        self.hooks: list[Callable[[str, Span], None]] = []
+        self.lock = threading.Lock()
+
+    def add_hook(self, hook: Callable[[str, Span], None]):
+        """
+        :param hook: Function called with ("start", span) as each span
+        starts, and ("end", span) as it ends. Exceptions raised by hooks
+        are not caught.
+        """
+        self.hooks.append(hook)
+
+    def call_hooks(self, event: str, span: Span):
+        for hook in self.hooks:
+            hook(event, span)
+
+    @contextmanager
+    def span(self, name: str, category: str = "stage", **attributes):
+        """
+        Record a span around a block of code. If the block raises an error,
+        the error (and the exit code, if it was a failed command) is added
+        to the attributes.
+
+        :param name: Name of the span
+        :param category: Kind of span
+        :param attributes: Attributes of the span
+        """
+        span = Span(self, name, category, attributes)
+        with self.lock:
+            self.spans.append(span)
+        self.call_hooks("start", span)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as error:
+            span.attributes["error"] = repr(error)
+            if hasattr(error, "returncode"):
+                span.attributes["exit_code"] = error.returncode
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end = time.time()
+            self.call_hooks("end", span)
+
+    def record(
+        self,
+        name: str,
+        start: float,
+        end: float,
+        category: str = "stage",
+        **attributes,
+    ) -> Span:
+        """
+        Record a span that has already ended (e.g. timed from the output of
+        a remote command)
+
+        :param start: Start time (time.time)
+        :param end: End time (time.time)
+        """
+        span = Span(self, name, category, attributes)
+        span.start, span.end = start, end
+        with self.lock:
+            self.spans.append(span)
+        self.call_hooks("start", span)
+        self.call_hooks("end", span)
+        return span
+
+    def chrome_trace(self) -> dict:
+        """
+        The spans in the Chrome trace event format. Stages are complete
+        events, in the track of the thread that ran them. Commands are
+        async events, as several can run at once.
+        """
+        pid = os.getpid()
+        events = []
+        with self.lock:
+            spans = list(self.spans)
+        for i, span in enumerate(spans):
+            end = span.end if span.end is not None else time.time()
+            event = {
+                "name": span.name,
+                "cat": span.category,
+                "pid": pid,
+                "tid": span.thread_id,
+                "ts": span.start * 1e6,
+                "args": span.attributes,
+            }
+            if span.category == "command":
+                events.append({**event, "ph": "b", "id": i})
+                events.append(
+                    {**event, "ph": "e", "id": i, "ts": end * 1e6, "args": {}}
+                )
+            else:
+                events.append(
+                    {**event, "ph": "X", "dur": (end - span.start) * 1e6}
+                )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self):
+        """
+        Write the trace file (if any)
+        """
+        if self.trace_file is None:
+            return
+        trace_file = Path(self.trace_file)
+        trace_file.parent.mkdir(parents=True, exist_ok=True)
+        trace_file.write_text(json.dumps(self.chrome_trace(), default=str))
+
+
+def current_span() -> Optional[Span]:
+    """
+    :return: The span being recorded in this context, if any
+    """
+    return _current_span.get()
+
+
+@contextmanager
+def child_span(name: str, category: str = "command", **attributes):
+    """
+    Record a span within the current span (if any, otherwise nothing is
+    recorded and None is yielded)
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    with parent.tracer.span(name, category, **attributes) as span:
+        yield span
+
+
+@contextmanager
+def profile(profile_file: Optional[Union[Path, str]]):
+    """
+    Profile the Python code run (in this thread) within this context with
+    cProfile, and save the statistics (for pstats or snakeviz)
+
+    :param profile_file: Where to save the statistics (or None to not
+    profile)
+    """
+    if profile_file is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        Path(profile_file).parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(str(profile_file))
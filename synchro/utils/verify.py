@@ -0,0 +1,198 @@
+import os
+import shlex
+import hashlib
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+# Algorithms with a coreutils "<algorithm>sum" equivalent, so that
+# checksums can be calculated on a remote machine, and checked with e.g.
+# "sha256sum -c"
+ALGORITHMS = ("md5", "sha1", "sha256", "sha512")
+BUFFER_SIZE = 8 * 1024 * 1024
+# Exit status of xargs if the command failed for some of the files (e.g.
+# they could not be read)
+XARGS_COMMAND_FAILED = 123
+
+
+def hash_file(
+    filename: Union[Path, str],
+    algorithm: str = "sha256",
+    buffer_size: int = BUFFER_SIZE,
+) -> str:
+    """
+    Calculate the checksum of a file. Large reads into a reused buffer
+    keep the overhead low, and hashlib releases the GIL while hashing, so
+    many files can be hashed in parallel using threads.
+
+    :param filename: File to hash
+    :param algorithm: Hash algorithm (e.g. "sha256")
+    :param buffer_size: Bytes to read at once
+    :return: Hex digest
+    """
+    digest = hashlib.new(algorithm)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(filename, "rb", buffering=0) as f:
+        while True:
+            n_bytes = f.readinto(buffer)
+            if not n_bytes:
+                break
+            digest.update(view[:n_bytes])
+    return digest.hexdigest()
+
+
+def hash_files(
+    directory: Union[Path, str],
+    paths: Iterable[str],
+    algorithm: str = "sha256",
+    threads: int = 8,
+) -> dict:
+    """
+    Calculate checksums of many files in parallel
+
+    :param directory: Directory that the paths are relative to
+    :param paths: Relative paths of the files to hash
+    :param algorithm: Hash algorithm (e.g. "sha256")
+    :param threads: Number of files to hash at once
+    :return: Dict of relative path: hex digest
+    """
+    directory = Path(directory)
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        digests = executor.map(
+            lambda path: hash_file(directory / path, algorithm), paths
+        )
+        return dict(zip(paths, digests))
+
+
+def hashable_files(directory: Union[Path, str], entries) -> list[str]:
+    """
+    Relative paths of the regular files (i.e. not directories or symlinks)
+    in a list of scanned entries
+    """
+    directory = str(directory)
+    return [
+        entry.path
+        for entry in entries
+        if not entry.is_dir
+        and not os.path.islink(os.path.join(directory, entry.path))
+    ]
+
+
+def remote_hash_command(
+    directory: Union[Path, str], algorithm: str = "sha256", threads: int = 8
+) -> list[str]:
+    """
+    Command to calculate checksums of files in a directory, in parallel,
+    using coreutils (e.g. sha256sum). The relative paths of the files are
+    read from stdin, separated by null characters.
+
+    :param directory: Directory that the paths are relative to
+    :param algorithm: Hash algorithm (e.g. "sha256")
+    :param threads: Number of files to hash at once
+    :return: Command (to be prefixed with ssh)
+    """
+    return [
+        f"cd {shlex.quote(str(directory))} && "
+        f"xargs -0 -P {threads} -n 64 {algorithm}sum --"
+    ]
+
+
+def hash_files_with_command(
+    cmd: list, paths: Iterable[str], timeout: Optional[float] = None
+) -> dict:
+    """
+    Calculate checksums of files by running a command from
+    remote_hash_command (e.g. over ssh). Files that can't be hashed (e.g.
+    unreadable) are logged and left out, so they are reported by
+    compare_checksums.
+
+    :param cmd: Command to run
+    :param paths: Relative paths of the files to hash
+    :param timeout: Seconds before the command is stopped
+    :return: Dict of relative path: hex digest
+    """
+    paths = list(paths)
+    if not paths:
+        return {}
+    result = subprocess.run(
+        cmd,
+        input=b"\0".join(os.fsencode(path) for path in paths),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        timeout=timeout,
+    )
+    for line in os.fsdecode(result.stderr).splitlines():
+        logging.error(line)
+    if result.returncode not in (0, XARGS_COMMAND_FAILED):
+        raise subprocess.CalledProcessError(
+            result.returncode, cmd, result.stdout, result.stderr
+        )
+    return dict(
+        parse_checksum_line(line)
+        for line in os.fsdecode(result.stdout).split("\n")
+        if line
+    )
+
+
+def format_checksum_line(path: str, digest: str) -> str:
+    """
+    Format a checksum in the style of coreutils (e.g. sha256sum), including
+    escaping of backslashes and newlines in the filename
+    """
+    if "\\" in path or "\n" in path:
+        path = path.replace("\\", "\\\\").replace("\n", "\\n")
+        return f"\\{digest}  {path}\n"
+    return f"{digest}  {path}\n"
+
+
+def parse_checksum_line(line: str) -> tuple[str, str]:
+    """
+    Parse a line of coreutils (e.g. sha256sum) output
+
+    :return: Relative path (without any leading "./") and hex digest
+    """
+    line = line.rstrip("\n")
+    escaped = line.startswith("\\")
+    if escaped:
+        line = line[1:]
+    digest, path = line.split("  ", 1)
+    if escaped:
+        path = path.replace("\\n", "\n").replace("\\\\", "\\")
+    if path.startswith("./"):
+        path = path[2:]
+    return path, digest
+
+
+def write_checksum_file(checksums: dict, filename: Union[Path, str]):
+    """
+    Save checksums in a file that can be checked with e.g.
+    "sha256sum -c" from the same directory
+    """
+    with open(filename, "w") as f:
+        for path in sorted(checksums):
+            f.write(format_checksum_line(path, checksums[path]))
+
+
+def compare_checksums(source: dict, destination: dict) -> list[str]:
+    """
+    Compare checksums of the source files to those at the destination
+
+    :param source: Dict of relative path: hex digest
+    :param destination: Dict of relative path: hex digest
+    :return: Description of each file that is missing or different
+    """
+    problems = []
+    for path, digest in sorted(source.items()):
+        destination_digest = destination.get(path)
+        if destination_digest is None:
+            problems.append(f"{path}: missing or unreadable at destination")
+        elif destination_digest != digest:
+            problems.append(
+                f"{path}: checksum mismatch (source: {digest}, "
+                f"destination: {destination_digest})"
+            )
+    return problems
@@ -0,0 +1,202 @@
+import io
+import queue
+import shlex
+import threading
+import subprocess
+import contextvars
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+from synchro.utils.misc import log_lines
+
+# Bytes read from tar at once
+CHUNK_SIZE = 1024 * 1024
+# Completed volumes waiting to be sent, before archiving pauses. Together
+# with the volumes being written & sent, this limits the scratch space.
+MAX_PENDING = 2
+# Seconds between checks for new volumes at the destination
+POLL_INTERVAL = 1
+
+
+def volume_name(archive: Union[Path, str], index: int) -> Path:
+    """
+    :return: Filename of a volume of an archive, e.g. "source.tar.003"
+    """
+    return Path(f"{archive}.{index:03d}")
+
+
+def split_into_volumes(
+    stream,
+    archive: Union[Path, str],
+    volume_size: int,
+    on_volume: Callable[[Path, int], None],
+) -> int:
+    """
+    Split a stream (e.g. the output of tar) into volumes of volume_size
+    bytes (the last may be smaller)
+
+    :param stream: Binary file object to read
+    :param archive: Volumes are named after this
+    :param volume_size: Bytes per volume
+    :param on_volume: Called with the path and index of each volume once it
+    has been written
+    :return: Number of volumes
+    """
+    index = 0
+    while True:
+        path = volume_name(archive, index)
+        written = 0
+        with open(path, "wb") as f:
+            while written < volume_size:
+                data = stream.read(min(CHUNK_SIZE, volume_size - written))
+                if not data:
+                    break
+                f.write(data)
+                written += len(data)
+        if written == 0 and index > 0:
+            path.unlink()
+            return index
+        on_volume(path, index)
+        index += 1
+        if written < volume_size:
+            return index
+
+
+def transfer_volumes(
+    tar_cmd: list,
+    archive: Union[Path, str],
+    volume_size: int,
+    send: Callable[[Path, int], None],
+    callback: Optional[Callable[[str], None]] = None,
+    max_pending: int = MAX_PENDING,
+) -> int:
+    """
+    Run tar, splitting the archive it writes to stdout into volumes, and
+    send each volume (in another thread) as soon as it is complete, so
+    archiving and sending overlap. Archiving pauses while max_pending
+    volumes are waiting to be sent.
+
+    :param tar_cmd: tar command writing the archive to stdout
+    :param archive: Volumes are named after this
+    :param volume_size: Bytes per volume
+    :param send: Called with the path and index of each volume, in order
+    :param callback: Function called with each line of tar's output
+    :param max_pending: Maximum number of volumes waiting to be sent
+    :return: Number of volumes
+    """
+    pending: queue.Queue = queue.Queue(maxsize=max_pending)
+    errors: list[Exception] = []
+
+    def send_volumes():
+        while True:
+            item = pending.get()
+            if item is None:
+                return
+            if not errors:
+                try:
+                    send(*item)
+                except Exception as error:
+                    errors.append(error)
+
+    def queue_volume(path, index):
+        if errors:
+            raise errors[0]
+        pending.put((path, index))
+
+    # The copied context carries any timeout to the sending thread
+    sender = threading.Thread(
+        target=contextvars.copy_context().run,
+        args=(send_volumes,),
+        daemon=True,
+    )
+    sender.start()
+    process = subprocess.Popen(
+        tar_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    assert process.stdout is not None and process.stderr is not None
+    # tar lists the files on stderr when writing the archive to stdout
+    logger = threading.Thread(
+        target=log_lines,
+        args=(io.TextIOWrapper(process.stderr, errors="replace"),),
+        kwargs={"callback": callback},
+        daemon=True,
+    )
+    logger.start()
+    try:
+        n_volumes = split_into_volumes(
+            process.stdout, archive, volume_size, queue_volume
+        )
+    finally:
+        # If splitting failed, tar stops when its output is closed
+        process.stdout.close()
+        return_code = process.wait()
+        logger.join()
+        pending.put(None)
+        sender.join()
+
+    if errors:
+        raise errors[0]
+    if return_code:
+        raise subprocess.CalledProcessError(return_code, tar_cmd)
+    return n_volumes
+
+
+def remove_volumes(archive: Union[Path, str]):
+    """
+    Remove any volumes of an archive left by a failed transfer
+    """
+    archive = Path(archive)
+    for path in archive.parent.glob(f"{archive.name}.[0-9]*"):
+        path.unlink(missing_ok=True)
+
+
+def done_marker(volume: Union[Path, str]) -> str:
+    """
+    File created at the destination once a volume has been sent in full
+    """
+    return f"{volume}.done"
+
+
+def end_marker(archive: Union[Path, str]) -> str:
+    """
+    File created at the destination once every volume has been sent (or the
+    transfer has failed)
+    """
+    return f"{archive}.end"
+
+
+def extract_volumes_script(
+    archive: Union[Path, str],
+    untar_cmd: list,
+    poll_interval: float = POLL_INTERVAL,
+) -> str:
+    """
+    Shell script, run at the destination, that concatenates the volumes of
+    an archive into tar as each one arrives, removing each volume once
+    read. It stops once the end marker exists and every volume that was
+    sent has been read.
+
+    :param archive: Path of the archive at the destination
+    :param untar_cmd: tar command extracting an archive from stdin
+    :param poll_interval: Seconds between checks for new volumes
+    """
+    quoted = shlex.quote(str(archive))
+    end = shlex.quote(end_marker(archive))
+    return (
+        "i=0; while :; do "
+        f"f={quoted}.$(printf %03d $i); "
+        'if [ -e "$f.done" ]; then '
+        'cat "$f" && rm -f "$f" "$f.done" || exit 1; i=$((i+1)); '
+        f"elif [ -e {end} ]; then rm -f {end}; break; "
+        f"else sleep {poll_interval}; fi; "
+        f"done | {shlex.join(str(c) for c in untar_cmd)}"
+    )
+
+
+def clear_volumes_script(archive: Union[Path, str]) -> str:
+    """
+    Shell script to remove any volumes & markers left at the destination by
+    an earlier, failed transfer
+    """
+    quoted = shlex.quote(str(archive))
+    return f"rm -f {quoted}.[0-9]* {shlex.quote(end_marker(archive))}"
@@ -0,0 +1,380 @@
+import os
+import time
+import signal
+import configparser
+
+from pathlib import Path
+
+from .batch import (
+    JobScheduler,
+    SyncJob,
+    find_config_files,
+    find_sources,
+    open_ssh_connection,
+)
+from .discover import is_source_pattern
+from .utils.misc import get_config_obj
+from .utils.options import try_set_boolean_with_default
+from .utils.paths import LOCAL_HOST, Paths
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+# Wait this long (s) before retrying a failed synchronisation
+RETRY_INTERVAL = 600
+
+
+class WatchedConfig:
+    """
+    A config file, and the files that decide whether its synchronisation
+    should run (the transfer ready & done files). Only these files are
+    checked (with stat), so checking many configs is cheap.
+
+    :param config_file: Path to config file
+    :param source: Source directory, if the config file has a source
+    pattern matching many directories
+    """
+
+    def __init__(self, config_file, source=None):
+        self.config_file = Path(config_file)
+        self.source = source
+        self.config_mtime = None
+        self.source_directory = None
+        self.transfer_ready_file = None
+        self.transfer_done_file = None
+        self.incremental = False
+        self.last_state = None
+        self.last_failure = None
+        self.load()
+
+    def __repr__(self):
+        if self.source is not None:
+            return f"WatchedConfig({self.config_file}, source={self.source})"
+        return f"WatchedConfig({self.config_file})"
+
+    def load(self):
+        """
+        (Re)load the config file if it has changed
+        """
+        try:
+            mtime = self.config_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            self.source_directory = None
+            return
+        if mtime == self.config_mtime:
+            return
+        self.config_mtime = mtime
+        config = get_config_obj(self.config_file)
+        if self.source is not None:
+            self.source_directory = Path(self.source)
+        else:
+            self.source_directory = Paths.set_source_directory(config)
+        if self.source_directory is None:
+            return
+        self.transfer_ready_file = Paths.set_transfer_initiation(
+            config, self.source_directory
+        )
+        self.transfer_done_file = self.source_directory / "transfer.done"
+        self.incremental = try_set_boolean_with_default(
+            config, False, "incremental", warn_if_missing=False
+        )
+        self.last_state = None
+        self.last_failure = None
+
+    def is_ready(self):
+        """
+        Check whether the synchronisation should run. This is when the
+        transfer ready file (if any) exists, and the transfer has not
+        already been done. For incremental transfers, touching the ready
+        file after the last transfer starts another.
+
+        A synchronisation isn't started again unless the ready or done
+        files have changed since the last one started, except to retry a
+        failure after RETRY_INTERVAL seconds.
+        """
+        if self.source_directory is None:
+            return False
+        state = self.state()
+        if state == self.last_state:
+            if self.last_failure is None:
+                return False
+            if time.monotonic() - self.last_failure < RETRY_INTERVAL:
+                return False
+
+        ready_mtime, done_mtime = state
+        if self.transfer_ready_file is not None and ready_mtime is None:
+            return False
+        if done_mtime is None:
+            return self.source_directory.is_dir()
+        return (
+            self.incremental
+            and ready_mtime is not None
+            and ready_mtime > done_mtime
+        )
+
+    def state(self):
+        """
+        :return: Modification times of the ready and done files
+        """
+        return (
+            modification_time(self.transfer_ready_file),
+            modification_time(self.transfer_done_file),
+        )
+
+    def started(self):
+        self.last_state = self.state()
+        self.last_failure = None
+
+
+class Watcher:
+    """
+    Watch many config files, and start each synchronisation as soon as its
+    source is ready. The source directories are watched with inotify if
+    the optional inotify_simple package is installed, otherwise (or for
+    sources that don't exist yet) the ready files are checked every
+    poll_interval seconds.
+
+    :param paths: Config files, or directories containing them (which are
+    rescanned for new config files)
+    :param poll_interval: Seconds between checks of all the configs
+    :param max_workers: Maximum number of concurrent synchronisations
+    :param max_per_host: Maximum number of concurrent synchronisations per
+    destination host
+    :param log_file: File to log to (otherwise set per synchronisation)
+    :param change_permissions: Change destination ownership & permissions
+    :param use_inotify: Use inotify (if available)
+
+    One multiplexed SSH connection is opened to each destination host (when
+    the first synchronisation to it starts), and shared by all the
+    synchronisations to that host until the watcher stops.
+    """
+
+    def __init__(
+        self,
+        paths,
+        poll_interval=60,
+        max_workers=4,
+        max_per_host=None,
+        log_file=None,
+        change_permissions=True,
+        use_inotify=True,
+    ):
+        self.paths = paths
+        self.poll_interval = poll_interval
+        self.log_file = log_file
+        self.change_permissions = change_permissions
+        self.scheduler = JobScheduler(max_workers, max_per_host)
+        self.configs = {}
+        self.ssh_masters = {}
+        self.stopping = False
+        self.last_poll = None
+
+        self.inotify = None
+        self.watches = {}
+        if use_inotify and INotify is not None:
+            self.inotify = INotify()
+
+    def refresh_configs(self):
+        """
+        Find any new config files (and new source directories matching
+        source patterns), and reload any that have changed. Config files
+        that can't be read are skipped (until they are fixed).
+        """
+        configs = {}
+        for config_file in find_config_files(self.paths):
+            try:
+                for source in find_sources(config_file):
+                    key = (config_file, source)
+                    configs[key] = self.configs.get(key) or WatchedConfig(
+                        config_file, source
+                    )
+                self.add_watch(pattern_base_directory(config_file))
+            except configparser.Error as error:
+                print(f"Skipping config file: {config_file}: {error}")
+        self.configs = configs
+        for config in self.configs.values():
+            try:
+                config.load()
+            except configparser.Error as error:
+                print(f"Skipping config file: {config.config_file}: {error}")
+                config.source_directory = None
+                continue
+            self.add_watch(config.source_directory)
+            if config.transfer_ready_file is not None:
+                self.add_watch(config.transfer_ready_file.parent)
+
+    def add_watch(self, directory):
+        """
+        Watch a directory for the ready file being created, or the done
+        file being removed
+        """
+        if self.inotify is None or directory is None:
+            return
+        if directory in self.watches.values() or not directory.is_dir():
+            return
+        watch_flags = (
+            flags.CREATE
+            | flags.MOVED_TO
+            | flags.ATTRIB
+            | flags.CLOSE_WRITE
+            | flags.DELETE
+        )
+        try:
+            descriptor = self.inotify.add_watch(directory, watch_flags)
+        except OSError:
+            return
+        self.watches[descriptor] = directory
+
+    def start_ready_jobs(self):
+        """
+        Start the synchronisation of every config that is ready (and not
+        already running)
+        """
+        for (config_file, source), config in self.configs.items():
+            if self.scheduler.is_running(config_file, source):
+                continue
+            if config.is_ready():
+                print(f"Source ready, starting: {config}")
+                config.started()
+                job = SyncJob(
+                    config_file,
+                    self.log_file,
+                    self.change_permissions,
+                    source,
+                )
+                job.control_path = self.ssh_control_path(job.host)
+                self.scheduler.submit(job)
+
+    def ssh_control_path(self, host):
+        """
+        Get the control path of the multiplexed SSH connection to a
+        destination host, opening the connection if needed
+
+        :return: Control path, or None for local destinations (or if the
+        connection can't be opened)
+        """
+        if host in (None, LOCAL_HOST):
+            return None
+        ssh_master = self.ssh_masters.get(host)
+        if ssh_master is None or not ssh_master.is_running():
+            ssh_master = open_ssh_connection(host)
+            if ssh_master is None:
+                return None
+            self.ssh_masters[host] = ssh_master
+        return ssh_master.control_path
+
+    def record_results(self):
+        """
+        Check for finished synchronisations, so failures (and those deferred,
+        e.g. until there is enough space) can be retried after RETRY_INTERVAL
+        """
+        failed = len(self.scheduler.failed)
+        deferred = len(self.scheduler.deferred)
+        self.scheduler.wait(timeout=0)
+        jobs = [job for job, _ in self.scheduler.failed[failed:]]
+        jobs += self.scheduler.deferred[deferred:]
+        for job in jobs:
+            config = self.configs.get((job.config_file, job.source))
+            if config is not None:
+                config.last_failure = time.monotonic()
+
+    def wait_for_events(self, timeout):
+        """
+        Wait until something changes in a watched directory, or for the
+        timeout (s)
+
+        :return: True if anything changed
+        """
+        if self.inotify is None:
+            time.sleep(timeout)
+            return False
+        events = self.inotify.read(timeout=int(timeout * 1000))
+        for event in events:
+            if event.mask & flags.IGNORED:
+                # Directory was removed
+                self.watches.pop(event.wd, None)
+        return bool(events)
+
+    def check(self, refresh=False):
+        """
+        Check all configs once, and start any that are ready
+
+        :param refresh: Look for new config files and source directories,
+        even if the poll interval hasn't passed
+        """
+        now = time.monotonic()
+        if (
+            refresh
+            or self.last_poll is None
+            or now - self.last_poll >= self.poll_interval
+        ):
+            self.refresh_configs()
+            self.last_poll = now
+        self.record_results()
+        self.start_ready_jobs()
+
+    def run(self):
+        """
+        Watch until stopped (e.g. by SIGTERM or Ctrl-C). Running
+        synchronisations are allowed to finish.
+        """
+        signal.signal(signal.SIGTERM, self.handle_sigterm)
+        print(f"Watching {len(find_config_files(self.paths))} config files")
+        try:
+            changed = False
+            while not self.stopping:
+                self.check(refresh=changed)
+                # Check often while jobs are running, to record results
+                timeout = 1 if self.scheduler.running else self.poll_interval
+                changed = self.wait_for_events(timeout)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            print("Stopping, waiting for running synchronisations to finish")
+            self.scheduler.wait_for_running()
+            self.scheduler.shutdown()
+            for ssh_master in self.ssh_masters.values():
+                ssh_master.stop()
+            if self.inotify is not None:
+                self.inotify.close()
+
+    def stop(self):
+        self.stopping = True
+
+    @staticmethod
+    def handle_sigterm(*args):
+        # Interrupt any wait, and stop as if Ctrl-C was pressed
+        raise KeyboardInterrupt
+
+
+def pattern_base_directory(config_file):
+    """
+    For a config file with a source pattern (e.g. "/data/runs/*"), the
+    directory where new source directories will appear (e.g. "/data/runs")
+
+    :return: Directory, or None if the source isn't a pattern
+    """
+    try:
+        source = Paths.set_source_directory(get_config_obj(config_file))
+    except (OSError, configparser.Error):
+        return None
+    if not is_source_pattern(source):
+        return None
+    base = Path(source)
+    while is_source_pattern(base):
+        base = base.parent
+    return base
+
+
+def modification_time(path):
+    """
+    :return: Modification time of a file (ns), or None if it doesn't exist
+    """
+    if path is None:
+        return None
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
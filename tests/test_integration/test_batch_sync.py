@@ -0,0 +1,81 @@
+import sys
+import asyncio
+from pathlib import Path
+from synchro.batch import SyncJob, run_batch_async
+from synchro.cli import main as synchro_run
+from .test_local_sync import prep_sync
+
+
+def test_batch_sync_directory_of_configs(tmpdir):
+    # Run several configs, found in a directory, in one invocation
+    tmpdir = Path(tmpdir)
+    config_dir = tmpdir / "configs"
+    config_dir.mkdir()
+    dest_dirs = []
+    for name in ("run_1", "run_2", "run_3"):
+        directory = tmpdir / name
+        directory.mkdir()
+        _, dest_dir, config_file = prep_sync(
+            directory, extra_options={"stream": "y"}
+        )
+        config_file.rename(config_dir / f"{name}.conf")
+        dest_dirs.append(dest_dir)
+
+    sys.argv = [
+        "synchro",
+        str(config_dir),
+        "--no-permission-change",
+        "--jobs",
+        "2",
+        "--jobs-per-host",
+        "1",
+    ]
+    synchro_run()
+    for dest_dir in dest_dirs:
+        # Config files were moved, so only the 3 test files/directories
+        assert len(list(dest_dir.iterdir())) == 3
+
+
+def test_batch_sync_source_pattern(tmpdir):
+    # Synchronise every directory matching the source pattern, each to a
+    # directory of the same name at the destination
+    tmpdir = Path(tmpdir)
+    runs_dir = tmpdir / "runs"
+    for name in ("run_1", "run_2"):
+        (runs_dir / name).mkdir(parents=True)
+        (runs_dir / name / "data.txt").write_text(name)
+    (runs_dir / "run_2" / "transfer.done").touch()
+    dest_dir = tmpdir / "dest"
+    config_file = tmpdir / "runs.conf"
+    config_file.write_text(
+        f"source = {runs_dir}/*\n"
+        f"destination = {dest_dir}\n"
+        "create_dest = y\n"
+        "stream = y\n"
+    )
+
+    sys.argv = ["synchro", str(config_file), "--no-permission-change"]
+    synchro_run()
+    assert (dest_dir / "run_1" / "data.txt").read_text() == "run_1"
+    assert not (dest_dir / "run_2").exists()
+    assert (tmpdir / "runs.conf.index").exists()
+
+
+def test_batch_sync_async(tmpdir):
+    # Run several configs from an asyncio event loop
+    tmpdir = Path(tmpdir)
+    jobs = []
+    dest_dirs = []
+    for name in ("run_1", "run_2"):
+        directory = tmpdir / name
+        directory.mkdir()
+        _, dest_dir, config_file = prep_sync(
+            directory, extra_options={"stream": "y"}
+        )
+        jobs.append(SyncJob(config_file, change_permissions=False))
+        dest_dirs.append(dest_dir)
+
+    failed = asyncio.run(run_batch_async(jobs, max_workers=2, max_per_host=1))
+    assert failed == []
+    for dest_dir in dest_dirs:
+        assert (dest_dir / "test_dir").exists()
@@ -0,0 +1,54 @@
+import json
+from pathlib import Path
+from benchmarks.datasets import create_dataset
+from benchmarks.fake_ssh import parse_args
+from benchmarks.run import main as run_benchmarks
+
+
+def test_create_dataset(tmpdir):
+    # The same files are created for the same seed
+    first = create_dataset("run", Path(tmpdir) / "first", scale=0.01)
+    second = create_dataset("run", Path(tmpdir) / "second", scale=0.01)
+    fastq = Path("Fastq") / "sample_L001_R1_001.fastq.gz"
+    assert (first / fastq).read_bytes() == (second / fastq).read_bytes()
+    assert (first / "Data" / "Intensities" / "BaseCalls" / "L004").is_dir()
+
+
+def test_fake_ssh_parse_args():
+    options, host, command = parse_args(
+        ["-o", "ControlPath=/tmp/x", "-Nf", "-l", "user", "host", "ls", "-l"]
+    )
+    assert options["o"] == ["ControlPath=/tmp/x"]
+    assert options["N"] and options["f"]
+    assert options["l"] == "user"
+    assert host == "host"
+    assert command == "ls -l"
+
+
+def test_benchmark_remote_stream(tmpdir):
+    # Synchronise to a "remote" destination, through the fake ssh
+    tmpdir = Path(tmpdir)
+    output = tmpdir / "results.json"
+    run_benchmarks(
+        [
+            "--datasets",
+            "deep",
+            "--modes",
+            "stream",
+            "--scale",
+            "0.01",
+            "--remote",
+            "--connect-latency",
+            "0.1",
+            "--latency",
+            "0",
+            "--work-dir",
+            str(tmpdir / "work"),
+            "--output",
+            str(output),
+        ]
+    )
+    (result,) = json.loads(output.read_text())["results"]
+    assert result["remote"]
+    assert result["files"] == 30
+    assert result["stages"]["stream"] > 0
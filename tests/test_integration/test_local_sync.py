@@ -1,6 +1,20 @@
+import json
 import sys
+import pytest
 from pathlib import Path
 from synchro.cli import main as synchro_run
+from synchro.sync import (
+    DestinationDirectoryError,
+    InsufficientSpaceError,
+    Synchronise,
+)
+from synchro.utils.history import (
+    failure_rates,
+    slowest_stages,
+    throughput_by_host,
+)
+from synchro.utils.journal import Journal, source_fingerprint
+from synchro.utils.scan import scan_directory
 from ..utils.utils import create_conf_file
 
 
@@ -28,6 +42,424 @@ def test_local_sync_no_tar(tmpdir):
     assert len(list(dest_dir.iterdir())) == 4
 
 
+def test_local_sync_rsync_shards(tmpdir):
+    # Run without tar, splitting the transfer across several rsync processes
+    source_dir, dest_dir, _ = prep_run_sync(
+        tmpdir,
+        create_ready_file=None,
+        check_ready_file=None,
+        tar="n",
+        extra_options={"rsync_shards": 3},
+    )
+    source_files = sorted(p.name for p in source_dir.iterdir())
+    assert sorted(p.name for p in dest_dir.iterdir()) == source_files
+
+
+def test_local_sync_not_started(tmpdir, monkeypatch):
+    # The file lists for rsync are only written when the synchronisation
+    # starts, so nothing is left if it doesn't
+    scratch = Path(tmpdir) / "scratch"
+    scratch.mkdir()
+    monkeypatch.setattr("tempfile.tempdir", str(scratch))
+    source_dir, _, config_file = prep_sync(
+        tmpdir, tar="n", extra_options={"rsync_shards": 2}
+    )
+    synchro = Synchronise(
+        config_file, source_dir / "synchro.log", change_permissions=False
+    )
+    assert len(synchro.rsync_shard_strings) == 2
+    assert not list(scratch.iterdir())
+
+
+def test_local_sync_hybrid(tmpdir):
+    # Archive small files, and rsync large files directly
+    source_dir, dest_dir, config_file = prep_sync(
+        tmpdir,
+        extra_options={"hybrid_threshold": "1K", "rsync_shards": 2},
+    )
+    (source_dir / "test_dir" / "large.bin").write_bytes(b"x" * 4096)
+    run_sync(config_file)
+
+    assert len(list(dest_dir.iterdir())) == 4
+    assert (dest_dir / "test_dir" / "large.bin").stat().st_size == 4096
+    assert (dest_dir / "test_dir").stat().st_mtime == (
+        source_dir / "test_dir"
+    ).stat().st_mtime
+
+
+def test_local_sync_volumes(tmpdir):
+    # Send the archive in volumes, extracting them as they arrive
+    source_dir, dest_dir, config_file = prep_sync(
+        tmpdir, extra_options={"volume_size": "10K"}
+    )
+    (source_dir / "test_dir" / "data.bin").write_bytes(b"x" * 50000)
+    run_sync(config_file)
+
+    assert len(list(dest_dir.iterdir())) == 4
+    assert (dest_dir / "test_dir" / "data.bin").stat().st_size == 50000
+    assert not list(Path(tmpdir).glob("source.tar*"))
+
+
+def test_local_stream_sync(tmpdir):
+    # Stream the archive straight into the destination
+    source_dir, dest_dir, _ = prep_run_sync(
+        tmpdir,
+        create_ready_file=None,
+        check_ready_file=None,
+        extra_options={"stream": "y"},
+    )
+    assert len(list(dest_dir.iterdir())) == 4
+    assert not (tmpdir / "source.tar").exists()
+
+
+def test_local_stream_sync_trace(tmpdir):
+    # Every stage (and the commands it runs) is exported as a trace
+    trace_file = Path(tmpdir) / "trace.json"
+    profile_file = Path(tmpdir) / "synchro.prof"
+    prep_run_sync(
+        tmpdir,
+        extra_options={
+            "stream": "y",
+            "trace_file": trace_file,
+            "profile_file": profile_file,
+        },
+    )
+    events = json.loads(trace_file.read_text())["traceEvents"]
+    spans = {}
+    for event in events:
+        # Commands have begin & end events
+        spans.setdefault(event["name"], event)
+    for name in ("read_config", "paths", "check_destination", "stream"):
+        assert spans[name]["ph"] == "X"
+    assert spans["stream"]["args"]["files"] >= 4
+    assert spans["pipeline"]["args"]["exit_codes"] == [0, 0]
+    assert "transfer_done" in spans
+    assert profile_file.exists()
+
+
+def test_local_stream_sync_no_untar(tmpdir):
+    # Stream the archive, but don't extract it at the destination
+    _, dest_dir, _ = prep_run_sync(
+        tmpdir,
+        create_ready_file=None,
+        check_ready_file=None,
+        untar="n",
+        extra_options={"stream": "y"},
+    )
+    assert [p.name for p in dest_dir.iterdir()] == ["source.tar"]
+
+
+def test_local_stream_sync_compressed(tmpdir):
+    # Compress the streamed archive, and write it to the destination
+    _, dest_dir, _ = prep_run_sync(
+        tmpdir,
+        create_ready_file=None,
+        check_ready_file=None,
+        untar="n",
+        extra_options={"stream": "y", "compression": "zstd"},
+    )
+    assert [p.name for p in dest_dir.iterdir()] == ["source.tar.zst"]
+
+
+def test_local_incremental_sync(tmpdir):
+    # Only new or changed files are sent after the first transfer
+    source_dir, dest_dir, config_file = prep_run_sync(
+        tmpdir,
+        create_ready_file=None,
+        check_ready_file=None,
+        extra_options={"stream": "y", "incremental": "y"},
+    )
+    assert (source_dir / "synchro.manifest").exists()
+    remove_path(dest_dir)
+
+    # Nothing has changed, so nothing is transferred
+    run_sync(config_file)
+    assert dest_dir.exists() is False
+
+    dest_dir.mkdir()
+    (source_dir / "test3.txt").touch()
+    run_sync(config_file)
+    assert [p.name for p in dest_dir.iterdir()] == ["test3.txt"]
+
+
+def test_local_stream_sync_verify(tmpdir):
+    # Verify the transfer, and write checksums at the destination
+    source_dir, dest_dir, _ = prep_run_sync(
+        tmpdir,
+        create_ready_file=None,
+        check_ready_file=None,
+        extra_options={"stream": "y", "verify": "y"},
+    )
+    with open(dest_dir / "synchro.sha256") as f:
+        lines = f.readlines()
+    # test1.txt, test2.txt & synchro.conf
+    assert len(lines) == 3
+
+
+def test_local_stream_sync_metrics(tmpdir):
+    # Write metrics for the transfer, and the time taken by each stage
+    metrics_file = Path(tmpdir) / "metrics.json"
+    prometheus_file = Path(tmpdir) / "synchro.prom"
+    prep_run_sync(
+        tmpdir,
+        create_ready_file=None,
+        check_ready_file=None,
+        extra_options={
+            "stream": "y",
+            "metrics_file": str(metrics_file),
+            "prometheus_file": str(prometheus_file),
+        },
+    )
+    with open(metrics_file) as f:
+        metrics = json.load(f)
+    assert metrics["status"] == "success"
+    # ., test_dir, test1.txt, test2.txt & synchro.conf
+    assert metrics["files_transferred"] == 5
+    assert set(metrics["stages"]) == {"stream", "permissions"}
+    assert "synchro_success{" in prometheus_file.read_text()
+
+
+def test_local_stream_sync_log_summary(tmpdir):
+    # Summarise the list of files in the log
+    source_dir, dest_dir, _ = prep_run_sync(
+        tmpdir,
+        create_ready_file=None,
+        check_ready_file=None,
+        extra_options={"stream": "y", "log_summary": "y"},
+    )
+    assert len(list(dest_dir.iterdir())) == 4
+    (log_file,) = source_dir.glob("synchro_*.log")
+    log = log_file.read_text()
+    assert "5 lines of output" in log
+    assert "./test1.txt\n" not in log
+
+
+def test_local_stream_sync_resume(tmpdir):
+    # Skip the stages completed by an interrupted synchronisation
+    source_dir, dest_dir, config_file = prep_sync(
+        tmpdir, extra_options={"stream": "y", "resume": "y"}
+    )
+    fingerprint = source_fingerprint(
+        scan_directory(source_dir), config_file.read_text()
+    )
+    interrupted = Journal(source_dir / "synchro.journal", fingerprint)
+    interrupted.complete("stream")
+
+    run_sync(config_file)
+    assert not dest_dir.exists() or not list(dest_dir.iterdir())
+    assert (source_dir / "transfer.done").exists()
+    assert not (source_dir / "synchro.journal").exists()
+
+
+def test_local_stream_sync_resume_source_changed(tmpdir):
+    # Start again if the source has changed since the interruption
+    source_dir, dest_dir, config_file = prep_sync(
+        tmpdir, extra_options={"stream": "y", "resume": "y"}
+    )
+    interrupted = Journal(source_dir / "synchro.journal", "old")
+    interrupted.complete("stream")
+
+    run_sync(config_file)
+    assert len(list(dest_dir.iterdir())) == 4
+
+
+def test_local_stream_sync_bandwidth_limit(tmpdir):
+    # Stream through the shared bandwidth throttle
+    _, dest_dir, _ = prep_run_sync(
+        tmpdir,
+        create_ready_file=None,
+        check_ready_file=None,
+        extra_options={
+            "stream": "y",
+            "bandwidth_limit": "00:00-12:00=100M, 200M",
+            "global_bandwidth_limit": "1G",
+            "bandwidth_coordination_file": str(
+                Path(tmpdir) / "bandwidth.json"
+            ),
+        },
+    )
+    assert len(list(dest_dir.iterdir())) == 4
+    assert (Path(tmpdir) / "bandwidth.json").exists()
+
+
+def test_local_stream_sync_inline_permissions(tmpdir):
+    # Permissions are set on extraction, and only the destination directory
+    # itself is changed afterwards
+    source_dir, dest_dir, config_file = prep_sync(
+        tmpdir,
+        extra_options={"stream": "y", "inline_permissions": "y"},
+    )
+    (source_dir / "test1.txt").chmod(0o600)
+    (source_dir / "test_dir").chmod(0o700)
+    sys.argv = ["synchro", str(config_file)]
+    synchro_run()
+
+    for path in (dest_dir, dest_dir / "test1.txt", dest_dir / "test_dir"):
+        assert path.stat().st_mode & 0o777 == 0o770
+    (log_file,) = source_dir.glob("synchro_*.log")
+    log = log_file.read_text()
+    assert "--mode=770" in log
+    assert "chmod -R" not in log
+
+
+def test_local_stream_sync_records_history(tmpdir, transfer_history, capsys):
+    # Each run is saved in the run history database, for synchro report
+    prep_run_sync(
+        tmpdir,
+        create_ready_file=None,
+        check_ready_file=None,
+        extra_options={"stream": "y"},
+    )
+    rows = throughput_by_host(transfer_history)
+    assert [(row["host"], row["runs"]) for row in rows] == [("localhost", 1)]
+    stages = [row["stage"] for row in slowest_stages(transfer_history)]
+    assert "stream" in stages
+
+    sys.argv = ["synchro", "report", "--history-file", str(transfer_history)]
+    synchro_run()
+    output = capsys.readouterr().out
+    assert "localhost" in output
+    assert "0/1" in output
+
+
+def test_local_plan(tmpdir, capsys):
+    # Planning describes the transfer without running it
+    source_dir, dest_dir, config_file = prep_sync(
+        tmpdir, create_ready_file=None, check_ready_file=None
+    )
+    (source_dir / "test1.txt").write_text("data", "utf-8")
+    sys.argv = ["synchro", "plan", str(config_file)]
+    synchro_run()
+
+    output = capsys.readouterr().out
+    # test1.txt, test2.txt & synchro.conf
+    assert "Files: 3" in output
+    assert "Directories: 1" in output
+    assert "Scratch space for the tar archive" in output
+    assert "Space needed at the destination" in output
+    assert "rsync: rsync" in output
+    assert "no previous transfers to localhost" in output
+    assert not dest_dir.exists()
+    assert not (Path(tmpdir) / "source.tar").exists()
+    assert not list(source_dir.glob("synchro_*.log"))
+
+
+def test_local_plan_not_ready(tmpdir, capsys):
+    # Why the synchronisation wouldn't run is left out of the plan
+    _, _, config_file = prep_sync(tmpdir, check_ready_file="ready.txt")
+    sys.argv = ["synchro", "plan", str(config_file)]
+    synchro_run()
+
+    output = capsys.readouterr().out
+    assert output.startswith("Plan for:")
+    assert "Ready to run: no" in output
+    assert "Not running synchronisation" not in output
+
+
+def test_local_sync_failed_records_history(tmpdir, transfer_history):
+    # A synchronisation that fails before it starts is recorded as failed
+    _, _, config_file = prep_sync(tmpdir, create_dest="n")
+    with pytest.raises(DestinationDirectoryError):
+        run_sync(config_file)
+    rows = failure_rates(transfer_history)
+    assert [(row["runs"], row["failures"]) for row in rows] == [(1, 1)]
+
+
+def test_local_plan_hybrid(tmpdir, capsys):
+    # Large files are sent directly, and left out of the archive
+    source_dir, _, config_file = prep_sync(
+        tmpdir, extra_options={"hybrid_threshold": "1K"}
+    )
+    (source_dir / "large.bin").write_bytes(b"x" * 4096)
+    sys.argv = ["synchro", "plan", str(config_file)]
+    synchro_run()
+
+    output = capsys.readouterr().out
+    assert "rsync large files 0: rsync" in output
+    assert "--no-recursion . -T" in output
+    # 2 small files & synchro.conf, 2 directories, and the end of archive
+    assert "Scratch space for the tar archive: 10.0 KiB" in output
+
+
+def test_local_plan_reproducible_archive(tmpdir, capsys):
+    # Sorted, rsyncable archives, kept at the destination for the next
+    # transfer
+    _, _, config_file = prep_sync(
+        tmpdir,
+        extra_options={
+            "reproducible_archive": "y",
+            "compression": "zstd",
+            "rsyncable": "y",
+            "delete_destination_tar": "n",
+        },
+    )
+    sys.argv = ["synchro", "plan", str(config_file)]
+    synchro_run()
+
+    output = capsys.readouterr().out
+    assert "zstd -T0 -3 --rsyncable --sort=name --format=gnu" in output
+    assert "delete destination tar" not in output
+
+
+def test_local_sync_space_check(tmpdir, monkeypatch):
+    # Without enough space, the synchronisation is deferred (nothing is
+    # written), or refused
+    monkeypatch.setattr("synchro.sync.local_free_space", lambda path: 0)
+    source_dir, dest_dir, config_file = prep_sync(
+        tmpdir, extra_options={"stream": "y", "space_check": "defer"}
+    )
+    run_sync(config_file)
+    assert not dest_dir.exists()
+    assert not (source_dir / "transfer.done").exists()
+
+    config = config_file.read_text()
+    config_file.write_text(config.replace("defer", "refuse"))
+    with pytest.raises(InsufficientSpaceError):
+        run_sync(config_file)
+
+    monkeypatch.undo()
+    run_sync(config_file)
+    assert (source_dir / "transfer.done").exists()
+    assert len(list(dest_dir.iterdir())) == 4
+
+
+def test_local_native_copy(tmpdir):
+    # Copy natively, rather than with tar, rsync & untar
+    metrics_file = Path(tmpdir) / "metrics.json"
+    source_dir, dest_dir, config_file = prep_sync(
+        tmpdir,
+        extra_options={"local_copy": "copy", "metrics_file": metrics_file},
+    )
+    (source_dir / "test_dir" / "data.bin").write_bytes(b"x" * 4096)
+    run_sync(config_file)
+
+    assert len(list(dest_dir.iterdir())) == 4
+    assert (dest_dir / "test_dir" / "data.bin").read_bytes() == b"x" * 4096
+    assert not list(Path(tmpdir).glob("source.tar*"))
+    metrics = json.loads(metrics_file.read_text())
+    assert list(metrics["stages"]) == ["copy", "permissions"]
+    assert metrics["bytes_transferred"] >= 4096
+
+
+def test_local_native_copy_hardlink(tmpdir):
+    # Without changing ownership & permissions, files can be hardlinked
+    source_dir, dest_dir, _ = prep_run_sync(
+        tmpdir, tar="n", extra_options={"local_copy": "hardlink"}
+    )
+    assert (dest_dir / "test1.txt").samefile(source_dir / "test1.txt")
+
+
+def test_local_plan_native_copy(tmpdir, capsys):
+    _, _, config_file = prep_sync(tmpdir, extra_options={"local_copy": "copy"})
+    sys.argv = ["synchro", "plan", str(config_file)]
+    synchro_run()
+
+    output = capsys.readouterr().out
+    assert "copy: native copy of" in output
+    assert "Scratch space: none" in output
+    assert "rsync:" not in output
+
+
 def test_local_sync_5_files(tmpdir, ready_file="ready.txt"):
     # Create a ready file, but do not require it
     _, dest_dir, _ = prep_run_sync(
@@ -101,6 +533,7 @@ def prep_run_sync(
     tar="y",
     untar="y",
     create_dest="y",
+    extra_options=None,
 ):
     source_dir, dest_dir, config_file = prep_sync(
         directory,
@@ -109,6 +542,7 @@ def prep_run_sync(
         tar=tar,
         untar=untar,
         create_dest=create_dest,
+        extra_options=extra_options,
     )
     run_sync(config_file)
     return source_dir, dest_dir, config_file
@@ -121,6 +555,7 @@ def prep_sync(
     tar="y",
     untar="y",
     create_dest="y",
+    extra_options=None,
 ):
     directory = Path(directory)
     source_dir, dest_dir = prep_directories(directory)
@@ -132,6 +567,7 @@ def prep_sync(
         tar=tar,
         untar=untar,
         create_dest=create_dest,
+        extra_options=extra_options,
     )
     return source_dir, dest_dir, config_file
 
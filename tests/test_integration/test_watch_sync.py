@@ -0,0 +1,31 @@
+from pathlib import Path
+
+from synchro.watch import Watcher
+from .test_local_sync import prep_sync
+
+
+def test_watch_starts_when_ready(tmpdir):
+    # Start the synchronisation once the ready file appears, and only once
+    source_dir, dest_dir, config_file = prep_sync(
+        Path(tmpdir),
+        check_ready_file="ready.txt",
+        extra_options={"stream": "y"},
+    )
+    watcher = Watcher(
+        [config_file], change_permissions=False, use_inotify=False
+    )
+    try:
+        watcher.check()
+        assert not watcher.scheduler.running
+
+        (source_dir / "ready.txt").touch()
+        watcher.check()
+        assert len(watcher.scheduler.running) == 1
+        watcher.scheduler.run_until_complete()
+        assert (source_dir / "transfer.done").exists()
+        assert len(list(dest_dir.iterdir())) == 5
+
+        watcher.check()
+        assert not watcher.scheduler.running
+    finally:
+        watcher.scheduler.shutdown()
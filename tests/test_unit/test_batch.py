@@ -0,0 +1,75 @@
+from synchro import batch
+from ..utils.utils import create_conf_file
+
+
+class DummyExecutor:
+    def submit(self, function, job):
+        return object()
+
+
+def make_job(tmpdir, name, destination):
+    directory = tmpdir / name
+    directory.mkdir()
+    config_file = create_conf_file(directory, destination)
+    return batch.SyncJob(config_file)
+
+
+def test_find_config_files(tmpdir):
+    (tmpdir / "a.conf").write_text("", "utf-8")
+    (tmpdir / "b.conf").write_text("", "utf-8")
+    (tmpdir / "notes.txt").write_text("", "utf-8")
+    config_files = batch.find_config_files([tmpdir, tmpdir / "c.conf"])
+    assert [f.name for f in config_files] == ["a.conf", "b.conf", "c.conf"]
+
+
+def test_get_destination_host(tmpdir):
+    local_job = make_job(tmpdir, "local", tmpdir / "dest")
+    remote_job = make_job(tmpdir, "remote", "user@remote:/path/to/dir")
+    assert local_job.host == batch.LOCAL_HOST
+    assert remote_job.host == "user@remote"
+    assert batch.get_destination_host(tmpdir / "missing.conf") is None
+
+
+def test_dispatch_per_host_limit(tmpdir):
+    scheduler = batch.JobScheduler(max_workers=3, max_per_host=1)
+    scheduler.executor.shutdown()
+    scheduler.executor = DummyExecutor()
+
+    remote_1 = make_job(tmpdir, "remote_1", "user@remote:/path/1")
+    remote_2 = make_job(tmpdir, "remote_2", "user@remote:/path/2")
+    local = make_job(tmpdir, "local", tmpdir / "dest")
+    for job in (remote_1, remote_2, local):
+        scheduler.submit(job)
+
+    # Second remote job is blocked by the host limit, but doesn't block
+    # the local job
+    assert list(scheduler.running.values()) == [remote_1, local]
+    assert list(scheduler.pending) == [remote_2]
+    assert scheduler.is_running(remote_2.config_file)
+
+
+def test_job_malformed_config(tmpdir):
+    # Reported as a failure when run, rather than stopping the batch
+    bad = tmpdir / "bad.conf"
+    bad.write_text("source = /data\nsource = /other\n", "utf-8")
+    assert batch.SyncJob(bad).host is None
+
+
+def test_create_jobs_malformed_config(tmpdir):
+    # Reported as a failure when run, rather than stopping the batch
+    good = make_job(tmpdir, "good", tmpdir / "dest")
+    bad = tmpdir / "bad.conf"
+    bad.write_text("source = /data\nsource = /other\n", "utf-8")
+    jobs = batch.create_jobs([bad, good.config_file])
+    assert [(job.config_file, job.source) for job in jobs] == [
+        (bad, None),
+        (good.config_file, None),
+    ]
+    assert jobs[0].host is None
+
+
+def test_job_name(tmpdir):
+    job = make_job(tmpdir, "run", tmpdir / "dest")
+    assert job.name == "synchro"
+    job.source = "/data/runs/run_1"
+    assert job.name == "synchro:run_1"
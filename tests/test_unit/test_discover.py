@@ -0,0 +1,74 @@
+from pathlib import Path
+
+from synchro import discover
+
+
+def make_runs(tmpdir, names):
+    for name in names:
+        (tmpdir / name).mkdir()
+
+
+def test_is_source_pattern():
+    assert discover.is_source_pattern("/data/runs/*")
+    assert discover.is_source_pattern(Path("/data/run_[0-9]"))
+    assert not discover.is_source_pattern("/data/runs")
+    assert not discover.is_source_pattern(None)
+
+
+def test_match_directories(tmpdir):
+    make_runs(tmpdir, ["a", "a/run_1", "a/run_2", "b", "b/run_3", ".hidden"])
+    (tmpdir / "a" / "run_file.txt").write_text("", "utf-8")
+    assert discover.match_directories(tmpdir / "*") == [
+        str(tmpdir / "a"),
+        str(tmpdir / "b"),
+    ]
+    assert discover.match_directories(tmpdir / "*" / "run_*") == [
+        str(tmpdir / "a" / "run_1"),
+        str(tmpdir / "a" / "run_2"),
+        str(tmpdir / "b" / "run_3"),
+    ]
+
+
+def test_discover_sources(tmpdir):
+    runs = tmpdir / "runs"
+    runs.mkdir()
+    make_runs(runs, ["run_1", "run_2"])
+    (runs / "run_1" / "transfer.done").write_text("", "utf-8")
+    index_file = tmpdir / "runs.conf.index"
+
+    sources = discover.discover_sources(runs / "*", index_file)
+    assert sources == [Path(runs / "run_2")]
+    assert discover.load_index(index_file) == {
+        str(runs / "run_1"): discover.DONE,
+        str(runs / "run_2"): discover.PENDING,
+    }
+
+    (runs / "run_2").remove()
+    make_runs(runs, ["run_3"])
+    sources = discover.discover_sources(runs / "*", index_file)
+    assert sources == [Path(runs / "run_3")]
+    assert str(runs / "run_2") not in discover.load_index(index_file)
+
+
+def test_discover_sources_done_file_removed(tmpdir):
+    # Removing transfer.done synchronises a done directory again
+    make_runs(tmpdir, ["run_1"])
+    (tmpdir / "run_1" / "transfer.done").write_text("", "utf-8")
+    index_file = tmpdir / "runs.conf.index"
+    assert discover.discover_sources(tmpdir / "*", index_file) == []
+
+    (tmpdir / "run_1" / "transfer.done").remove()
+    sources = discover.discover_sources(tmpdir / "*", index_file)
+    assert sources == [Path(tmpdir / "run_1")]
+    assert discover.load_index(index_file) == {
+        str(tmpdir / "run_1"): discover.PENDING
+    }
+
+
+def test_discover_sources_incremental(tmpdir):
+    make_runs(tmpdir, ["run_1"])
+    (tmpdir / "run_1" / "transfer.done").write_text("", "utf-8")
+    sources = discover.discover_sources(
+        tmpdir / "*", tmpdir / "index", incremental=True
+    )
+    assert sources == [Path(tmpdir / "run_1")]
@@ -0,0 +1,95 @@
+import io
+from datetime import datetime
+
+import pytest
+
+from synchro.utils import bandwidth, throttle
+
+
+def test_parse_rate():
+    assert bandwidth.parse_rate("200M") == 200 * 1024**2
+    assert bandwidth.parse_rate(" 1.5GB") == int(1.5 * 1024**3)
+    assert bandwidth.parse_rate("512k") == 512 * 1024
+    assert bandwidth.parse_rate("1000") == 1000
+    assert bandwidth.parse_rate("unlimited") is None
+    assert bandwidth.parse_rate("0") is None
+    with pytest.raises(ValueError):
+        bandwidth.parse_rate("fast")
+
+
+def test_bandwidth_schedule():
+    schedule = bandwidth.BandwidthSchedule(
+        "09:00-18:00=200M, 22:00-06:00=0, 1G"
+    )
+    assert schedule.limit_at(datetime(2024, 1, 1, 9, 0)) == 200 * 1024**2
+    assert schedule.limit_at(datetime(2024, 1, 1, 18, 0)) == 1024**3
+    assert schedule.limit_at(datetime(2024, 1, 1, 23, 0)) is None
+    assert schedule.limit_at(datetime(2024, 1, 1, 5, 59)) is None
+    assert not bandwidth.BandwidthSchedule(None)
+
+
+def test_lowest_limit():
+    assert bandwidth.lowest_limit(
+        bandwidth.BandwidthSchedule("2M"),
+        bandwidth.BandwidthSchedule("1M"),
+        bandwidth.BandwidthSchedule(None),
+    ) == bandwidth.parse_rate("1M")
+    assert bandwidth.lowest_limit(bandwidth.BandwidthSchedule(None)) is None
+
+
+def make_throttle(tmpdir, key, limit=None, global_limit=None):
+    return bandwidth.SharedThrottle(
+        key,
+        bandwidth.BandwidthSchedule(limit),
+        bandwidth.BandwidthSchedule(global_limit),
+        tmpdir / "bandwidth.json",
+    )
+
+
+def test_shared_throttle_per_config(tmpdir):
+    # Transfers with the same config share its limit
+    first = make_throttle(tmpdir, "a.conf", limit="1M")
+    second = make_throttle(tmpdir, "a.conf", limit="1M")
+    other = make_throttle(tmpdir, "b.conf", limit="1M")
+    # The first second's worth can be sent straight away
+    assert first.reserve(1024**2) == 0
+    assert second.reserve(1024**2) == pytest.approx(1, abs=0.1)
+    assert other.reserve(1024**2) == 0
+
+
+def test_shared_throttle_global(tmpdir):
+    # The lowest global limit of any running transfer applies to all
+    first = make_throttle(tmpdir, "a.conf", global_limit="1M")
+    first.reserve(0)
+    second = make_throttle(tmpdir, "b.conf", global_limit="10M")
+    second.client = "another process"
+    assert second.reserve(2 * 1024**2) == pytest.approx(1, abs=0.1)
+
+
+def test_copy_throttled_unlimited(tmpdir):
+    # While there is no limit, the coordination files aren't used
+    throttle = make_throttle(tmpdir, "a.conf", limit="0", global_limit="0")
+    destination = io.BytesIO()
+    data = b"x" * (3 * bandwidth.CHUNK_SIZE)
+    assert bandwidth.copy_throttled(io.BytesIO(data), destination, throttle)
+    assert destination.getvalue() == data
+    assert tmpdir.listdir() == []
+
+
+def test_copy_throttled_quanta(tmpdir, monkeypatch):
+    # A second's worth is taken from the buckets at once
+    throttle = make_throttle(tmpdir, "a.conf", limit="1G")
+    reserved = []
+    monkeypatch.setattr(throttle, "reserve", lambda n: reserved.append(n))
+    monkeypatch.setattr(bandwidth.time, "sleep", lambda seconds: None)
+    data = b"x" * (3 * bandwidth.CHUNK_SIZE)
+    bandwidth.copy_throttled(io.BytesIO(data), io.BytesIO(), throttle)
+    assert reserved == [1024**3]
+
+
+def test_throttle_command_default_coordination_file():
+    cmd = throttle.throttle_command("a.conf", "1M", None, None)
+    assert "--coordination-file" not in cmd
+    args = throttle.parser().parse_args(cmd[3:])
+    assert args.coordination_file is None
+    assert args.limit == "1M"
@@ -0,0 +1,36 @@
+from synchro.utils import compression
+from synchro.utils.scan import FileEntry
+
+
+def test_compress_program():
+    codec = compression.get_codec("zstd")
+    assert codec.compress_program() == "zstd -T0 -3"
+    assert codec.compress_program(100) == "zstd -T0 -19"
+    assert compression.get_codec("none") is None
+
+
+def test_compress_program_rsyncable():
+    zstd = compression.get_codec("zstd")
+    assert zstd.compress_program(rsyncable=True) == "zstd -T0 -3 --rsyncable"
+    # Not supported by lz4
+    lz4 = compression.get_codec("lz4")
+    assert lz4.compress_program(rsyncable=True) == "lz4 -1"
+
+
+def test_incompressible_fraction():
+    entries = [
+        FileEntry("sample.bam", 75, 0, 0, False),
+        FileEntry("sample.vcf", 25, 0, 0, False),
+        FileEntry("dir.bam", 0, 0, 0, True),
+    ]
+    fraction = compression.incompressible_fraction(entries, (".bam",))
+    assert fraction == 0.75
+    assert compression.incompressible_fraction([], (".bam",)) == 0
+
+
+def test_parse_extensions():
+    assert compression.parse_extensions("bam, .cram,fastq.gz,") == (
+        ".bam",
+        ".cram",
+        ".fastq.gz",
+    )
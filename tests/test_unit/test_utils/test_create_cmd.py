@@ -1,6 +1,20 @@
+import os
+import pytest
+import subprocess
+from pathlib import Path
 from synchro.utils import create_cmd
 
 
+def is_gnu_tar():
+    try:
+        version = subprocess.run(
+            ["tar", "--version"], capture_output=True, text=True
+        ).stdout
+    except OSError:
+        return False
+    return "GNU tar" in version
+
+
 def test_add_ssh_prefix():
     cmd = ["mkdir test"]
     remote_host = "8.8.8.8"
@@ -9,3 +23,85 @@ def test_add_ssh_prefix():
         remote_host,
         cmd[0],
     ]
+
+
+def test_add_ssh_prefix_control_path():
+    cmd = ["mkdir test"]
+    remote_host = "8.8.8.8"
+    assert create_cmd.add_ssh_prefix(cmd, remote_host, "/tmp/socket") == [
+        "ssh",
+        "-o",
+        "ControlPath=/tmp/socket",
+        remote_host,
+        cmd[0],
+    ]
+
+
+def test_batch_remote_steps():
+    steps = [("untar", ["tar", "-xf", "a b.tar"]), ("chmod", ["chmod", "770"])]
+    cmd = create_cmd.batch_remote_steps(steps, "8.8.8.8")
+    assert cmd[:2] == ["ssh", "8.8.8.8"]
+    assert len(cmd) == 3
+    assert "tar -xf 'a b.tar' 2>&1" in cmd[2]
+    assert cmd[2].index("untar start") < cmd[2].index("chmod start")
+
+
+def test_change_ownership_permission_not_recursive():
+    chown, chmod = create_cmd.change_ownership_permission(
+        False,
+        False,
+        False,
+        "user",
+        "group",
+        "770",
+        "/dest.tar",
+        "/dest",
+        None,
+        recursive=False,
+    )
+    assert chown == ["chown", "user:group", "/dest"]
+    assert chmod == ["chmod", "770", "/dest"]
+
+
+def test_ownership_permission_flags():
+    assert create_cmd.rsync_ownership_permission_flags(
+        "user", "group", "750"
+    ) == ["--chown=user:group", "--chmod=D750,F750"]
+    assert create_cmd.tar_ownership_permission_flags(
+        "user", "group", "750"
+    ) == ["--owner=user", "--group=group", "--mode=750"]
+
+
+def test_quiet_tar_flags():
+    assert create_cmd.quiet_tar_flags(
+        ["-xvpf", "-v", "--overwrite", "--verbose"]
+    ) == ["-xpf", "--overwrite", "--verbose"]
+
+
+@pytest.mark.skipif(not is_gnu_tar(), reason="Requires GNU tar")
+def test_reproducible_tar_flags(tmpdir):
+    # The same files, listed in a different order by the filesystem, give
+    # the same archive
+    archives = []
+    for names in (["a", "b", "c"], ["c", "b", "a"]):
+        source = Path(tmpdir) / "_".join(names)
+        source.mkdir()
+        for name in names:
+            (source / name).write_text(name)
+            os.utime(source / name, (0, 1000000))
+        os.utime(source, (0, 1000000))
+        archive = Path(tmpdir) / f"{source.name}.tar"
+        subprocess.run(
+            [
+                "tar",
+                *create_cmd.reproducible_tar_flags(),
+                "-cf",
+                archive,
+                "-C",
+                source,
+                ".",
+            ],
+            check=True,
+        )
+        archives.append(archive.read_bytes())
+    assert archives[0] == archives[1]
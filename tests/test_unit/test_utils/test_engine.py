@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import pytest
+import asyncio
+import subprocess
+from synchro.utils import engine
+
+
+def test_parse_duration():
+    assert engine.parse_duration("90") == 90
+    assert engine.parse_duration("30m") == 30 * 60
+    assert engine.parse_duration(" 2h ") == 2 * 60 * 60
+    assert engine.parse_duration("1d") == 24 * 60 * 60
+    assert engine.parse_duration("none") is None
+    assert engine.parse_duration("0") is None
+
+
+def test_parse_stage_timeouts():
+    timeouts = engine.parse_stage_timeouts("tar=2h, rsync=12h, 6h")
+    assert timeouts == {
+        "tar": 2 * 60 * 60,
+        "rsync": 12 * 60 * 60,
+        None: 6 * 60 * 60,
+    }
+
+
+def test_line_splitter():
+    # rsync ends progress updates with "\r"
+    splitter = engine.LineSplitter()
+    assert splitter.feed(b"one\ntwo\r") == ["one"]
+    assert splitter.feed(b"\nthree\rfo") == ["two", "three"]
+    assert splitter.feed("ur é".encode()[:-1]) == []
+    assert splitter.flush() == ["four �"]
+
+
+def test_run_command():
+    lines = []
+    engine.get_engine().run(
+        engine.run_command(["printf", "a\\nb\\rc"], lines.append)
+    )
+    assert lines == ["a", "b", "c"]
+
+    with pytest.raises(subprocess.CalledProcessError):
+        engine.get_engine().run(engine.run_command(["false"]))
+
+
+def test_run_command_timeout(tmpdir):
+    # The whole process group is stopped, including the background sleep
+    marker = tmpdir / "marker"
+    cmd = ["sh", "-c", f"(sleep 2; touch {marker}) & sleep 10"]
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        engine.get_engine().run(engine.run_command(cmd, timeout=0.5))
+    assert time.monotonic() - start < 5
+    time.sleep(2.5)
+    assert not marker.exists()
+
+
+def test_run_command_process_group():
+    # Only commands with a timeout are detached from the terminal
+    cmd = [sys.executable, "-c", "import os; print(os.getpgrp())"]
+    for timeout, detached in [(None, False), (60, True)]:
+        lines = []
+        engine.get_engine().run(engine.run_command(cmd, lines.append, timeout))
+        assert (int(lines[0]) != os.getpgrp()) == detached
+
+
+def test_stage_deadline():
+    with engine.command_timeout(30), engine.stage_deadline(0.5):
+        timeout = engine.effective_timeout(60)
+        assert 0 < timeout <= 0.5
+        with pytest.raises(subprocess.TimeoutExpired):
+            engine.get_engine().run(
+                engine.run_command(["sleep", "10"], timeout=timeout)
+            )
+    assert engine.effective_timeout() is None
+
+
+def test_run_command_cancelled():
+    async def cancel_command():
+        task = asyncio.ensure_future(engine.run_command(["sleep", "10"]))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    start = time.monotonic()
+    asyncio.run(cancel_command())
+    assert time.monotonic() - start < 5
+
+
+def test_run_pipeline():
+    lines = []
+    cmds = [["printf", "b\\na\\n"], ["sort"]]
+    engine.get_engine().run(engine.run_pipeline(cmds, lines.append))
+    assert lines == ["a", "b"]
+
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        engine.get_engine().run(engine.run_pipeline([["true"], ["false"]]))
+    assert error.value.cmd == ["false"]
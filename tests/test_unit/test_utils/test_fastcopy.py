@@ -0,0 +1,120 @@
+import os
+import errno
+import subprocess
+import pytest
+from pathlib import Path
+from synchro.utils import fastcopy
+from synchro.utils.engine import stage_deadline
+from synchro.utils.fastcopy import FastCopy
+from synchro.utils.scan import FileEntry
+
+
+def create_source(directory):
+    source = Path(directory) / "source"
+    (source / "a" / "b").mkdir(parents=True)
+    (source / "empty.txt").touch()
+    (source / "a" / "data.bin").write_bytes(os.urandom(100000))
+    (source / "a" / "b" / "link").symlink_to("../data.bin")
+    (source / "a" / "data.bin").chmod(0o640)
+    os.utime(source / "a" / "data.bin", ns=(0, 1234567890123456789))
+    os.utime(source / "a", ns=(0, 1000000000000000000))
+    return source
+
+
+def test_copy_preserves_metadata(tmpdir):
+    # As rsync -a: contents, permissions, times (directories too) & symlinks
+    source = create_source(tmpdir)
+    destination = Path(tmpdir) / "destination"
+    copied = []
+    copy = FastCopy(source, destination, callback=copied.append)
+    copy.copy()
+
+    assert sorted(copied) == ["a/b/link", "a/data.bin", "empty.txt"]
+    data = destination / "a" / "data.bin"
+    assert data.read_bytes() == (source / "a" / "data.bin").read_bytes()
+    assert data.stat().st_mode & 0o777 == 0o640
+    assert data.stat().st_mtime_ns == 1234567890123456789
+    assert (destination / "a").stat().st_mtime_ns == 1000000000000000000
+    assert os.readlink(destination / "a" / "b" / "link") == "../data.bin"
+    assert copy.bytes_copied == 100000
+    assert copy.methods["empty"] == 1
+    assert copy.methods["symlink"] == 1
+    assert not list(destination.rglob(".*.synchro.*"))
+
+
+def test_copy_skips_unchanged(tmpdir):
+    source = create_source(tmpdir)
+    destination = Path(tmpdir) / "destination"
+    FastCopy(source, destination).copy()
+    (source / "empty.txt").write_text("changed")
+
+    copy = FastCopy(source, destination)
+    copy.copy()
+    assert copy.methods["unchanged"] == 2
+    assert copy.bytes_copied == len("changed")
+    assert (destination / "empty.txt").read_text() == "changed"
+
+
+def test_copy_entries(tmpdir):
+    # Only the given entries are copied, with the directories they are in
+    source = create_source(tmpdir)
+    destination = Path(tmpdir) / "destination"
+    FastCopy(source, destination).copy(
+        [FileEntry("a/data.bin", 100000, 0, 0, False)]
+    )
+    assert [p.name for p in destination.rglob("*")] == ["a", "data.bin"]
+    assert (destination / "a").stat().st_mtime_ns == 1000000000000000000
+
+
+def test_copy_hardlink(tmpdir):
+    source = create_source(tmpdir)
+    destination = Path(tmpdir) / "destination"
+    copy = FastCopy(source, destination, policy="hardlink")
+    copy.copy()
+    assert (destination / "a" / "data.bin").samefile(source / "a" / "data.bin")
+    assert copy.methods["hardlink"] == 2
+    assert copy.bytes_copied == 0
+
+
+def test_copy_falls_back(tmpdir, monkeypatch):
+    # If the fast paths aren't supported, the data is read & written (and
+    # the fast paths aren't tried again)
+    def unsupported(*args):
+        unsupported.calls += 1
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    unsupported.calls = 0
+    monkeypatch.setattr(fastcopy, "reflink", unsupported)
+    monkeypatch.setattr(fastcopy, "copy_file_range", unsupported)
+    source = create_source(tmpdir)
+    (source / "other.bin").write_bytes(b"x" * 10)
+    copy = FastCopy(source, Path(tmpdir) / "destination", threads=1)
+    copy.copy()
+    assert copy.methods["read_write"] == 2
+    assert unsupported.calls == 2
+    assert copy.unsupported == {"reflink", "copy_file_range"}
+
+
+def test_copy_error(tmpdir, monkeypatch):
+    # Other errors stop the copy, without leaving partial files
+    def no_space(*args):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(fastcopy, "reflink", no_space)
+    source = create_source(tmpdir)
+    destination = Path(tmpdir) / "destination"
+    with pytest.raises(OSError, match="No space"):
+        FastCopy(source, destination).copy()
+    assert not (destination / "a" / "data.bin").exists()
+    assert not list(destination.rglob(".*.synchro.*"))
+
+
+def test_copy_deadline(tmpdir):
+    source = create_source(tmpdir)
+    with stage_deadline(-1), pytest.raises(subprocess.TimeoutExpired):
+        FastCopy(source, Path(tmpdir) / "destination").copy()
+
+
+def test_unknown_policy(tmpdir):
+    with pytest.raises(ValueError):
+        FastCopy(tmpdir, tmpdir, policy="rsync")
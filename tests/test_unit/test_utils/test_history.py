@@ -0,0 +1,66 @@
+from synchro.utils.history import (
+    MAX_RUNS,
+    estimate_throughput,
+    failure_rates,
+    record_run,
+    slowest_stages,
+    throughput_by_host,
+)
+
+
+def add_run(history_file, host="host", status="success", started=0.0, **run):
+    run = {
+        "started": started,
+        "finished": started + run.pop("seconds", 1.0),
+        "host": host,
+        "status": status,
+        **run,
+    }
+    return record_run(run, run.pop("stages", {}), history_file)
+
+
+def test_estimate_throughput(tmp_path):
+    history_file = tmp_path / "history.db"
+    assert estimate_throughput("host", history_file) is None
+
+    add_run(history_file, bytes=1000)
+    add_run(history_file, bytes=3000)
+    add_run(history_file, host="other", bytes=10, seconds=10.0)
+    # Failed and resumed runs are ignored
+    add_run(history_file, bytes=1, status="failed")
+    add_run(history_file, bytes=1, resumed=True)
+    assert estimate_throughput("host", history_file) == 2000
+    assert estimate_throughput("other", history_file) == 1
+
+
+def test_estimate_throughput_recent_runs(tmp_path):
+    history_file = tmp_path / "history.db"
+    add_run(history_file, bytes=10**9)
+    for i in range(MAX_RUNS):
+        add_run(history_file, bytes=100, started=float(i + 1))
+    assert estimate_throughput("host", history_file) == 100
+
+
+def test_report_queries(tmp_path):
+    history_file = tmp_path / "history.db"
+    add_run(history_file, bytes=100, stages={"tar": 5.0, "rsync": 20.0})
+    add_run(history_file, bytes=300, stages={"rsync": 1.0})
+    add_run(history_file, status="failed", stages={"rsync": None})
+    add_run(history_file, host="other", bytes=5)
+
+    rows = throughput_by_host(history_file, "month")
+    assert [(row["host"], row["runs"]) for row in rows] == [
+        ("host", 2),
+        ("other", 1),
+    ]
+    assert rows[0]["throughput"] == 200
+
+    rows = slowest_stages(history_file, limit=2)
+    assert [(row["stage"], row["seconds"]) for row in rows] == [
+        ("rsync", 20.0),
+        ("tar", 5.0),
+    ]
+
+    rows = failure_rates(history_file, host="host")
+    assert len(rows) == 1
+    assert (rows[0]["runs"], rows[0]["failures"]) == (3, 1)
@@ -0,0 +1,36 @@
+from synchro.utils import journal
+from synchro.utils.scan import FileEntry
+
+
+def test_source_fingerprint():
+    entries = [FileEntry("a", 1, 1, 1, False), FileEntry("b", 1, 1, 2, False)]
+    fingerprint = journal.source_fingerprint(entries, "source = /data")
+    assert fingerprint == journal.source_fingerprint(
+        entries[::-1], "source = /data"
+    )
+    assert fingerprint != journal.source_fingerprint(
+        entries, "source = /other"
+    )
+    modified = [entries[0], FileEntry("b", 1, 2, 2, False)]
+    assert fingerprint != journal.source_fingerprint(
+        modified, "source = /data"
+    )
+
+
+def test_save_load_journal(tmpdir):
+    journal_file = tmpdir / "synchro.journal"
+    saved = journal.Journal(journal_file, "abc")
+    saved.start("tar")
+    saved.complete("tar")
+    saved.start("rsync")
+
+    loaded = journal.Journal.load(journal_file, "abc")
+    assert loaded.is_completed("tar")
+    assert loaded.is_started("rsync")
+    assert not loaded.is_completed("rsync")
+
+    # Source changed since the checkpoint
+    assert journal.Journal.load(journal_file, "def") is None
+
+    loaded.remove()
+    assert journal.Journal.load(journal_file, "abc") is None
@@ -1,7 +1,11 @@
 import logging
 from datetime import datetime
 from synchro.utils.logging import (
+    OUTPUT_LOGGER,
     initalise_logger,
+    initalise_queue_logger,
+    log_formatter,
+    stop_queue_logger,
     write_log_header,
     write_log_footer,
 )
@@ -17,6 +21,50 @@ def test_initalise_logger(tmpdir):
     assert lines[0] == "TEST LOGGING\n"
 
 
+def test_log_formatter_prefix():
+    record = logging.makeLogRecord({"msg": "TEST LOGGING"})
+    formatter = log_formatter("runs:run_1 100%")
+    assert formatter.format(record) == "[runs:run_1 100%] TEST LOGGING"
+    assert log_formatter().format(record) == "TEST LOGGING"
+
+
+def test_queue_logger_summarises_output(tmpdir):
+    log_file = tmpdir / "log.log"
+    listener = initalise_queue_logger(log_file, summary_interval=3600)
+    output_logger = logging.getLogger(OUTPUT_LOGGER)
+    logging.info("TEST LOGGING")
+    for i in range(100):
+        output_logger.debug(f"./file_{i}.txt")
+    output_logger.debug("tar: ./missing.txt: Cannot open")
+    logging.error("Command failed")
+    stop_queue_logger(listener)
+
+    with open(log_file) as f:
+        lines = f.readlines()
+    assert lines[0] == "TEST LOGGING\n"
+    assert lines[1] == "tar: ./missing.txt: Cannot open\n"
+    # The most recent lines are logged in full before an error
+    assert lines[2:22] == [f"./file_{i}.txt\n" for i in range(80, 100)]
+    assert lines[22] == "Command failed\n"
+    assert lines[23] == "100 lines of output (last: ./file_99.txt)\n"
+
+
+def test_queue_logger_max_log_size(tmpdir):
+    log_file = tmpdir / "log.log"
+    listener = initalise_queue_logger(log_file, max_log_size=10)
+    logging.debug("0123456789")
+    logging.debug("Not logged")
+    logging.warning("Still logged")
+    stop_queue_logger(listener)
+
+    with open(log_file) as f:
+        lines = f.readlines()
+    assert lines[0] == "0123456789\n"
+    assert lines[1].startswith("Log file reached 10 bytes")
+    assert lines[2] == "Still logged\n"
+    assert len(lines) == 3
+
+
 def test_write_log_header(tmpdir):
     log_file = tmpdir / "log.log"
     setup_simple_log(log_file)
@@ -51,3 +99,25 @@ def test_write_log_footer(tmpdir):
     with open(log_file) as f:
         lines = f.readlines()
     assert lines[0] == "Transfer ended\n"
+
+
+def test_queue_logger_started_later(tmpdir):
+    log_file = tmpdir / "log.log"
+    listener = initalise_queue_logger(log_file, start=False)
+    logging.info("TEST LOGGING")
+    assert listener._thread is None
+    listener.start()
+    stop_queue_logger(listener)
+
+    with open(log_file) as f:
+        assert f.readlines() == ["TEST LOGGING\n"]
+
+
+def test_queue_logger_prefix(tmpdir):
+    log_file = tmpdir / "log.log"
+    listener = initalise_queue_logger(log_file, prefix="runs:run_1 100%")
+    logging.info("TEST LOGGING")
+    stop_queue_logger(listener)
+
+    with open(log_file) as f:
+        assert f.readlines() == ["[runs:run_1 100%] TEST LOGGING\n"]
@@ -0,0 +1,31 @@
+from synchro.utils import manifest
+from synchro.utils.scan import FileEntry
+
+
+def test_save_load_manifest(tmpdir):
+    entries = [
+        FileEntry("dir", 0, 10, 1, True),
+        FileEntry("dir/file\twith tab.txt", 5, 20, 2, False),
+    ]
+    manifest_file = tmpdir / "synchro.manifest"
+    manifest.save_manifest(entries, manifest_file)
+    loaded = manifest.load_manifest(manifest_file)
+    assert list(loaded.values()) == entries
+
+
+def test_load_missing_manifest(tmpdir):
+    assert manifest.load_manifest(tmpdir / "synchro.manifest") is None
+
+
+def test_changed_entries():
+    previous = {
+        "same": FileEntry("same", 1, 1, 1, False),
+        "modified": FileEntry("modified", 1, 1, 2, False),
+    }
+    current = [
+        FileEntry("same", 1, 1, 1, False),
+        FileEntry("modified", 1, 2, 2, False),
+        FileEntry("new", 1, 1, 3, False),
+    ]
+    changed = manifest.changed_entries(previous, current)
+    assert [entry.path for entry in changed] == ["modified", "new"]
@@ -0,0 +1,78 @@
+import json
+
+from synchro.utils import metrics
+
+
+def create_metrics(tmpdir=None, cumulative_progress=False):
+    json_file = None if tmpdir is None else tmpdir / "metrics.json"
+    prometheus_file = None if tmpdir is None else tmpdir / "synchro.prom"
+    return metrics.TransferMetrics(
+        {"source": "/data/source"},
+        json_file=json_file,
+        prometheus_file=prometheus_file,
+        cumulative_progress=cumulative_progress,
+    )
+
+
+def test_rsync_per_file_progress():
+    transfer = create_metrics()
+    with transfer.stage("rsync"):
+        transfer.observe("file1.txt")
+        transfer.observe("     32,768  50%   16.00MB/s    0:00:00")
+        assert transfer.bytes_transferred == 32768
+        transfer.observe(
+            "     65,536 100%   32.00MB/s    0:00:00 (xfr#1, to-chk=1/3)"
+        )
+        transfer.observe("file2.txt")
+        transfer.observe(
+            "      1,024 100%    1.00kB/s    0:00:00 (xfr#2, to-chk=0/3)"
+        )
+    assert transfer.bytes_transferred == 65536 + 1024
+    assert transfer.rate == 1024
+    assert transfer.files_to_check == 0
+    assert transfer.files == 2
+
+
+def test_rsync_cumulative_progress():
+    transfer = create_metrics(cumulative_progress=True)
+    for stream in ("0", "1"):
+        transfer.observe(
+            "  1,048,576  10%    2.00MB/s    0:01:05 (xfr#3, ir-chk=10/20)",
+            stream=stream,
+        )
+    assert transfer.bytes_transferred == 2 * 1048576
+    assert transfer.files == 6
+    assert transfer.eta == 65
+
+
+def test_tar_files_counted_once():
+    transfer = create_metrics()
+    for stage in ("tar", "untar"):
+        with transfer.stage(stage):
+            for line in ("./", "./file1.txt", "./file2.txt"):
+                transfer.observe(line)
+    assert transfer.files == 3
+    assert transfer.stages["tar"]["duration"] >= 0
+
+
+def test_write_metrics(tmpdir):
+    transfer = create_metrics(tmpdir)
+    with transfer.stage("stream"):
+        transfer.add_bytes(100)
+    transfer.finish("success")
+
+    with open(tmpdir / "metrics.json") as f:
+        written = json.load(f)
+    assert written["source"] == "/data/source"
+    assert written["bytes_transferred"] == 100
+    assert written["status"] == "success"
+    assert list(written["stages"]) == ["stream"]
+
+    prometheus = (tmpdir / "synchro.prom").read()
+    assert 'synchro_success{source="/data/source"} 1' in prometheus
+    assert 'stage="stream"' in prometheus
+    assert prometheus.count("# TYPE synchro_bytes_transferred") == 1
+
+
+def test_parse_duration():
+    assert metrics.parse_duration("1:02:03") == 3723
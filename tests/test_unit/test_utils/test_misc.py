@@ -1,5 +1,8 @@
+import pytest
+import subprocess
 from pathlib import Path
 from synchro.utils import misc
+from synchro.utils.create_cmd import batch_remote_steps
 from ...utils.utils import create_conf_file, setup_simple_log
 
 
@@ -31,6 +34,63 @@ def test_execute_and_log(tmpdir):
     assert lines[0] == "test\n"
 
 
+def test_execute_concurrently_and_log(tmpdir):
+    log_file = tmpdir / "log.log"
+    setup_simple_log(log_file)
+
+    cmds = [["echo", "first"], ["echo", "second"]]
+    misc.execute_concurrently_and_log(cmds, prefixes=["[1] ", "[2] "])
+    with open(log_file) as f:
+        lines = sorted(f.readlines())
+    assert lines == ["[1] first\n", "[2] second\n"]
+
+
+def test_execute_concurrently_raises_on_failure():
+    with pytest.raises(subprocess.CalledProcessError):
+        misc.execute_concurrently_and_log([["true"], ["false"]])
+
+
+def test_execute_pipeline_and_log(tmpdir):
+    log_file = tmpdir / "log.log"
+    setup_simple_log(log_file)
+
+    cmds = [["echo", "pipeline test"], ["tr", "a-z", "A-Z"]]
+    misc.execute_pipeline_and_log(cmds)
+    with open(log_file) as f:
+        lines = f.readlines()
+    assert lines[0] == "PIPELINE TEST\n"
+
+
+def test_execute_pipeline_raises_on_failed_stage():
+    cmds = [["echo", "pipeline test"], ["false"]]
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        misc.execute_pipeline_and_log(cmds)
+    assert error.value.cmd == ["false"]
+
+
+def test_execute_remote_steps_and_log(tmpdir):
+    log_file = tmpdir / "log.log"
+    setup_simple_log(log_file)
+
+    steps = [("first", ["echo", "one"]), ("second", ["echo", "two"])]
+    # Run the batched script with a local shell, rather than ssh
+    cmd = ["sh", "-c", batch_remote_steps(steps, "host")[-1]]
+    misc.execute_remote_steps_and_log(cmd, steps)
+    with open(log_file) as f:
+        lines = f.readlines()
+    assert "[first] one\n" in lines
+    assert "[second] two\n" in lines
+    assert "Remote step: second exited with status: 0\n" in lines
+
+
+def test_execute_remote_steps_raises_for_failed_step():
+    steps = [("first", ["false"]), ("second", ["echo", "two"])]
+    cmd = ["sh", "-c", batch_remote_steps(steps, "host")[-1]]
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        misc.execute_remote_steps_and_log(cmd, steps)
+    assert error.value.cmd == ["false"]
+
+
 def test_split_pathlib():
     path = Path("user@remote:/path/to/dir")
     components = misc.split_pathlib(path)
@@ -0,0 +1,32 @@
+from synchro.utils.scan import scan_directory, scan_directory_parallel
+
+
+def test_scan_directory(tmpdir):
+    (tmpdir / "a.txt").write_text("aaa", "utf-8")
+    (tmpdir / "sub").mkdir()
+    (tmpdir / "sub" / "b.txt").write_text("bb", "utf-8")
+    (tmpdir / "skip.log").write_text("", "utf-8")
+
+    entries = {
+        entry.path: entry
+        for entry in scan_directory(tmpdir, exclude=("skip.log",))
+    }
+    assert sorted(entries) == ["a.txt", "sub", "sub/b.txt"]
+    assert entries["a.txt"].size == 3
+    assert entries["sub/b.txt"].size == 2
+    assert entries["sub"].is_dir
+    assert entries["sub"].size == 0
+
+
+def test_scan_directory_parallel(tmpdir):
+    for i in range(3):
+        (tmpdir / f"dir{i}").mkdir()
+        (tmpdir / f"dir{i}" / "nested").mkdir()
+        (tmpdir / f"dir{i}" / "nested" / "file.txt").write_text("x", "utf-8")
+    (tmpdir / "skip.log").write_text("", "utf-8")
+
+    serial = sorted(scan_directory(tmpdir, exclude=("skip.log",)))
+    parallel = scan_directory_parallel(
+        tmpdir, exclude=("skip.log",), threads=4
+    )
+    assert parallel == serial
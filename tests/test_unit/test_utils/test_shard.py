@@ -0,0 +1,32 @@
+from synchro.utils.scan import FileEntry
+from synchro.utils.shard import balance_shards, write_file_list
+
+
+def make_entry(path, size, is_dir=False):
+    return FileEntry(path, size, 0, 0, is_dir)
+
+
+def test_balance_shards():
+    entries = [
+        make_entry("dir", 0, is_dir=True),
+        make_entry("a", 100),
+        make_entry("b", 60),
+        make_entry("c", 50),
+        make_entry("d", 30),
+        make_entry("e", 20),
+    ]
+    shards = balance_shards(entries, 2)
+    totals = [sum(entry.size for entry in shard) for shard in shards]
+    assert sorted(totals) == [130, 130]
+    assert all(not entry.is_dir for shard in shards for entry in shard)
+
+
+def test_balance_shards_more_shards_than_files():
+    shards = balance_shards([make_entry("a", 10)], 3)
+    assert [len(shard) for shard in shards] == [1, 0, 0]
+
+
+def test_write_file_list(tmpdir):
+    entries = [make_entry("a", 1), make_entry("sub/b", 1)]
+    file_list = write_file_list(entries, tmpdir / "list")
+    assert file_list.read_bytes() == b"a\0sub/b\0"
@@ -0,0 +1,54 @@
+import shutil
+import subprocess
+from pathlib import Path
+from synchro.utils import space
+from synchro.utils.scan import FileEntry
+
+
+def test_tar_archive_size(tmpdir):
+    # Matches the size of an archive written by tar
+    source = Path(tmpdir) / "source"
+    (source / "directory").mkdir(parents=True)
+    (source / "empty.txt").touch()
+    (source / "directory" / "data.bin").write_bytes(b"x" * 12345)
+    entries = [
+        FileEntry(".", 0, 0, 0, True),
+        FileEntry("directory", 0, 0, 0, True),
+        FileEntry("empty.txt", 0, 0, 0, False),
+        FileEntry("directory/data.bin", 12345, 0, 0, False),
+    ]
+    archive = Path(tmpdir) / "source.tar"
+    subprocess.run(["tar", "-cf", archive, "-C", source, "."], check=True)
+    assert space.tar_archive_size(entries) == archive.stat().st_size
+
+
+def test_existing_parent(tmpdir):
+    tmpdir = Path(tmpdir)
+    assert space.existing_parent(tmpdir / "a" / "b") == tmpdir
+    assert space.existing_parent(tmpdir) == tmpdir
+
+
+def test_local_free_space(tmpdir):
+    # A missing directory is on the filesystem of its closest parent
+    free = space.local_free_space(Path(tmpdir) / "missing")
+    assert abs(free - shutil.disk_usage(tmpdir).free) < 1024**3
+    assert space.same_filesystem(tmpdir, Path(tmpdir) / "missing")
+
+
+def test_remote_free_space_script(tmpdir):
+    # The script runs locally too
+    script = space.remote_free_space_script(Path(tmpdir) / "a b" / "c")
+    output = subprocess.run(
+        ["sh", "-c", script], capture_output=True, text=True, check=True
+    ).stdout
+    free = space.parse_df_output(output.splitlines())
+    # Free space changes, so only check it is close
+    assert abs(free - space.local_free_space(tmpdir)) < 1024**3
+
+
+def test_parse_df_output():
+    lines = [
+        "Filesystem     1024-blocks      Used Available Capacity Mounted on",
+        "/dev/sda1        102400000  51200000  51200000      50% /data",
+    ]
+    assert space.parse_df_output(lines) == 51200000 * 1024
@@ -0,0 +1,34 @@
+from synchro.utils import ssh
+
+
+def test_get_control_path(tmpdir):
+    control_path = ssh.get_control_path("user@remote", tmpdir)
+    assert control_path.parent == tmpdir
+    assert control_path == ssh.get_control_path("user@remote", tmpdir)
+    assert control_path != ssh.get_control_path("user@other", tmpdir)
+
+
+def test_rsync_ssh_options():
+    assert ssh.rsync_ssh_options(None) == []
+    assert ssh.rsync_ssh_options("/tmp/socket") == [
+        "--rsh=ssh -o ControlPath=/tmp/socket"
+    ]
+
+
+def test_stop_does_not_close_shared_connection(tmpdir):
+    # A connection opened elsewhere must be left running
+    ssh_master = ssh.SSHMaster("user@remote", tmpdir)
+    ssh_master.stop()
+    assert not ssh_master.owner
+
+
+def test_control_path_per_process(tmpdir, monkeypatch):
+    # Each process closes only its own connection
+    control_path = ssh.get_control_path("user@remote", tmpdir)
+    monkeypatch.setattr(ssh.os, "getpid", lambda: 1)
+    assert control_path != ssh.get_control_path("user@remote", tmpdir)
+
+
+def test_shared_control_path(tmpdir):
+    ssh_master = ssh.SSHMaster("user@remote", control_path=tmpdir / "socket")
+    assert ssh_master.control_path == tmpdir / "socket"
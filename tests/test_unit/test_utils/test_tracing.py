@@ -0,0 +1,72 @@
+import json
+import pstats
+import pytest
+import subprocess
+from synchro.utils import misc
+from synchro.utils.create_cmd import batch_remote_steps
+from synchro.utils.tracing import Tracer, profile
+
+
+def test_span_hooks():
+    events = []
+    tracer = Tracer()
+    tracer.add_hook(lambda event, span: events.append((event, span.name)))
+    with tracer.span("outer", source="/data"):
+        with tracer.span("inner") as span:
+            span.attributes["files"] = 3
+    assert events == [
+        ("start", "outer"),
+        ("start", "inner"),
+        ("end", "inner"),
+        ("end", "outer"),
+    ]
+    outer, inner = tracer.spans
+    assert outer.attributes == {"source": "/data"}
+    assert inner.attributes == {"files": 3}
+    assert outer.start <= inner.start <= inner.end <= outer.end
+
+
+def test_span_error():
+    # Failed commands record their exit code
+    tracer = Tracer()
+    with pytest.raises(subprocess.CalledProcessError):
+        with tracer.span("rsync"):
+            raise subprocess.CalledProcessError(23, ["rsync"])
+    assert tracer.spans[0].attributes["exit_code"] == 23
+    assert tracer.spans[0].duration is not None
+
+
+def test_commands_recorded(tmpdir):
+    # Commands run within a span are recorded as child spans
+    tracer = Tracer(tmpdir / "trace.json")
+    with tracer.span("stage"):
+        misc.execute_and_log(["echo", "test"])
+        with pytest.raises(subprocess.CalledProcessError):
+            misc.execute_pipeline_and_log([["echo", "test"], ["false"]])
+        steps = [("first", ["true"]), ("second", ["false"])]
+        cmd = ["sh", "-c", batch_remote_steps(steps, "host")[-1]]
+        with pytest.raises(subprocess.CalledProcessError):
+            misc.execute_remote_steps_and_log(cmd, steps)
+
+    spans = {span.name: span for span in tracer.spans}
+    assert spans["echo"].category == "command"
+    assert spans["echo"].attributes["command"] == "echo test"
+    assert spans["echo"].attributes["exit_code"] == 0
+    assert spans["pipeline"].attributes["exit_codes"] == [0, 1]
+    assert spans["first"].attributes["exit_code"] == 0
+    assert spans["second"].attributes["exit_code"] == 1
+
+    tracer.write()
+    trace = json.loads((tmpdir / "trace.json").read_text("utf-8"))
+    phases = {(e["name"], e["ph"]) for e in trace["traceEvents"]}
+    assert ("stage", "X") in phases
+    assert ("echo", "b") in phases
+    assert ("echo", "e") in phases
+
+
+def test_profile(tmpdir):
+    profile_file = tmpdir / "synchro.prof"
+    with profile(profile_file):
+        sorted(range(1000))
+    stats = pstats.Stats(str(profile_file))
+    assert stats.total_calls > 0
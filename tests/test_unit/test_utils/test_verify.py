@@ -0,0 +1,61 @@
+import hashlib
+from synchro.utils import verify
+
+
+def test_hash_files(tmpdir):
+    (tmpdir / "a.txt").write_text("aaa", "utf-8")
+    (tmpdir / "b.txt").write_text("bbb", "utf-8")
+    checksums = verify.hash_files(tmpdir, ["a.txt", "b.txt"], "md5")
+    assert checksums["a.txt"] == hashlib.md5(b"aaa").hexdigest()
+    assert checksums["b.txt"] == hashlib.md5(b"bbb").hexdigest()
+
+
+def test_hash_file_small_buffer(tmpdir):
+    data = b"0123456789" * 100
+    (tmpdir / "a").write_binary(data)
+    digest = verify.hash_file(tmpdir / "a", buffer_size=7)
+    assert digest == hashlib.sha256(data).hexdigest()
+
+
+def test_checksum_line_round_trip():
+    for path in ["dir/file.txt", "back\\slash", "new\nline"]:
+        line = verify.format_checksum_line(path, "abc")
+        assert verify.parse_checksum_line(line) == (path, "abc")
+    assert verify.parse_checksum_line("abc  ./dir/file\n") == (
+        "dir/file",
+        "abc",
+    )
+
+
+def test_compare_checksums():
+    source = {"same": "1", "different": "2", "missing": "3"}
+    destination = {"same": "1", "different": "4", "extra": "5"}
+    problems = verify.compare_checksums(source, destination)
+    assert problems == [
+        "different: checksum mismatch (source: 2, destination: 4)",
+        "missing: missing or unreadable at destination",
+    ]
+
+
+def test_hash_files_with_command(tmpdir):
+    (tmpdir / "a.txt").write_text("aaa", "utf-8")
+    (tmpdir / "-b.txt").write_text("bbb", "utf-8")
+    (tmpdir / "not hashed").write_text("ccc", "utf-8")
+    cmd = ["sh", "-c", *verify.remote_hash_command(tmpdir, "md5")]
+    # A file that can't be hashed is left out, rather than failing
+    checksums = verify.hash_files_with_command(
+        cmd, ["a.txt", "-b.txt", "missing"]
+    )
+    assert checksums == {
+        "a.txt": hashlib.md5(b"aaa").hexdigest(),
+        "-b.txt": hashlib.md5(b"bbb").hexdigest(),
+    }
+    assert verify.hash_files_with_command(cmd, []) == {}
+
+
+def test_remote_hash_command_quoting(tmpdir):
+    directory = tmpdir.mkdir("it's here")
+    (directory / "a.txt").write_text("aaa", "utf-8")
+    cmd = ["sh", "-c", *verify.remote_hash_command(directory, "md5")]
+    checksums = verify.hash_files_with_command(cmd, ["a.txt"])
+    assert checksums == {"a.txt": hashlib.md5(b"aaa").hexdigest()}
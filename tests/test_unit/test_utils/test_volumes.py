@@ -0,0 +1,73 @@
+import io
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from synchro.utils.volumes import (
+    done_marker,
+    end_marker,
+    extract_volumes_script,
+    remove_volumes,
+    split_into_volumes,
+    transfer_volumes,
+    volume_name,
+)
+
+
+def test_split_into_volumes(tmp_path):
+    archive = tmp_path / "source.tar"
+    volumes = []
+    n_volumes = split_into_volumes(
+        io.BytesIO(b"x" * 25), archive, 10, lambda *v: volumes.append(v)
+    )
+    assert n_volumes == 3
+    assert volumes == [(volume_name(archive, i), i) for i in range(3)]
+    sizes = [path.stat().st_size for path, _ in volumes]
+    assert sizes == [10, 10, 5]
+
+    remove_volumes(archive)
+    assert not list(tmp_path.iterdir())
+
+
+def test_split_into_volumes_exact(tmp_path):
+    # No empty volume at the end
+    archive = tmp_path / "source.tar"
+    n_volumes = split_into_volumes(
+        io.BytesIO(b"x" * 20), archive, 10, lambda *v: None
+    )
+    assert n_volumes == 2
+    assert not volume_name(archive, 2).exists()
+
+
+def test_transfer_and_extract_volumes(tmp_path):
+    # Volumes are extracted at the destination as they are sent
+    source = tmp_path / "source"
+    (source / "sub").mkdir(parents=True)
+    for i in range(20):
+        (source / "sub" / f"{i}.bin").write_bytes(bytes([i]) * 5000)
+    destination = tmp_path / "dest"
+    destination.mkdir()
+    archive = tmp_path / "source.tar"
+    dest_archive = destination / archive.name
+
+    def send(volume, index):
+        shutil.copy(volume, destination)
+        Path(done_marker(volume_name(dest_archive, index))).touch()
+        volume.unlink()
+
+    script = extract_volumes_script(
+        dest_archive, ["tar", "-xpf", "-", "-C", str(destination)], 0.1
+    )
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        extraction = executor.submit(subprocess.run, ["sh", "-c", script])
+        n_volumes = transfer_volumes(
+            ["tar", "-cf", "-", "-C", str(source), "."], archive, 20000, send
+        )
+        Path(end_marker(dest_archive)).touch()
+        assert extraction.result().returncode == 0
+
+    assert n_volumes > 1
+    assert sorted(p.name for p in destination.iterdir()) == ["sub"]
+    assert (destination / "sub" / "7.bin").read_bytes() == b"\x07" * 5000
+    assert not list(tmp_path.glob("source.tar*"))
@@ -0,0 +1,114 @@
+import os
+from types import SimpleNamespace
+
+from synchro import watch
+from ..utils.utils import create_conf_file
+
+
+def make_config(tmpdir, extra_options=None):
+    source_dir = tmpdir / "source"
+    source_dir.mkdir()
+    config_file = create_conf_file(
+        source_dir,
+        tmpdir / "dest",
+        ready_file="ready.txt",
+        extra_options=extra_options,
+    )
+    return source_dir, watch.WatchedConfig(config_file)
+
+
+def test_ready_file(tmpdir):
+    source_dir, config = make_config(tmpdir)
+    assert not config.is_ready()
+    (source_dir / "ready.txt").write_text("", "utf-8")
+    assert config.is_ready()
+
+    # Not restarted unless something changes
+    config.started()
+    assert not config.is_ready()
+
+    (source_dir / "transfer.done").write_text("", "utf-8")
+    assert not config.is_ready()
+
+
+def test_retry_failure(tmpdir, monkeypatch):
+    source_dir, config = make_config(tmpdir)
+    (source_dir / "ready.txt").write_text("", "utf-8")
+    config.started()
+    config.last_failure = 0
+    monkeypatch.setattr(watch.time, "monotonic", lambda: 1)
+    assert not config.is_ready()
+    monkeypatch.setattr(
+        watch.time, "monotonic", lambda: watch.RETRY_INTERVAL + 1
+    )
+    assert config.is_ready()
+
+
+def test_incremental_ready_file_touched(tmpdir):
+    source_dir, config = make_config(tmpdir, {"incremental": "y"})
+    (source_dir / "ready.txt").write_text("", "utf-8")
+    (source_dir / "transfer.done").write_text("", "utf-8")
+    os.utime(source_dir / "ready.txt", ns=(0, 0))
+    assert not config.is_ready()
+
+    # Touching the ready file starts another incremental transfer
+    os.utime(source_dir / "ready.txt")
+    assert config.is_ready()
+
+
+def test_config_reloaded(tmpdir):
+    source_dir, config = make_config(tmpdir)
+    (source_dir / "go.txt").write_text("", "utf-8")
+    assert not config.is_ready()
+    create_conf_file(source_dir, tmpdir / "dest", ready_file="go.txt")
+    os.utime(config.config_file, ns=(0, 0))
+    config.load()
+    assert config.is_ready()
+
+
+def test_watcher_source_pattern(tmpdir):
+    runs_dir = tmpdir / "runs"
+    runs_dir.mkdir()
+    (runs_dir / "run_1").mkdir()
+    config_file = tmpdir / "runs.conf"
+    config_file.write_text(
+        f"source = {runs_dir}/*\ndestination = {tmpdir}/dest\n", "utf-8"
+    )
+    watcher = watch.Watcher([config_file], use_inotify=False)
+    try:
+        watcher.refresh_configs()
+        assert list(watcher.configs) == [
+            (config_file, runs_dir / "run_1"),
+        ]
+        (runs_dir / "run_2").mkdir()
+        watcher.refresh_configs()
+        assert len(watcher.configs) == 2
+    finally:
+        watcher.scheduler.shutdown()
+
+
+def test_malformed_config_skipped(tmpdir):
+    source_dir, config = make_config(tmpdir)
+    (source_dir / "ready.txt").write_text("", "utf-8")
+    broken = tmpdir / "broken.conf"
+    broken.write_text("source = /data\nsource = /other\n", "utf-8")
+    watcher = watch.Watcher([config.config_file, broken], use_inotify=False)
+    watcher.refresh_configs()
+    assert list(watcher.configs) == [(config.config_file, None)]
+
+
+def test_pending_jobs_not_started_after_stop(tmpdir, monkeypatch):
+    _, config = make_config(tmpdir)
+    watcher = watch.Watcher([config.config_file], use_inotify=False)
+    started = []
+    monkeypatch.setattr(
+        watcher.scheduler.executor,
+        "submit",
+        lambda *args: started.append(args),
+    )
+    # Waiting for a free worker
+    watcher.scheduler.pending.append(SimpleNamespace(host=None))
+    watcher.stop()
+    watcher.run()
+    assert started == []
+    assert not watcher.scheduler.pending
@@ -9,6 +9,7 @@ def create_conf_file(
     tar="y",
     untar="y",
     create_dest="y",
+    extra_options=None,
 ):
     conf_file = source_dir / filename
     with open(conf_file, "w") as f:
@@ -21,6 +22,10 @@ def create_conf_file(
         if ready_file is not None:
             f.write(f"transfer_ready_file = {ready_file}\n")
 
+        if extra_options is not None:
+            for option, value in extra_options.items():
+                f.write(f"{option} = {value}\n")
+
     return conf_file
 
 